@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+"""Compare `group_devices` against `group_devices_pairwise` on synthetic device sets.
+
+Usage: ``python benchmarks/bench_device_grouping.py [--sizes 10 100 1000 10000]``
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import copy
+import random
+import timeit
+
+import logbook
+
+import stethoscope.api.devices
+
+
+SOURCES = ('jamf', 'landesk', 'google', 'bitfit')
+
+
+def synthetic_devices(count, seed=0):
+  """Generate `count` device entries describing roughly `count / 2.5` physical devices.
+
+  Each physical device is reported by one to four sources, each of which knows a different subset
+  of its identifiers (as is typical of real data); some entries carry a locally-administered MAC.
+  """
+  rng = random.Random(seed)
+  devices = list()
+  physical = 0
+  while len(devices) < count:
+    physical += 1
+    serial = 'C02{:08d}'.format(physical)
+    macaddrs = ['00:DE:{:02X}:{:02X}:{:02X}:{:02X}'.format((physical >> 16) & 0xFF,
+      (physical >> 8) & 0xFF, physical & 0xFF, nic) for nic in range(2)]
+    udid = 'UDID-{:08d}'.format(physical)
+
+    for source in rng.sample(SOURCES, rng.randint(1, len(SOURCES))):
+      identifiers = {}
+      if rng.random() < 0.8:
+        identifiers['serial'] = serial
+      if rng.random() < 0.7:
+        identifiers['mac_addresses'] = rng.sample(macaddrs, rng.randint(1, 2))
+        if rng.random() < 0.3:
+          identifiers['mac_addresses'].append('02:00:00:00:00:00')
+      if source == 'jamf':
+        identifiers['udid'] = udid
+      if source == 'google':
+        identifiers['google_device_id'] = 'gdid-{:d}'.format(physical)
+      devices.append({'source': source, 'identifiers': identifiers})
+  return devices[:count]
+
+
+def time_grouping(func, devices, repeat):
+  timer = timeit.Timer(lambda: func(devices))
+  return min(timer.repeat(repeat=repeat, number=1))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--pairwise-max', dest='pairwise_max', type=int, default=100,
+      help="""Skip the pairwise implementation for larger sizes (it is super-cubic).""")
+  args = parser.parse_args()
+
+  print("{:>8s} {:>8s} {:>14s} {:>14s} {:>10s}".format('devices', 'groups', 'pairwise (s)',
+    'indexed (s)', 'speedup'))
+  for size in args.sizes:
+    devices = synthetic_devices(size)
+    groups = stethoscope.api.devices.group_devices(devices)
+    indexed = time_grouping(stethoscope.api.devices.group_devices, devices, args.repeat)
+
+    if size <= args.pairwise_max:
+      # `group_devices_pairwise` updates the identifiers of the devices it groups
+      pairwise = time_grouping(stethoscope.api.devices.group_devices_pairwise,
+                               copy.deepcopy(devices), 1)
+      print("{:>8d} {:>8d} {:>14.4f} {:>14.4f} {:>9.1f}x".format(size, len(groups), pairwise,
+        indexed, pairwise / indexed))
+    else:
+      print("{:>8d} {:>8d} {:>14s} {:>14.4f} {:>10s}".format(size, len(groups), 'skipped',
+        indexed, '-'))
+
+
+if __name__ == "__main__":
+  with logbook.NullHandler():
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+"""Compare Duo authentication log storage: a single list scanned per lookup against `EventStore`.
+
+A synthetic authentication log (by default a million entries spread over 20,000 users) is parsed
+in pages, as it is retrieved from Duo's admin API. "list" keeps every event (with its `_raw` entry)
+in a single list and scans it for each lookup, as the ``duo`` plugin did; "store" keeps events
+(without `_raw`) in an `EventStore`, indexed by username. Memory is that held once the whole log
+has been added (as measured by `tracemalloc`, where available).
+
+Usage: ``python benchmarks/bench_duo_events.py [--entries 1000000] [--users 20000]``
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import gc
+import random
+import timeit
+
+import six
+
+from stethoscope.plugins.events import EventStore, get_event_id
+from stethoscope.plugins.sources.duo import utils as duo_utils
+
+try:
+  import tracemalloc
+except ImportError:  # python 2.x
+  tracemalloc = None
+
+
+FACTORS = ('Duo Push', 'Phone Call', 'Passcode', 'SMS Passcode')
+INTEGRATIONS = ('VPN', 'SSO', 'Workstation')
+PAGE_SIZE = 1000
+
+
+def auth_log_pages(entries, users, start=1500000000, seed=0):
+  """Generate a synthetic authentication log, a page at a time, in chronological order."""
+  rng = random.Random(seed)
+  page = list()
+  for idx in six.moves.range(entries):
+    page.append({
+      'timestamp': start + idx // 20,
+      'username': 'user{:d}'.format(rng.randrange(users)),
+      'factor': rng.choice(FACTORS),
+      'reason': 'User approved',
+      'result': 'SUCCESS' if rng.random() < 0.95 else 'FAILURE',
+      'ip': '10.{:d}.{:d}.{:d}'.format(rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+      'eventtype': 'authentication',
+      'device': '555-{:04d}'.format(rng.randrange(10000)),
+      'integration': rng.choice(INTEGRATIONS),
+      'new_enrollment': False,
+    })
+    if len(page) == PAGE_SIZE:
+      yield page
+      page = list()
+  if len(page) > 0:
+    yield page
+
+
+class ListEvents(object):
+  """All events in a single list, scanned for each lookup (as the ``duo`` plugin did)."""
+
+  def __init__(self):
+    self.events = list()
+
+  def add_page(self, page):
+    self.events.extend(duo_utils.parse_duo_auth_log(page, include_raw=True))
+
+  def get(self, username):
+    return [event for event in self.events if event['username'] == username]
+
+
+class StoreEvents(object):
+
+  def __init__(self):
+    self.store = EventStore(key=get_event_id)
+
+  def add_page(self, page):
+    for entry, event in zip(page, duo_utils.parse_duo_auth_log(page)):
+      self.store.add(entry['username'], entry['timestamp'], event)
+
+  def get(self, username):
+    return self.store.get(username)
+
+
+def build(cls, args):
+  gc.collect()
+  if tracemalloc is not None:
+    tracemalloc.start()
+  started = timeit.default_timer()
+  events = cls()
+  for page in auth_log_pages(args.entries, args.users):
+    events.add_page(page)
+  seconds = timeit.default_timer() - started
+  memory = None
+  if tracemalloc is not None:
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0] / float(1 << 20)
+    tracemalloc.stop()
+  return events, seconds, memory
+
+
+def run(name, cls, args, usernames):
+  """Build and time lookups against one kind of storage, returning the number of events found."""
+  events, seconds, memory = build(cls, args)
+  lookup = timeit.Timer(lambda: [events.get(username) for username in usernames]).timeit(
+    number=1) / len(usernames)
+  print("{:>8s} {:>10d} {:>12.1f} {:>12s} {:>12.3f}".format(name, args.entries, seconds,
+    '{:.0f}'.format(memory) if memory is not None else '-', lookup * 1000))
+  # the storage is released on return, before the next one is built (and measured)
+  return [len(events.get(username)) for username in usernames]
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--entries', type=int, default=1000000)
+  parser.add_argument('--users', type=int, default=20000)
+  parser.add_argument('--lookups', type=int, default=20)
+  args = parser.parse_args()
+
+  usernames = ['user{:d}'.format(idx) for idx in random.Random(1).sample(
+    six.moves.range(args.users), args.lookups)]
+
+  print("{:>8s} {:>10s} {:>12s} {:>12s} {:>12s}".format('storage', 'entries', 'build (s)',
+    'memory (MB)', 'lookup (ms)'))
+  results = dict()
+  for name, cls in (('list', ListEvents), ('store', StoreEvents)):
+    results[name] = run(name, cls, args, usernames)
+  assert results['list'] == results['store']
+
+
+if __name__ == "__main__":
+  main()
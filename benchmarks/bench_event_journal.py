@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+"""Compare the time from startup to the first Duo event query with and without an event journal.
+
+Without a journal (``DUO_EVENT_JOURNAL``), the first query backfills the whole retention window
+(12 hours) of the authentication log from Duo, a page of 1,000 entries per request; with one, the
+store is rebuilt by replaying the journal and only entries after the latest one journaled are
+requested. Duo is simulated locally, so "local (s)" excludes network time; "modelled (s)" adds
+``--request-latency`` seconds per request to Duo (whose admin API also limits how often the
+authentication log may be requested).
+
+Usage: ``python benchmarks/bench_event_journal.py [--entries 200000] [--request-latency 1.0]``
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import bisect
+import random
+import shutil
+import tempfile
+import time
+import timeit
+
+import six
+
+import stethoscope.plugins.sources.duo.base
+from stethoscope.plugins.sources.duo import utils as duo_utils
+
+
+class SimulatedAdmin(object):
+  """Serves a synthetic authentication log in pages, as `duo_client.Admin` does."""
+
+  def __init__(self, entries):
+    self.entries = entries
+    self.timestamps = [entry['timestamp'] for entry in entries]
+    self.requests = 0
+
+  def get_authentication_log(self, mintime):
+    self.requests += 1
+    start = bisect.bisect_left(self.timestamps, mintime)
+    return self.entries[start:start + duo_utils.DUO_BATCH_SIZE]
+
+
+class DuoDataSource(stethoscope.plugins.sources.duo.base.DuoDataSourceBase):
+
+  connection = None
+
+
+def auth_log(entries, users, end, seed=0):
+  rng = random.Random(seed)
+  start = end - stethoscope.plugins.sources.duo.base.DEFAULT_RETENTION + 60
+  span = end - start
+  return [{
+    'timestamp': start + idx * span // entries,
+    'username': 'user{:d}'.format(rng.randrange(users)),
+    'factor': 'Duo Push',
+    'reason': 'User approved',
+    'result': 'SUCCESS',
+    'ip': '10.{:d}.{:d}.{:d}'.format(rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+    'eventtype': 'authentication',
+    'device': '555-{:04d}'.format(rng.randrange(10000)),
+    'integration': 'VPN',
+    'new_enrollment': False,
+  } for idx in six.moves.range(entries)]
+
+
+def cold_start(config, admin):
+  """Return the time taken to start and answer the first query, and the requests made to Duo."""
+  admin.requests = 0
+  started = timeit.default_timer()
+  datasource = DuoDataSource(config)
+  datasource.connection = admin
+  datasource.get_events_by_email('user0@example.com')
+  seconds = timeit.default_timer() - started
+  if datasource.event_store.journal is not None:
+    datasource.event_store.journal.close()
+  return seconds, admin.requests
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--entries', type=int, default=200000)
+  parser.add_argument('--users', type=int, default=20000)
+  parser.add_argument('--request-latency', dest='request_latency', type=float, default=1.0)
+  args = parser.parse_args()
+
+  admin = SimulatedAdmin(auth_log(args.entries, args.users, int(time.time())))
+  config = {
+    'DUO_INTEGRATION_KEY': '',
+    'DUO_SECRET_KEY': '',
+    'DUO_API_HOSTNAME': '',
+  }
+  directory = tempfile.mkdtemp()
+  journaled = dict(config, DUO_EVENT_JOURNAL=directory)
+  try:
+    # populate the journal, as a previous run would have
+    cold_start(journaled, admin)
+
+    print("{:>10s} {:>10s} {:>10s} {:>10s} {:>13s}".format('start', 'entries', 'requests',
+      'local (s)', 'modelled (s)'))
+    for name, start_config in (('backfill', config), ('journal', journaled)):
+      seconds, requests = cold_start(start_config, admin)
+      print("{:>10s} {:>10d} {:>10d} {:>10.2f} {:>13.2f}".format(name, args.entries, requests,
+        seconds, seconds + requests * args.request_latency))
+  finally:
+    shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+  main()
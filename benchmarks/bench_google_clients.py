@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+"""Compare per-lookup latency of Google API calls with and without cached service objects.
+
+Builds the Admin SDK Directory API from a recorded discovery document (by default, the copy bundled
+with ``google-api-python-client``) and answers every request from a canned response, so only
+client-side overhead is measured.
+
+Usage: ``python benchmarks/bench_google_clients.py [--lookups 200] [--discovery-document PATH]``
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import io
+import json
+import os.path
+import timeit
+
+import googleapiclient
+import logbook
+from googleapiclient import discovery
+from googleapiclient import http as googlehttp
+
+import stethoscope.plugins.sources.google.deferred
+
+
+DEFAULT_DOCUMENT = os.path.join(os.path.dirname(googleapiclient.__file__), 'discovery_cache',
+    'documents', 'admin.directory_v1.json')
+
+RESPONSE = json.dumps({'primaryEmail': 'user@example.com', 'name': {'fullName': 'User'}})
+
+
+class RecordedHttp(googlehttp.HttpMock):
+  """`httplib2.Http` stand-in which answers every request with `RESPONSE`."""
+
+  def __init__(self):
+    googlehttp.HttpMock.__init__(self, headers={'status': '200'})
+    self.data = RESPONSE
+
+
+class RecordedCredentials(object):
+  """Stand-in for `oauth2client` credentials with an already-valid token."""
+
+  access_token = 'token'
+  access_token_expired = False
+
+  def authorize(self, http):
+    return http
+
+
+class RecordedGoogleDataSource(
+    stethoscope.plugins.sources.google.deferred.DeferredGoogleDataSource,
+  ):
+
+  def __init__(self, document):
+    super(RecordedGoogleDataSource, self).__init__({
+      'GOOGLE_API_SECRETS': {},
+      'GOOGLE_API_USERNAME': '',
+      'GOOGLE_API_SCOPES': [],
+    })
+    self.document = document
+    self._credentials = RecordedCredentials()
+
+  def connect(self, http=None):
+    return self.credentials.authorize(RecordedHttp())
+
+  def build_service(self, name, version, http):
+    return discovery.build_from_document(self.document, http=http)
+
+
+def lookup_uncached(source, email):
+  """Per-call connection and service object, as before caching was introduced."""
+  directory = source.build_service('admin', 'directory_v1', http=source.connect())
+  return directory.users().get(userKey=email).execute()
+
+
+def lookup_cached(source, email):
+  return source.service('admin', 'directory_v1').users().get(userKey=email).execute()
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--lookups', type=int, default=200)
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--discovery-document', dest='document', default=DEFAULT_DOCUMENT)
+  args = parser.parse_args()
+
+  with io.open(args.document, encoding='utf-8') as fi:
+    source = RecordedGoogleDataSource(fi.read())
+
+  print("{:>10s} {:>16s} {:>10s}".format('variant', 'per lookup (ms)', 'speedup'))
+  timings = dict()
+  for name, func in (('uncached', lookup_uncached), ('cached', lookup_cached)):
+    timer = timeit.Timer(lambda: func(source, 'user@example.com'))
+    timings[name] = min(timer.repeat(repeat=args.repeat, number=args.lookups)) / args.lookups
+  for name in ('uncached', 'cached'):
+    print("{:>10s} {:>16.3f} {:>9.1f}x".format(name, timings[name] * 1000,
+      timings['uncached'] / timings[name]))
+
+
+if __name__ == "__main__":
+  with logbook.NullHandler():
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+"""Compare per-rule scans of LANDESK vulnerabilities against single-pass `RuleSet` evaluation.
+
+Synthetic vulnerability tables mix ``Vul_ID``s, types and severities roughly as LANDESK reports
+them; `--extra-rules` adds further ``Vul_ID`` rules (e.g., for antivirus or agent checks) to show
+how each approach scales with the number of configured practices, and `--filtered` keeps only the
+vulnerabilities some rule matches, as the detail queries' SQL filter does. Both evaluators are timed
+once their memos (if any) are warm; the chosen column shows which one `RuleSet` uses by default.
+
+Usage: ``python benchmarks/bench_landesk_vulns.py [--sizes 10000 50000] [--extra-rules 0 3 10]``
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import random
+import timeit
+
+import six
+
+from stethoscope.plugins.sources.landesk import rules as landesk_rules
+
+
+TYPES = ('Vulnerability', 'Security Threat', 'Custom Definition', 'Software Updates')
+SEVERITIES = ('Critical', 'High', 'Medium', 'Low', 'Not Applicable', 'Unknown')
+
+
+def synthetic_vulns(count, seed=0):
+  """Generate `count` vulnerabilities (each `Vul_ID` appearing once, as for a single device)."""
+  rng = random.Random(seed)
+  vul_ids = ['MS-{:06d}'.format(idx) for idx in six.moves.range(count)]
+  for vul_id in ['ST000202', 'ST000003v2'] + ['AV-{:03d}'.format(av) for av in range(0, 100, 5)]:
+    vul_ids[rng.randrange(count)] = vul_id
+
+  vulns = list()
+  for vul_id in vul_ids:
+    vulns.append({
+      'Vul_ID': vul_id,
+      'VulType': rng.choice(TYPES),
+      'VulSeverity': rng.choice(SEVERITIES),
+      'Title': 'Title for {!s}'.format(vul_id),
+      'Reason': 'Reason for {!s}'.format(vul_id),
+    })
+  return vulns
+
+
+def get_rules(extra_rules):
+  rules = dict(landesk_rules.DEFAULT_RULES)
+  for idx in six.moves.range(extra_rules):
+    rules['extra-{:d}'.format(idx)] = {'vul_ids': ['AV-{:03d}'.format(idx)]}
+  return rules
+
+
+def time_evaluate(ruleset, vulns, repeat):
+  ruleset.evaluate(vulns)
+  return min(timeit.Timer(lambda: ruleset.evaluate(vulns)).repeat(repeat=repeat, number=1))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+  parser.add_argument('--extra-rules', dest='extra_rules', type=int, nargs='+',
+                      default=[0, 3, 10])
+  parser.add_argument('--filtered', action='store_true',
+      help="""Keep only vulnerabilities matched by some rule (as the SQL filter does).""")
+  parser.add_argument('--repeat', type=int, default=5)
+  args = parser.parse_args()
+
+  print("{:>8s} {:>6s} {:>14s} {:>14s} {:>10s} {:>12s}".format('vulns', 'rules', 'per-rule (ms)',
+    'single (ms)', 'speedup', 'chosen'))
+  for extra_rules in args.extra_rules:
+    rules = get_rules(extra_rules)
+    per_rule = landesk_rules.RuleSet(rules, single_pass=False)
+    single_pass = landesk_rules.RuleSet(rules, single_pass=True)
+    chosen = 'single' if landesk_rules.RuleSet(rules).single_pass else 'per-rule'
+    for size in args.sizes:
+      vulns = synthetic_vulns(size)
+      if args.filtered:
+        vulns = [vuln for vuln in vulns if single_pass.match(*landesk_rules._vuln_key(vuln))]
+      assert per_rule.evaluate(vulns) == single_pass.evaluate(vulns)
+
+      per_rule_time = time_evaluate(per_rule, vulns, args.repeat)
+      single_pass_time = time_evaluate(single_pass, vulns, args.repeat)
+      print("{:>8d} {:>6d} {:>14.2f} {:>14.2f} {:>9.1f}x {:>12s}".format(len(vulns), len(rules),
+        per_rule_time * 1000, single_pass_time * 1000, per_rule_time / single_pass_time, chosen))
+
+
+if __name__ == "__main__":
+  main()
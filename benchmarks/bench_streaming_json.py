@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+"""Compare buffering and decoding whole JSON responses against `StreamingJSONDecoder`.
+
+Synthetic multi-MB responses are built from the JAMF and bitfit fixtures: a full JAMF computer
+record (as requested with ``JAMF_SUBSET = False``) with thousands of applications, fonts and
+plugins, a JAMF advanced computer search covering a large fleet, and a bitfit user's asset list.
+Each is delivered in chunks (as `treq.collect` does); "buffered" joins the chunks and calls
+`json.loads` on the whole body (as `treq.content` and `json.loads` did), while "streaming" feeds
+each chunk to a decoder keeping only what the plugins read. "after last (ms)" is the decoding left
+to do once the last chunk has arrived; "peak (MB)" is the peak memory allocated while decoding.
+
+Usage: ``python benchmarks/bench_streaming_json.py [--scale 1 4] [--chunk-size 65536]``
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+import copy
+import json
+import timeit
+
+import six
+
+from stethoscope.plugins.sources.bitfit import base as bitfit_base
+from stethoscope.plugins.sources.jamf import base as jamf_base
+from stethoscope.plugins.streaming import StreamingJSONDecoder
+
+try:
+  import tracemalloc
+except ImportError:  # python 2.x
+  tracemalloc = None
+
+
+def jamf_record(scale):
+  with open('tests/fixtures/jamf/lgml-pfry.json') as fo:
+    record = json.load(fo)
+  computer = record['computer']
+  application = computer['software']['applications'][0]
+  computer['software']['applications'] = [dict(application, name='App {:d}.app'.format(idx),
+    path='/Applications/App {:d}.app'.format(idx)) for idx in six.moves.range(2000 * scale)]
+  computer['software']['fonts'] = [{'name': 'Font {:d}'.format(idx), 'path': '/Library/Fonts/x',
+    'version': '1.0'} for idx in six.moves.range(3000 * scale)]
+  computer['software']['plugins'] = [{'name': 'Plugin {:d}'.format(idx), 'path': '/Library/x',
+    'version': '2.0'} for idx in six.moves.range(1000 * scale)]
+  computer['certificates'] = [{'common_name': 'cert {:d}'.format(idx), 'identity': False,
+    'expires_utc': '2020-01-01T00:00:00.000+0000'} for idx in six.moves.range(500 * scale)]
+  return record
+
+
+def jamf_search(scale):
+  computers = list()
+  for idx in six.moves.range(20000 * scale):
+    computers.append({
+      'id': idx,
+      'name': 'lgml-{:d}'.format(idx),
+      'udid': '{:032x}'.format(idx),
+      'Email_Address': 'user{:d}@example.com'.format(idx),
+      'Username': 'user{:d}'.format(idx),
+      'Serial_Number': 'C02{:08d}'.format(idx),
+      'MAC_Address': '00:DE:CA:FB:AD:00',
+      'Alternate_MAC_Address': '',
+      'Department': 'Engineering',
+      'Building': 'Main',
+    })
+  return {'advanced_computer_search': {'id': 7, 'name': 'Stethoscope', 'computers': computers}}
+
+
+def bitfit_assets(scale):
+  with open('tests/fixtures/bitfit/asset_response_lgml-pfry.json') as fo:
+    asset = json.load(fo)['item']
+  items = list()
+  for idx in six.moves.range(200 * scale):
+    item = copy.deepcopy(asset)
+    item['id'] = idx
+    items.append(item)
+  return {'items': items, 'total': len(items)}
+
+
+def chunks(body, chunk_size):
+  return [body[start:start + chunk_size] for start in six.moves.range(0, len(body), chunk_size)]
+
+
+def buffered(parts, spec):
+  after = timeit.default_timer()
+  return json.loads(b''.join(parts).decode('utf-8')), after
+
+
+def streaming(parts, spec):
+  decoder = StreamingJSONDecoder(spec)
+  for part in parts:
+    decoder.feed(part)
+  after = timeit.default_timer()
+  return decoder.close(), after
+
+
+def measure(func, parts, spec, repeat):
+  best_total, best_after = None, None
+  for _ in six.moves.range(repeat):
+    started = timeit.default_timer()
+    _, after = func(parts, spec)
+    finished = timeit.default_timer()
+    if best_total is None or finished - started < best_total:
+      best_total, best_after = finished - started, finished - after
+
+  peak = None
+  if tracemalloc is not None:
+    tracemalloc.start()
+    func(parts, spec)
+    peak = tracemalloc.get_traced_memory()[1] / float(1 << 20)
+    tracemalloc.stop()
+  return best_total, best_after, peak
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--scale', type=int, nargs='+', default=[1, 4])
+  parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=1 << 16)
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+
+  practices = list(jamf_base.PRACTICE_SECTIONS)
+  cases = [
+    ('jamf record', jamf_record, jamf_base.get_device_spec(practices)),
+    ('jamf search', jamf_search, jamf_base.SEARCH_SPEC),
+    ('bitfit assets', bitfit_assets, bitfit_base.ASSETS_SPEC),
+  ]
+
+  print("{:>14s} {:>8s} {:>10s} {:>11s} {:>15s} {:>10s}".format('response', 'MB', 'decoder',
+    'total (ms)', 'after last (ms)', 'peak (MB)'))
+  for scale in args.scale:
+    for name, build, spec in cases:
+      body = json.dumps(build(scale)).encode('utf-8')
+      parts = chunks(body, args.chunk_size)
+      for label, func in (('buffered', buffered), ('streaming', streaming)):
+        total, after, peak = measure(func, parts, spec, args.repeat)
+        print("{:>14s} {:>8.1f} {:>10s} {:>11.1f} {:>15.1f} {:>10s}".format(name,
+          len(body) / float(1 << 20), label, total * 1000, after * 1000,
+          '{:.1f}'.format(peak) if peak is not None else '-'))
+
+
+if __name__ == "__main__":
+  main()
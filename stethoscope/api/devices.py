@@ -2,6 +2,7 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+import collections
 import copy
 import itertools
 import operator
@@ -138,7 +139,13 @@ def should_merge(groups):
   return False
 
 
-def group_devices(devices):
+def group_devices_pairwise(devices):
+  """Group devices by repeatedly rescanning all pairs of groups (see `should_merge`).
+
+  This is the original grouping implementation; it is retained as a reference for `group_devices`
+  and for benchmarking, but its cost grows faster than cubically in the number of devices. Note
+  that `should_merge` updates the identifiers of `devices` in place.
+  """
   # Start with each device in it's own group, then check if any two groups should be merged. If so,
   # merge them and recheck; if not, we're done.
   groups = [[device] for device in devices]
@@ -151,6 +158,119 @@ def group_devices(devices):
   return groups
 
 
+def _identifier_tokens(identifier_set):
+  """Yield hashable tokens for an identifier set for use as keys in an inverted index.
+
+  Two identifier sets share at least one token if and only if `compare_identifiers` returns `True`
+  for them.
+
+  >>> sorted(_identifier_tokens({'serial': '0xDECAFBAD', 'mac_addresses': []}))
+  [('serial', 'eq', '0xDECAFBAD'), ('serial', 'in', '0xDECAFBAD')]
+  >>> sorted(_identifier_tokens({'mac_addresses': ['02:00:00:00:00:00']}))
+  [('mac_addresses', 'eq', ('02:00:00:00:00:00',))]
+
+  """
+  for identifier, value in six.iteritems(identifier_set):
+    if len(value) == 0:
+      continue
+
+    # whole-value equality always matches (even for MAC addresses which would be filtered below)
+    if isinstance(value, six.string_types):
+      yield (identifier, 'eq', value)
+      values = [value]
+    else:
+      yield (identifier, 'eq', tuple(value))
+      values = value
+
+    if identifier == 'mac_addresses':
+      values = stethoscope.validation.filter_macaddrs(values)
+
+    for element in values:
+      yield (identifier, 'in', element)
+
+
+class _DisjointSets(object):
+  """Minimal union-find structure over the integers ``0`` to ``size - 1``.
+
+  >>> sets = _DisjointSets(4)
+  >>> sets.union(3, 1)
+  >>> [sets.find(idx) for idx in range(4)]
+  [0, 1, 2, 1]
+
+  """
+
+  def __init__(self, size):
+    self._parents = list(six.moves.range(size))
+
+  def find(self, idx):
+    root = idx
+    while self._parents[root] != root:
+      root = self._parents[root]
+    # path compression
+    while self._parents[idx] != root:
+      self._parents[idx], idx = root, self._parents[idx]
+    return root
+
+  def union(self, this, other):
+    this, other = self.find(this), self.find(other)
+    if this != other:
+      # the lowest index is always the root so that groups retain the order of the input
+      self._parents[max(this, other)] = min(this, other)
+
+
+def _merge_group_identifiers(this_identifiers, other_identifiers):
+  """Returns the combined identifiers of two groups, or `None` if they conflict.
+
+  Neither argument is modified.
+  """
+  try:
+    # shallow copy since `merge_identifiers` updates the first identifier set in place
+    return merge_identifiers([dict(this_identifiers), other_identifiers])
+  except MergeConflict:
+    logger.exception("merge conflict:\nthis:\n{:s}\nother:\n{:s}",
+                     json_pp(this_identifiers), json_pp(other_identifiers))
+    return None
+
+
+def group_devices(devices):
+  """Partition `devices` into groups of entries which describe the same physical device.
+
+  Two devices are linked if any of their identifiers match (as in `compare_identifiers`). Rather
+  than comparing every pair of devices, devices are indexed by identifier value so that only
+  devices sharing a value are ever compared; groups are tracked with a union-find structure. Two
+  groups are only joined if the combined identifiers of all of their devices do not conflict (as
+  in `merge_identifiers`), so that every group can be passed to `merge_device_group`.
+
+  Devices are linked in input order, each to the earliest compatible group it matches, as in
+  `group_devices_pairwise`. Groups (and the devices within each group) are returned in the order
+  in which they first appear in `devices`; `devices` is not modified.
+  """
+  index = collections.defaultdict(list)
+  sets = _DisjointSets(len(devices))
+  # combined identifiers of each group, kept at the group's root
+  identifiers = [device.get('identifiers', {}) for device in devices]
+
+  for idx, device in enumerate(devices):
+    tokens = set(_identifier_tokens(device.get('identifiers', {})))
+    matches = set(itertools.chain.from_iterable(index[token] for token in tokens))
+    for other_idx in sorted(matches):
+      this_root, other_root = sets.find(idx), sets.find(other_idx)
+      if this_root == other_root:
+        continue
+      merged = _merge_group_identifiers(identifiers[other_root], identifiers[this_root])
+      if merged is None:
+        continue
+      sets.union(this_root, other_root)
+      identifiers[sets.find(idx)] = merged
+    for token in tokens:
+      index[token].append(idx)
+
+  groups = collections.OrderedDict()
+  for idx, device in enumerate(devices):
+    groups.setdefault(sets.find(idx), []).append(device)
+  return list(groups.values())
+
+
 def merge_device_group(entries):
   if len(entries) > 1:
     logger.debug("merging devices:\n{!s}", pprint.pformat(entries, depth=4))
@@ -3,6 +3,7 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import functools
+import json
 import pprint
 import sys
 from itertools import chain
@@ -13,6 +14,7 @@ from twisted.internet import defer
 import stethoscope.api.devices
 import stethoscope.api.endpoints.utils
 import stethoscope.api.utils
+import stethoscope.plugins.cache
 import stethoscope.plugins.utils
 import stethoscope.validation
 from stethoscope.api.endpoints.utils import add_get_route, log_access, log_response
@@ -253,6 +255,16 @@ def register_device_api_endpoints(app, config, auth, log_hooks=[]):
     register_merged_device_endpoints(app, config, auth, device_plugins, apply_practices,
         transforms=transforms, log_hooks=log_hooks)
 
+  if config.get('ENABLE_CACHE_STATS_ENDPOINT', config['DEBUG']):
+    @auth.token_required
+    def __get_cache_stats(request, **_kwargs):
+      request.setHeader('Content-Type', 'application/json')
+      return json.dumps({
+        'predevices': stethoscope.plugins.cache.collect_stats(predevice_plugins),
+        'devices': stethoscope.plugins.cache.collect_stats(device_plugins),
+      })
+    app.route('/devices/cache', endpoint='devices-cache', methods=['GET'])(__get_cache_stats)
+
   # primary device api endpoint ('merged' or 'staged') which merges device data across all
   # device plugins (both initial and second-stage)
   @stethoscope.api.endpoints.utils.serialized_endpoint(apply_practices,
@@ -3,14 +3,15 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import functools
-import operator
-from itertools import chain
+import itertools
 
 import logbook
 from twisted.internet import defer
 
 import stethoscope.api.endpoints.utils
+import stethoscope.plugins.events
 import stethoscope.plugins.utils
+import stethoscope.utils
 import stethoscope.validation
 from stethoscope.api.endpoints.utils import add_get_route, log_access, log_response
 
@@ -19,27 +20,40 @@ logger = logbook.Logger(__name__)
 
 
 def sort_events(events):
-  return sorted(events, key=operator.itemgetter('timestamp'), reverse=True)
+  return sorted(events, key=stethoscope.plugins.events.get_sort_key, reverse=True)
 
 
-def merge_events(events):
-  return sort_events(chain.from_iterable(_events for (status, _events) in events if status))
+def merge_events(events, limit=None):
+  """Merge the events from each source into a single list (of at most `limit` events), most recent
+  first.
 
+  Each source returns its events most recent first, so rather than sorting all events together, the
+  sources' events are merged lazily and only the events returned are visited.
+  """
+  merged = stethoscope.utils.merge_sorted([_events for (status, _events) in events if status],
+    key=stethoscope.plugins.events.get_sort_key, reverse=True)
+  return list(itertools.islice(merged, limit))
 
-def get_events_by_email(email, extensions):
+
+def get_events_by_email(email, extensions, before=None, limit=None):
+  """Request events from each source, passing on the page bounds (`before` and `limit`), if any."""
+  kwargs = dict((key, value) for key, value in (('before', before), ('limit', limit))
+                if value is not None)
   deferreds = []
   for ext in extensions:
-    deferred = ext.obj.get_events_by_email(email)
+    deferred = ext.obj.get_events_by_email(email, **kwargs)
     deferred.addCallback(functools.partial(log_response, 'event', ext.name))
     deferreds.append(deferred)
 
   return defer.DeferredList(deferreds, consumeErrors=True)
 
 
-@stethoscope.api.endpoints.utils.serialized_endpoint(merge_events)
-def merged_events(*args, **kwargs):
-  """Endpoint returning (as JSON) all events after merging."""
-  return get_events_by_email(*args, **kwargs)
+@stethoscope.api.endpoints.utils.serialized_endpoint()
+def merged_events(email, extensions, before=None, limit=None):
+  """Endpoint returning (as JSON) all events (or a page of them) after merging."""
+  deferred = get_events_by_email(email, extensions, before=before, limit=limit)
+  deferred.addCallback(merge_events, limit=limit)
+  return deferred
 
 
 def register_event_api_endpoints(app, config, auth, log_hooks=[]):
@@ -58,6 +72,7 @@ def register_event_api_endpoints(app, config, auth, log_hooks=[]):
   @stethoscope.validation.check_valid_email
   def _merged_events(request, email, **_kwargs):
     userinfo = _kwargs.pop('userinfo')
+    before, limit = stethoscope.api.endpoints.utils.get_page_args(request)
 
     # required so that app.route can get a '__name__' attribute from decorated function
     _kwargs['callbacks'] = [hook.obj.transform for hook in hooks] + [
@@ -65,6 +80,6 @@ def register_event_api_endpoints(app, config, auth, log_hooks=[]):
       functools.partial(log_access, 'event', userinfo, email, context='merged'),
     ] + [functools.partial(hook.obj.log, 'event', userinfo, email, context='merged')
         for hook in log_hooks]
-    return merged_events(request, email, event_plugins, **_kwargs)
+    return merged_events(request, email, event_plugins, before=before, limit=limit, **_kwargs)
   app.route('/events/merged/<string:email>', endpoint='events-merged',
       methods=['GET'])(_merged_events)
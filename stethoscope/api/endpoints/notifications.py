@@ -3,13 +3,14 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import functools
-from itertools import chain
+import itertools
 
 import logbook
 from twisted.internet import defer
 
 import stethoscope.api.endpoints.utils
 import stethoscope.plugins.utils
+import stethoscope.utils
 import stethoscope.validation
 from stethoscope.api.endpoints.utils import add_get_route, log_access, log_response
 
@@ -17,32 +18,49 @@ from stethoscope.api.endpoints.utils import add_get_route, log_access, log_respo
 logger = logbook.Logger(__name__)
 
 
+def get_sort_key(notification):
+  """Return the key by which notifications are sorted: the timestamp (which plugins provide as
+  ``_source.event_timestamp``) and then, for notifications with the same timestamp, the ``_id``."""
+  return notification['_source']['event_timestamp'], notification.get('_id') or ''
+
+
 def sort_notifications(notifications):
   # TODO: replace with generic version
-  def get_timestamp(notification):
-    return notification['_source']['event_timestamp']
-  return sorted(notifications, key=get_timestamp, reverse=True)
+  return sorted(notifications, key=get_sort_key, reverse=True)
+
 
+def merge_notifications(notifications, limit=None):
+  """Merge the notifications from each source into a single list (of at most `limit`
+  notifications), most recent first.
 
-def merge_notifications(notifications):
-  return sort_notifications(chain.from_iterable(notifs for (status, notifs) in notifications if
-    status))
+  Each source returns its notifications most recent first, so they are merged lazily rather than
+  sorted all together.
+  """
+  merged = stethoscope.utils.merge_sorted([notifs for (status, notifs) in notifications if status],
+    key=get_sort_key, reverse=True)
+  return list(itertools.islice(merged, limit))
 
 
-def get_notifications_by_email(email, extensions):
+def get_notifications_by_email(email, extensions, before=None, limit=None):
+  """Request notifications from each source, passing on the page bounds (`before` and `limit`), if
+  any."""
+  kwargs = dict((key, value) for key, value in (('before', before), ('limit', limit))
+                if value is not None)
   deferreds = []
   for ext in extensions:
-    deferred = ext.obj.get_notifications_by_email(email)
+    deferred = ext.obj.get_notifications_by_email(email, **kwargs)
     deferred.addCallback(functools.partial(log_response, 'notifications', ext.name))
     deferreds.append(deferred)
 
   return defer.DeferredList(deferreds, consumeErrors=True)
 
 
-@stethoscope.api.endpoints.utils.serialized_endpoint(merge_notifications)
-def merged_notifications(*args, **kwargs):
-  """Endpoint returning (as JSON) all notifications after merging."""
-  return get_notifications_by_email(*args, **kwargs)
+@stethoscope.api.endpoints.utils.serialized_endpoint()
+def merged_notifications(email, extensions, before=None, limit=None):
+  """Endpoint returning (as JSON) all notifications (or a page of them) after merging."""
+  deferred = get_notifications_by_email(email, extensions, before=before, limit=limit)
+  deferred.addCallback(merge_notifications, limit=limit)
+  return deferred
 
 
 def register_notification_api_endpoints(app, config, auth, log_hooks=[]):
@@ -58,6 +76,7 @@ def register_notification_api_endpoints(app, config, auth, log_hooks=[]):
   @stethoscope.validation.check_valid_email
   def _merged_notifications(request, email, **_kwargs):
     userinfo = _kwargs.pop('userinfo')
+    before, limit = stethoscope.api.endpoints.utils.get_page_args(request)
 
     # required so that app.route can get a '__name__' attribute from decorated function
     _kwargs['callbacks'] = [
@@ -65,6 +84,7 @@ def register_notification_api_endpoints(app, config, auth, log_hooks=[]):
       functools.partial(log_access, 'notification', userinfo, email, context='merged'),
     ] + [functools.partial(hook.obj.log, 'notification', userinfo, email, context='merged')
         for hook in log_hooks]
-    return merged_notifications(request, email, notification_plugins, **_kwargs)
+    return merged_notifications(request, email, notification_plugins, before=before, limit=limit,
+                                **_kwargs)
   app.route('/notifications/merged/<string:email>', endpoint='notifications-merged',
       methods=['GET'])(_merged_notifications)
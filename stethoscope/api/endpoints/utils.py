@@ -6,6 +6,7 @@ import functools
 import json
 import pprint
 
+import arrow
 import logbook
 import six
 import werkzeug.exceptions
@@ -49,6 +50,43 @@ def log_post_error(name, extension_name, result):
   return result
 
 
+def get_page_args(request):
+  """Return the page cursor (a `stethoscope.utils.PageCursor`, from the ``before`` and ``before_id``
+  query parameters) and ``limit`` of `request`.
+
+  Together, these page through records sorted most recent first (and by id, for records with the
+  same timestamp): ``limit`` bounds the number of records returned. ``before`` (an ISO 8601
+  timestamp) excludes records from that time onward. To resume after the last record of the
+  previous page, pass its timestamp as ``before`` and its id as ``before_id``: records at that
+  timestamp which sort after the id are then kept. ``before_id`` is only meaningful together with
+  ``before``. Either result is `None` if not given.
+  """
+  args = getattr(request, 'args', None) or {}
+
+  before = args.get(b'before')
+  before_id = args.get(b'before_id')
+  if before is not None:
+    try:
+      timestamp = arrow.get(before[0].decode('utf-8'))
+    except (ValueError, TypeError, arrow.parser.ParserError):
+      raise werkzeug.exceptions.BadRequest("invalid 'before' timestamp")
+    before = stethoscope.utils.PageCursor(timestamp,
+        before_id[0].decode('utf-8') if before_id is not None else None)
+  elif before_id is not None:
+    raise werkzeug.exceptions.BadRequest("'before_id' requires 'before'")
+
+  limit = args.get(b'limit')
+  if limit is not None:
+    try:
+      limit = int(limit[0])
+    except ValueError:
+      limit = 0
+    if limit < 1:
+      raise werkzeug.exceptions.BadRequest("'limit' must be a positive integer")
+
+  return before, limit
+
+
 def add_post_route(ext, app, config, auth, csrf, name, **kwargs):
   method_name = 'post_' + name
   if not hasattr(ext.obj, method_name):
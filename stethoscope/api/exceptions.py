@@ -36,6 +36,9 @@ class InvalidResponseException(werkzeug.exceptions.BadGateway):
   """The raising plugin received an invalid HTTP response code from the external service."""
 
   def __init__(self, response_code, service=None, resource=None):
+    self.response_code = response_code
+    self.service = service
+    self.resource = resource
     msg = ("received invalid response code ({!s}) for {!r} from {!r}"
            "".format(response_code, resource, service))
     super(InvalidResponseException, self).__init__(msg)
@@ -12,6 +12,7 @@ from twisted.internet import defer
 
 import stethoscope.auth
 import stethoscope.csrf
+import stethoscope.plugins.pool
 import stethoscope.plugins.utils
 import stethoscope.utils
 from stethoscope.api.endpoints.accounts import register_account_api_endpoints
@@ -80,7 +81,8 @@ def register_endpoints(app, config, auth, csrf):
   def healthcheck(request):
     upstream = 'http://{!s}/healthcheck'.format(os.getenv("STETHOSCOPE_LOGIN_HOST",
       "127.0.0.1:5002"))
-    deferred = treq.get(upstream, timeout=0.1, headers={'Host': request.getHost().host})
+    deferred = treq.get(upstream, timeout=0.1, headers={'Host': request.getHost().host},
+        pool=stethoscope.plugins.pool.get_pool('healthcheck', config))
     deferred.addCallback(check_upstream_response, request)
     deferred.addErrback(handle_upstream_error, request)
     return deferred
@@ -23,6 +23,10 @@ class RESTfulSummary(
   """Plugin to summarize and report devices via REST API."""
 
   def transform_to_snapshot(self, devices_by_email):
+    """Return the recently-synced devices from `devices_by_email` (a `dict` or `DeviceSpool`).
+
+    A `DeviceSpool` is read one user at a time, so only the snapshot itself is held in memory.
+    """
     since = arrow.utcnow().replace(days=-14)
 
     snapshot = list()
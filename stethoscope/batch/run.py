@@ -4,6 +4,9 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 import argparse
 import collections
+import sys
+import zlib
+from itertools import chain
 
 import arrow
 import logbook
@@ -13,6 +16,10 @@ from twisted.internet import defer, task
 
 import stethoscope.api.endpoints.devices
 import stethoscope.api.factory
+import stethoscope.api.utils
+import stethoscope.batch.spool
+import stethoscope.plugins.cache
+import stethoscope.plugins.pool
 import stethoscope.plugins.utils
 import stethoscope.utils
 
@@ -52,6 +59,8 @@ def augment_devices(devices, email):
 def gather_statistics(devices_by_user):
   """Gather aggregate statistics on device status from given devices.
 
+  `devices_by_user` may be a `dict` or a `DeviceSpool`; the latter is read one user at a time.
+
   >>> user = [{'practices': {'foo': {'status': 'warn'}, 'bar': {'status': 'nudge'}}}]
   >>> expected = {'foo': {'warn': 2}, 'bar': {'nudge': 2}}
   >>> expected == gather_statistics({'user_a': user, 'user_b': user})
@@ -66,6 +75,38 @@ def gather_statistics(devices_by_user):
   return dict((key, dict(val)) for key, val in six.iteritems(counts))
 
 
+def parse_shard(value):
+  """Parse a shard specification of the form ``i/n`` (with ``0 <= i < n``).
+
+  >>> parse_shard('1/4')
+  (1, 4)
+
+  """
+  try:
+    index, count = (int(part) for part in value.split('/'))
+  except ValueError:
+    raise argparse.ArgumentTypeError("shard must be of the form i/n; got {!r}".format(value))
+  if not 0 <= index < count:
+    raise argparse.ArgumentTypeError("shard index must be in [0, {:d}); got {:d}".format(count,
+      index))
+  return index, count
+
+
+def in_shard(email, shard):
+  """Return whether `email` belongs to the given ``(index, count)`` shard.
+
+  Assignment depends only on the email address (not its position in the list of emails), so
+  separate processes agree on it even if they retrieve their lists in different orders.
+
+  >>> emails = ['user{:d}@example.com'.format(idx) for idx in range(100)]
+  >>> sum(in_shard(email, (idx, 3)) for email in emails for idx in range(3))
+  100
+
+  """
+  index, count = shard
+  return zlib.crc32(email.lower().encode('utf-8')) % count == index
+
+
 def wrap_hook(func):
   def _hook(devices, *args, **kwargs):
     func(devices, *args, **kwargs)
@@ -73,7 +114,46 @@ def wrap_hook(func):
   return _hook
 
 
-def work_generator(args, config, emails, results):
+def prefetch_devices(plugins, emails):
+  """Have plugins which support bulk retrieval (via `prefetch_devices`) fetch data up front."""
+  deferreds = list()
+  for plugin in plugins:
+    if hasattr(plugin.obj, 'prefetch_devices'):
+      logger.info("prefetching devices from {!s} for {:d} users", plugin.name, len(emails))
+      deferreds.append(plugin.obj.prefetch_devices(emails))
+
+  # failures just mean falling back to per-user lookups
+  deferred_list = defer.DeferredList(deferreds, consumeErrors=True)
+  deferred_list.addCallback(stethoscope.api.utils.filter_by_status,
+      context=sys._getframe().f_code.co_name, level=logbook.WARNING)
+  return deferred_list
+
+
+def finish_plugins(plugins):
+  """Have plugins which keep state across runs (via `save_state`) save it, and log their stats."""
+  for plugin in plugins:
+    if hasattr(plugin.obj, 'save_state'):
+      try:
+        plugin.obj.save_state()
+      except Exception:
+        logger.exception("failed to save state for {!s}", plugin.name)
+
+  for name, stats in six.iteritems(stethoscope.plugins.cache.collect_stats(plugins)):
+    logger.info("[{!s}] lookup stats: {!r}", name, stats)
+
+
+def after(deferred):
+  """Return a new `Deferred` which fires (with `None`) once `deferred` has fired."""
+  waiting = defer.Deferred()
+
+  def _fire(result):
+    waiting.callback(None)
+    return result
+  deferred.addBoth(_fire)
+  return waiting
+
+
+def work_generator(args, config, emails, results, plugins=None):
   practices = stethoscope.plugins.utils.instantiate_practices(config,
       namespace='stethoscope.plugins.practices.devices')
 
@@ -90,14 +170,22 @@ def work_generator(args, config, emails, results):
       namespace='stethoscope.plugins.sources.devices')
   predevice_plugins = stethoscope.plugins.utils.instantiate_plugins(config,
       namespace='stethoscope.plugins.sources.predevices')
+  if plugins is not None:
+    plugins.extend(chain(predevice_plugins, device_plugins))
 
   hook_iter = stethoscope.plugins.utils.instantiate_plugins(config,
       namespace='stethoscope.batch.plugins.incremental')
   incremental_hooks = [wrap_hook(hook.obj.post) for hook in hook_iter]
 
+  if args.prefetch:
+    prefetched = prefetch_devices(chain(predevice_plugins, device_plugins), emails)
+  else:
+    prefetched = defer.succeed(None)
+
   for email in emails:
-    deferred = stethoscope.api.endpoints.devices.get_devices_by_stages(email, predevice_plugins,
-        device_plugins, transforms)
+    deferred = after(prefetched)
+    deferred.addCallback(lambda _, _email: stethoscope.api.endpoints.devices.get_devices_by_stages(
+      _email, predevice_plugins, device_plugins, transforms), email)
     deferred.addCallback(stethoscope.api.endpoints.devices.apply_device_transforms, transforms)
     deferred.addCallback(apply_practices)
     deferred.addCallback(stethoscope.api.devices.merge_devices)
@@ -133,20 +221,41 @@ def _main(reactor, args, config):
     emails = config['BATCH_GET_EMAILS']()
   else:
     emails = [email.strip().strip('"') for email in args.input.readlines()]
+
+  if args.shard is not None:
+    emails = [email for email in emails if in_shard(email, args.shard)]
+    logger.info("shard {:d}/{:d}: {:d} users", args.shard[0], args.shard[1], len(emails))
+
+  if args.spool is None:
+    results = dict()
+  else:
+    # stream each user's devices to disk rather than holding the whole fleet in memory
+    results = stethoscope.batch.spool.DeviceSpool(args.spool, resume=args.resume)
+    logger.info("spooling devices to {!s}", args.spool)
+    if args.resume:
+      remaining = [email for email in emails if email not in results]
+      logger.info("skipping {:d} users completed by a previous run", len(emails) - len(remaining))
+      emails = remaining
+
   logger.info("retrieving devices for {:d} users", len(emails))
 
-  results = dict()
   deferreds = list()
+  plugins = list()
   cooperator = task.Cooperator()
-  work = work_generator(args, config, emails, results)
+  work = work_generator(args, config, emails, results, plugins)
   for idx in six.moves.range(args.limit):
     deferreds.append(cooperator.coiterate(work))
 
   deferred = defer.gatherResults(deferreds)
 
   def log_results(_):
-    num_devices = sum(len(values) for values in six.itervalues(results))
-    logger.info("retrieved {:d} unique devices for {:d} users", num_devices, len(emails))
+    if isinstance(results, stethoscope.batch.spool.DeviceSpool):
+      # includes users completed by previous (resumed) runs
+      num_devices, num_users = results.num_devices, len(results)
+    else:
+      num_devices = sum(len(values) for values in six.itervalues(results))
+      num_users = len(emails)
+    logger.info("retrieved {:d} unique devices for {:d} users", num_devices, num_users)
     return _
   deferred.addCallback(log_results)
 
@@ -157,6 +266,24 @@ def _main(reactor, args, config):
         return _
       deferred.addCallback(_hook)
 
+  if isinstance(results, stethoscope.batch.spool.DeviceSpool):
+    def close_spool(_):
+      results.close()
+      return _
+    deferred.addBoth(close_spool)
+
+  def _finish_plugins(_):
+    finish_plugins(plugins)
+    return _
+  deferred.addBoth(_finish_plugins)
+
+  def close_pools(_):
+    # close persistent connections so the reactor can shut down cleanly
+    deferred = stethoscope.plugins.pool.close_pools()
+    deferred.addCallback(lambda __: _)
+    return deferred
+  deferred.addBoth(close_pools)
+
   return deferred
 
 
@@ -173,10 +300,24 @@ def main():
   parser.add_argument('input', nargs='?', type=argparse.FileType('r'), default=None)
 
   parser.add_argument('--collect-only', dest="collect_only", action="store_true")
+  parser.add_argument('--spool', dest="spool", default=None,
+      help="""Write each user's devices to this file (as JSON Lines) as they are retrieved instead
+      of holding all devices in memory; summary hooks then read the file incrementally.""")
+  parser.add_argument('--resume', dest="resume", action="store_true", default=False,
+      help="""Reuse the spool (and its journal) from a previous run, skipping users it completed.
+      Requires --spool.""")
+  parser.add_argument('--shard', dest="shard", type=parse_shard, default=None,
+      help="""Process only the i-th of n disjoint subsets of users (given as i/n, with 0 <= i < n),
+      so that n processes (each with its own spool) can split a run.""")
+  parser.add_argument('--no-prefetch', dest="prefetch", action="store_false", default=True,
+      help="""Don't let plugins which support it retrieve data for all users up front; look up
+      each user individually instead.""")
   parser.add_argument('--debug', dest="debug", action="store_true", default=False)
 
   config = stethoscope.api.factory.get_config()
   args = parser.parse_args()
+  if args.resume and args.spool is None:
+    parser.error("--resume requires --spool")
 
   for plugin in ['BITFIT', 'JAMF']:
     config[plugin + '_TIMEOUT'] = args.timeout
@@ -0,0 +1,154 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+import io
+import json
+import os
+
+import logbook
+import six
+
+import stethoscope.utils
+
+
+logger = logbook.Logger(__name__)
+
+
+def read_journal(path):
+  """Return an ordered mapping of email to ``(offset, length, num_devices)`` from a spool journal.
+
+  Missing journals are treated as empty. A truncated final line (e.g., from a crash part-way
+  through writing it) is ignored.
+  """
+  completed = collections.OrderedDict()
+  if not os.path.exists(path):
+    return completed
+  with io.open(path, 'r', encoding='utf-8') as fi:
+    for line in fi:
+      if not line.strip():
+        continue
+      try:
+        record = json.loads(line)
+      except ValueError:
+        logger.warning("ignoring malformed journal entry in {!s}: {!r}", path, line)
+        continue
+      completed[record['email']] = (record['offset'], record['length'], record['num_devices'])
+  return completed
+
+
+class DeviceSpool(object):
+  """On-disk, append-only store of each user's devices in JSON Lines format.
+
+  A `DeviceSpool` can stand in for the `dict` of devices keyed by email which the batch process
+  otherwise accumulates in memory: assigning ``spool[email] = devices`` appends a line to the file
+  and `items` (and `values`) read the file back one line (i.e., one user) at a time. Memory use is
+  therefore bounded by the largest single user's devices rather than by the whole fleet.
+
+  Each write is checkpointed in a journal (at ``path + '.journal'``) recording the user's email and
+  the location of their record in the spool. With ``resume=True``, an existing spool and journal
+  are reopened rather than overwritten: anything in the spool beyond the last journaled record
+  (i.e., a write interrupted by a crash) is discarded, and `completed` lists the users already
+  processed, so that a rerun need only process the remaining users.
+
+  >>> import os, tempfile
+  >>> path = os.path.join(tempfile.mkdtemp(), 'devices.jsonl')
+  >>> with DeviceSpool(path) as spool:
+  ...   spool['user@example.com'] = [{'serial': 'C02'}]
+  ...   [(email, devices) for email, devices in spool.items()]
+  [('user@example.com', [{'serial': 'C02'}])]
+  >>> with DeviceSpool(path, resume=True) as spool:
+  ...   list(spool.completed), spool['user@example.com']
+  (['user@example.com'], [{'serial': 'C02'}])
+  >>> len(spool), spool.num_devices
+  (1, 1)
+
+  """
+
+  def __init__(self, path, resume=False):
+    self.path = path
+    self.journal_path = path + '.journal'
+
+    if resume and os.path.exists(path):
+      self.completed = read_journal(self.journal_path)
+      end = max([offset + length for offset, length, _ in six.itervalues(self.completed)] or [0])
+      self._file = io.open(path, 'r+b')
+      self._file.truncate(end)
+      self._file.seek(end)
+      self._journal = io.open(self.journal_path, 'a', encoding='utf-8')
+      if self._journal.tell() > 0:
+        # terminate any partially-written final entry so that new entries start on their own line
+        self._journal.write('\n')
+      logger.info("resuming {!s}: {:d} users already completed", path, len(self.completed))
+    else:
+      self.completed = collections.OrderedDict()
+      self._file = io.open(path, 'wb')
+      self._journal = io.open(self.journal_path, 'w', encoding='utf-8')
+
+    self.num_devices = sum(num_devices for _, _, num_devices in six.itervalues(self.completed))
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def __len__(self):
+    return len(self.completed)
+
+  def __contains__(self, email):
+    return email in self.completed
+
+  def __setitem__(self, email, devices):
+    self.write(email, devices)
+
+  def __getitem__(self, email):
+    offset, length, _ = self.completed[email]
+    self.flush()
+    with io.open(self.path, 'rb') as fi:
+      fi.seek(offset)
+      return stethoscope.utils.json_loads_line(fi.read(length).decode('utf-8'))['devices']
+
+  def write(self, email, devices):
+    """Append `devices` for the user with the given `email` to the spool and checkpoint it."""
+    line = stethoscope.utils.json_dumps_line({'email': email, 'devices': devices}) + '\n'
+    line = line.encode('utf-8')
+    offset = self._file.tell()
+    self._file.write(line)
+    # the record must be on disk before the journal claims it is
+    self._file.flush()
+
+    self.completed[email] = (offset, len(line), len(devices))
+    self.num_devices += len(devices)
+    self._journal.write(six.text_type(json.dumps({'email': email, 'offset': offset,
+      'length': len(line), 'num_devices': len(devices)})))
+    self._journal.write('\n')
+    self._journal.flush()
+    return devices
+
+  def flush(self):
+    if not self._file.closed:
+      self._file.flush()
+
+  def close(self):
+    for fo in (self._file, self._journal):
+      if not fo.closed:
+        fo.close()
+
+  def items(self):
+    """Yield ``(email, devices)`` for each user in the spool, in the order they were written."""
+    self.flush()
+    with io.open(self.path, 'rb') as fi:
+      for line in fi:
+        if line.strip():
+          record = stethoscope.utils.json_loads_line(line.decode('utf-8'))
+          yield record['email'], record['devices']
+
+  def values(self):
+    for _, devices in self.items():
+      yield devices
+
+  # python 2.x spellings, used by `six.iteritems` and `six.itervalues`
+  iteritems = items
+  itervalues = values
@@ -0,0 +1,248 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+import copy
+import functools
+import sys
+
+import logbook
+import six
+from twisted.internet import defer
+
+import stethoscope.api.exceptions
+import stethoscope.plugins.singleflight
+
+
+logger = logbook.Logger(__name__)
+
+# plugin methods wrapped by `wrap_lookups`
+LOOKUP_METHODS = (
+  'get_devices_by_email',
+  'get_devices_by_serial',
+  'get_devices_by_macaddr',
+)
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+
+def approximate_size(obj):
+  """Return an approximation (in bytes) of the memory used by `obj` and everything it contains.
+
+  >>> approximate_size([]) < approximate_size(['foo'])
+  True
+  >>> approximate_size({'foo': ['bar', 'baz']}) > approximate_size({'foo': []})
+  True
+
+  """
+  seen = set()
+  pending = [obj]
+  size = 0
+  while pending:
+    item = pending.pop()
+    if id(item) in seen:
+      continue
+    seen.add(id(item))
+    size += sys.getsizeof(item)
+    if isinstance(item, dict):
+      pending.extend(six.iterkeys(item))
+      pending.extend(six.itervalues(item))
+    elif isinstance(item, (list, tuple, set, frozenset)):
+      pending.extend(item)
+  return size
+
+
+class _Entry(object):
+
+  __slots__ = ('value', 'failure', 'size', 'stored_at')
+
+  def __init__(self, value, failure, size, stored_at):
+    self.value = value
+    self.failure = failure
+    self.size = size
+    self.stored_at = stored_at
+
+
+class DeferredCache(object):
+  """LRU cache for the results of functions returning `Deferred`s.
+
+  Entries are fresh for `ttl` seconds after they are stored, during which they are served without
+  calling the underlying function. For a further `stale_ttl` seconds, the stale entry is still
+  served but a refresh is started in the background (stale-while-revalidate). Concurrent misses for
+  the same key share a single call to the underlying function (see `SingleFlight`).
+  Least-recently-used entries are evicted once the approximate size of all entries exceeds
+  `max_bytes`.
+
+  Successful results are cached, as are `NotFoundException` failures (since "no such user" is a
+  common and stable answer); any other failure is passed through without being cached.
+
+  Every caller receives its own deep copy of the cached value, so callers are free to modify it.
+  """
+
+  def __init__(self, ttl, stale_ttl=0, max_bytes=DEFAULT_MAX_BYTES, clock=None, name=None,
+               single_flight=None):
+    if clock is None:
+      from twisted.internet import reactor as clock
+    self.ttl = ttl
+    self.stale_ttl = stale_ttl
+    self.max_bytes = max_bytes
+    self.clock = clock
+    self.name = name
+    self.single_flight = single_flight or stethoscope.plugins.singleflight.SingleFlight(name)
+
+    self._entries = collections.OrderedDict()
+    self._bytes = 0
+    self.counts = collections.Counter()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def stats(self):
+    """Return a `dict` of counters (hits, misses, stale hits, etc.) and the cache's current size."""
+    stats = dict((key, 0) for key in ('hits', 'misses', 'stale', 'evictions'))
+    stats.update(self.counts)
+    stats['coalesced'] = self.single_flight.counts['coalesced']
+    stats['entries'] = len(self._entries)
+    stats['bytes'] = self._bytes
+    stats['max_bytes'] = self.max_bytes
+    return stats
+
+  def get(self, key, func, *args, **kwargs):
+    """Return a `Deferred` firing with the (possibly cached) result of `func(*args, **kwargs)`."""
+    entry = self._entries.get(key)
+    if entry is not None:
+      age = self.clock.seconds() - entry.stored_at
+      if age < self.ttl:
+        self.counts['hits'] += 1
+        self._touch(key)
+        return self._replay(entry)
+      if age < self.ttl + self.stale_ttl:
+        self.counts['stale'] += 1
+        self._touch(key)
+        if key not in self.single_flight:
+          self.single_flight.call(key, self._load, key, func, *args, **kwargs) \
+              .addErrback(self._log_refresh_failure, key)
+        return self._replay(entry)
+      self._discard(key)
+
+    if key not in self.single_flight:
+      self.counts['misses'] += 1
+    return self.single_flight.call(key, self._load, key, func, *args, **kwargs)
+
+  def invalidate(self, key=None):
+    """Drop the entry for `key` (or all entries if `key` is `None`)."""
+    if key is None:
+      self._entries.clear()
+      self._bytes = 0
+    else:
+      self._discard(key)
+
+  def _load(self, key, func, *args, **kwargs):
+    deferred = defer.maybeDeferred(func, *args, **kwargs)
+    deferred.addCallbacks(self._store_result, self._store_failure, callbackArgs=(key,),
+        errbackArgs=(key,))
+    return deferred
+
+  def _store_result(self, result, key):
+    self._store(key, _Entry(result, None, approximate_size(result), self.clock.seconds()))
+    return copy.deepcopy(result)
+
+  def _store_failure(self, failure, key):
+    if failure.check(stethoscope.api.exceptions.NotFoundException):
+      # keep only the exception itself (not the traceback) for replaying
+      self._store(key, _Entry(None, failure.value, approximate_size(failure.value),
+        self.clock.seconds()))
+    return failure
+
+  def _replay(self, entry):
+    if entry.failure is not None:
+      return defer.fail(entry.failure)
+    return defer.succeed(copy.deepcopy(entry.value))
+
+  def _store(self, key, entry):
+    self._discard(key)
+    if entry.size > self.max_bytes:
+      logger.debug("[{!s}] not caching oversized entry for {!r} ({:d} bytes)", self.name, key,
+          entry.size)
+      return
+
+    self._entries[key] = entry
+    self._bytes += entry.size
+    while self._bytes > self.max_bytes:
+      _, evicted = self._entries.popitem(last=False)
+      self._bytes -= evicted.size
+      self.counts['evictions'] += 1
+
+  def _discard(self, key):
+    entry = self._entries.pop(key, None)
+    if entry is not None:
+      self._bytes -= entry.size
+
+  def _touch(self, key):
+    # mark as most-recently used (`OrderedDict.move_to_end` is not available on python 2.x)
+    self._entries[key] = self._entries.pop(key)
+
+  def _log_refresh_failure(self, failure, key):
+    if not failure.check(stethoscope.api.exceptions.NotFoundException):
+      logger.error("[{!s}] failed to refresh stale entry for {!r}:\n{!s}", self.name, key, failure)
+
+
+def _wrapped_lookup(call, method_name, method, arg):
+  return call((method_name, arg), method, arg)
+
+
+def wrap_lookups(obj, config, clock=None):
+  """Coalesce (and optionally cache) calls to `obj`'s device lookup methods (see `LOOKUP_METHODS`).
+
+  Concurrent identical lookups share a single upstream call via a `SingleFlight` (available as
+  ``obj.single_flight``) unless `config` (the plugin's configuration) sets ``SINGLE_FLIGHT`` to
+  `False`. Results are also cached if `config` sets ``CACHE_TTL``; optional ``CACHE_STALE_TTL`` and
+  ``CACHE_MAX_BYTES`` values are passed on to `DeferredCache`. The cache is available as
+  ``obj.response_cache`` (which is `None` when caching is disabled).
+  """
+  name = getattr(obj, 'plugin_name', None)
+  obj.single_flight = None
+  obj.response_cache = None
+
+  if config.get('CACHE_TTL') is not None:
+    obj.response_cache = DeferredCache(config['CACHE_TTL'],
+        stale_ttl=config.get('CACHE_STALE_TTL', 0),
+        max_bytes=config.get('CACHE_MAX_BYTES', DEFAULT_MAX_BYTES), clock=clock, name=name)
+    obj.single_flight = obj.response_cache.single_flight
+    call = obj.response_cache.get
+    logger.debug("[{!s}] caching results for {!s}s (stale for a further {!s}s)", name,
+        obj.response_cache.ttl, obj.response_cache.stale_ttl)
+  elif config.get('SINGLE_FLIGHT', True):
+    obj.single_flight = stethoscope.plugins.singleflight.SingleFlight(name)
+    call = obj.single_flight.call
+  else:
+    return obj
+
+  for method_name in LOOKUP_METHODS:
+    method = getattr(obj, method_name, None)
+    if method is not None:
+      setattr(obj, method_name, functools.partial(_wrapped_lookup, call, method_name, method))
+  return obj
+
+
+def collect_stats(plugins):
+  """Return a `dict` mapping plugin names to their lookup, connection and store stats."""
+  stats = dict()
+  for plugin in plugins:
+    components = {
+      'single_flight': getattr(plugin.obj, 'single_flight', None),
+      'cache': getattr(plugin.obj, 'response_cache', None),
+      'concurrency': getattr(plugin.obj, 'limiter', None),
+      'http_pool': getattr(plugin.obj, 'http_pool', None),
+      'connection_pool': getattr(plugin.obj, 'connection_pool', None),
+      'responses': getattr(plugin.obj, 'response_metrics', None),
+      'device_store': getattr(plugin.obj, 'device_store', None),
+      'event_store': getattr(plugin.obj, 'event_store', None),
+      'poller': getattr(plugin.obj, 'poller', None),
+    }
+    if all(component is None for component in six.itervalues(components)):
+      continue
+    stats[plugin.name] = dict((key, component.stats() if component is not None else None)
+                              for key, component in six.iteritems(components))
+  return stats
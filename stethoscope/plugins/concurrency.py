@@ -0,0 +1,248 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+
+import logbook
+import six
+from twisted.internet import defer, error
+from twisted.python import failure as twisted_failure
+
+import stethoscope.api.exceptions
+
+
+logger = logbook.Logger(__name__)
+
+# limiters shared by all instances of a plugin (e.g., the same plugin loaded as both a device and an
+# account source), keyed by plugin name
+_limiters = dict()
+
+
+def _status_code(result):
+  """Return the HTTP status code carried by `result` (a response or failure), if any."""
+  if isinstance(result, twisted_failure.Failure):
+    result = result.value
+  if isinstance(result, stethoscope.api.exceptions.InvalidResponseException):
+    return result.response_code
+  # `googleapiclient.errors.HttpError`
+  status = getattr(getattr(result, 'resp', None), 'status', None)
+  if status is None:
+    # `treq` responses
+    status = getattr(result, 'code', None)
+  return status if isinstance(status, six.integer_types) else None
+
+
+def is_overloaded(result):
+  """Return whether `result` indicates the upstream service is overloaded (429, 5xx or timeout).
+
+  >>> is_overloaded(stethoscope.api.exceptions.InvalidResponseException(429))
+  True
+  >>> is_overloaded(twisted_failure.Failure(error.TimeoutError()))
+  True
+  >>> is_overloaded(stethoscope.api.exceptions.InvalidResponseException(404))
+  False
+  >>> is_overloaded([{'serial': 'foo'}])
+  False
+
+  """
+  if isinstance(result, twisted_failure.Failure) and \
+      result.check(error.TimeoutError, defer.TimeoutError, defer.CancelledError):
+    return True
+  status = _status_code(result)
+  return status is not None and (status == 429 or status >= 500)
+
+
+class AdaptiveLimiter(object):
+  """Limit the number of concurrent calls to an upstream service, adapting the limit AIMD-style.
+
+  Calls beyond the current limit wait (in order) for a running call to complete. Each call that
+  succeeds within `latency_target` seconds (if given) grows the window additively, by about one
+  slot per window's worth of calls; each call which signals overload (see `is_overloaded`) or
+  exceeds `latency_target` shrinks it multiplicatively by `backoff`. Calls that were already in
+  flight when the window last shrank do not shrink it again, so that a burst of failures from a
+  single overloaded period halves the window once rather than collapsing it.
+  """
+
+  def __init__(self, limit=8, min_limit=1, max_limit=64, latency_target=None, backoff=0.5,
+               clock=None, name=None):
+    if clock is None:
+      from twisted.internet import reactor as clock
+    self.window = float(limit)
+    self.min_limit = min_limit
+    self.max_limit = max_limit
+    self.latency_target = latency_target
+    self.backoff = backoff
+    self.clock = clock
+    self.name = name
+
+    self.active = 0
+    self._waiting = collections.deque()
+    self._dispatching = False
+    self._last_decrease = None
+    self.counts = collections.Counter()
+
+  @property
+  def limit(self):
+    return max(self.min_limit, int(self.window))
+
+  def stats(self):
+    """Return the current window and limit, calls running and waiting, and event counters."""
+    stats = dict((key, 0) for key in ('calls', 'queued', 'increases', 'decreases'))
+    stats.update(self.counts)
+    stats.update({
+      'window': self.window,
+      'limit': self.limit,
+      'active': self.active,
+      'waiting': len(self._waiting),
+    })
+    return stats
+
+  def run(self, func, *args, **kwargs):
+    """Return a `Deferred` firing with the result of `func(*args, **kwargs)` once a slot is free."""
+    self.counts['calls'] += 1
+    if self.active < self.limit:
+      self.active += 1
+      return self._call(func, args, kwargs)
+
+    self.counts['queued'] += 1
+    deferred = defer.Deferred()
+    self._waiting.append(deferred)
+    deferred.addCallback(lambda _: self._call(func, args, kwargs))
+    return deferred
+
+  def _call(self, func, args, kwargs):
+    started = self.clock.seconds()
+    deferred = defer.maybeDeferred(func, *args, **kwargs)
+    deferred.addBoth(self._release, started)
+    return deferred
+
+  def _release(self, result, started):
+    latency = self.clock.seconds() - started
+    if is_overloaded(result) or \
+        (self.latency_target is not None and latency > self.latency_target):
+      self._decrease(started)
+    elif not isinstance(result, twisted_failure.Failure):
+      self._increase()
+
+    self.active -= 1
+    self._dispatch()
+    return result
+
+  def _dispatch(self):
+    # calls started here may complete synchronously and re-enter `_release`; let the outermost
+    # invocation do the dispatching rather than recursing once per waiting call
+    if self._dispatching:
+      return
+    self._dispatching = True
+    try:
+      while self._waiting and self.active < self.limit:
+        self.active += 1
+        self._waiting.popleft().callback(None)
+    finally:
+      self._dispatching = False
+
+  def _increase(self):
+    if self.window < self.max_limit:
+      self.window = min(self.max_limit, self.window + 1.0 / self.window)
+      self.counts['increases'] += 1
+
+  def _decrease(self, started):
+    if self._last_decrease is not None and started < self._last_decrease:
+      return
+    self.window = max(self.min_limit, self.window * self.backoff)
+    self._last_decrease = self.clock.seconds()
+    self.counts['decreases'] += 1
+    logger.info("[{!s}] upstream overloaded; reducing concurrency limit to {:d}", self.name,
+        self.limit)
+
+
+def get_limiter(name, config, clock=None):
+  """Return the `AdaptiveLimiter` for the plugin `name`, or `None` if it has no limit configured.
+
+  A plugin's configuration enables limiting by setting ``CONCURRENCY_LIMIT`` (the initial limit);
+  ``CONCURRENCY_MIN``, ``CONCURRENCY_MAX`` and ``CONCURRENCY_LATENCY_TARGET`` (in seconds) are
+  optional. All instances of the plugin share a single limiter.
+  """
+  if config.get('CONCURRENCY_LIMIT') is None:
+    return None
+  if name not in _limiters:
+    limit = config['CONCURRENCY_LIMIT']
+    _limiters[name] = AdaptiveLimiter(limit,
+        min_limit=config.get('CONCURRENCY_MIN', 1),
+        max_limit=config.get('CONCURRENCY_MAX', max(limit, 64)),
+        latency_target=config.get('CONCURRENCY_LATENCY_TARGET'), clock=clock, name=name)
+  return _limiters[name]
+
+
+def run_limited(obj, func, *args, **kwargs):
+  """Call `func` subject to `obj`'s limiter (see `get_limiter`), if it has one.
+
+  The call holds its slot until the `Deferred` returned by `func` fires, so `func` should cover the
+  whole exchange with the upstream service (e.g., reading the response body, not just the headers).
+  """
+  limiter = getattr(obj, 'limiter', None)
+  if limiter is None:
+    return func(*args, **kwargs)
+  return limiter.run(func, *args, **kwargs)
+
+
+def run_limited_with_retry(obj, retry, read, request, *args, **kwargs):
+  """Call `request` through `retry`, then `read` (if given) with its response, under a limit.
+
+  `retry` is a retrying wrapper such as ``txwebretry.ExponentialBackoffRetry(3)``. Each attempt
+  takes its own slot under `obj`'s limiter (see `run_limited`), so a request which failed does not
+  hold one while waiting to be retried. The slot of an attempt which received a response is held
+  until `read` is done with the response (e.g., has read its body), or until the next attempt if
+  `retry` retries the response itself; failures raised by `read` are not retried.
+  """
+  limiter = getattr(obj, 'limiter', None)
+  if limiter is None:
+    deferred = retry(request, *args, **kwargs)
+    if read is not None:
+      deferred.addCallback(read)
+    return deferred
+
+  # the slot held by the response of the most recent attempt, and that response
+  held = list()
+
+  def _release(result=None):
+    while held:
+      slot, response = held.pop()
+      outcome = response if result is None else result
+      if isinstance(outcome, twisted_failure.Failure):
+        slot.errback(outcome)
+      else:
+        slot.callback(outcome)
+    return result
+
+  def _attempt():
+    # `retry` only makes another attempt once it has given up on the previous response
+    _release()
+    response = defer.Deferred()
+
+    def _exchange():
+      deferred = defer.maybeDeferred(request, *args, **kwargs)
+
+      def _received(result):
+        slot = defer.Deferred()
+        held.append((slot, result))
+        response.callback(result)
+        return slot
+      deferred.addCallback(_received)
+      return deferred
+
+    def _failed(failure):
+      # the request failed (and its slot has been released); failures from `read` reach the caller
+      # directly
+      if not response.called:
+        response.errback(failure)
+
+    limiter.run(_exchange).addErrback(_failed)
+    return response
+
+  deferred = retry(_attempt)
+  if read is not None:
+    deferred.addCallback(read)
+  deferred.addBoth(_release)
+  return deferred
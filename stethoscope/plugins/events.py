@@ -0,0 +1,217 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+import heapq
+import threading
+import time
+
+import logbook
+
+
+logger = logbook.Logger(__name__)
+
+
+def get_event_id(event):
+  """Return the id of `event` (or ``''``), which orders events with the same timestamp."""
+  return event.get('id') or ''
+
+
+def get_sort_key(event):
+  """Return the key by which events are sorted (most recent first, when pages are requested)."""
+  return event['timestamp'], get_event_id(event)
+
+
+def _insert(events, entry):
+  """Insert `entry` (a ``(timestamp, identity, event)`` triple) into `events`, keeping them ordered
+  by time and identity."""
+  position = entry[:2]
+  if len(events) == 0 or position >= events[-1][:2]:
+    events.append(entry)
+  elif position < events[0][:2]:
+    events.appendleft(entry)
+  else:
+    # a late event, usually only a little older than the most recent ones (`collections.deque`
+    # lacks `insert` on Python 2)
+    newer = 1
+    while events[-newer - 1][:2] > position:
+      newer += 1
+    events.rotate(newer)
+    events.append(entry)
+    events.rotate(-newer)
+
+
+class EventStore(object):
+  """Events (e.g., authentication log entries) held in memory for a limited time, indexed by user.
+
+  Each user's events are kept in their own `collections.deque`, in time order (and in order of
+  identity, for events at the same time), so retrieving them costs only as much as the number of
+  events for that user. Events older than `retention` seconds
+  are evicted, as are the oldest events once there are more than `max_events` in all. Events may be
+  added in any order (e.g., when a log delivers some of them late), but adding each user's events in
+  (or in reverse) chronological order is quickest. The store may be shared between threads.
+
+  Given an `EventJournal`, the store writes each event added to it, and is rebuilt (with events
+  still within the retention window) from the journal when created; segments of the journal are
+  deleted as the events in them are evicted for age.
+
+  Given `key`, a function returning an identity for each event which, together with its timestamp,
+  distinguishes it from the user's other events (e.g., the reports API's ``uniqueQualifier``),
+  events retrieved by overlapping requests can be added with `add_new` without duplicating any, and
+  pages of events (see `get_recent`) can end between events with the same timestamp.
+
+  >>> store = EventStore(retention=3600, max_events=2, clock=lambda: 10000)
+  >>> store.add('pfry', 9000, {'type': 'push'})
+  >>> store.add('tleela', 9500, {'type': 'sms'})
+  >>> store.add('pfry', 9900, {'type': 'phone'})
+  >>> store.get('pfry'), len(store), store.latest
+  ([{'type': 'phone'}], 2, 9900)
+  >>> store.evict(now=13450)
+  >>> store.get('tleela'), len(store)
+  ([], 1)
+
+  """
+
+  def __init__(self, retention=None, max_events=None, clock=time.time, name=None, journal=None,
+               key=None):
+    self.retention = retention
+    self.max_events = max_events
+    self.clock = clock
+    self.name = name
+    self.journal = journal
+    self.key = key
+
+    self.latest = None  # timestamp of the most recent event added
+    self._by_user = dict()
+    self._latest_by_user = dict()
+    # heap of `(timestamp, user)` for every event held, for evicting the oldest
+    self._order = list()
+    self.counts = collections.Counter()
+    self._lock = threading.Lock()
+
+    if journal is not None:
+      journal.replay(self._add, since=self._cutoff())
+
+  def __len__(self):
+    return len(self._order)
+
+  def add(self, user, timestamp, event):
+    with self._lock:
+      self._add(user, timestamp, event)
+      if self.journal is not None:
+        self.journal.append(user, timestamp, event)
+
+  def _identity(self, event):
+    return self.key(event) if self.key is not None else None
+
+  def add_new(self, user, timestamp, event):
+    """Add an event unless one with the same timestamp and identity (see `key`) is already held for
+    `user`; return whether it was added.
+
+    Without `key`, events with the same timestamp are taken to be the same event. Only the user's
+    events from `timestamp` onward are compared, so adding events which overlap only the most recent
+    ones held (e.g., from polls over overlapping periods) is cheap.
+    """
+    identity = self._identity(event)
+    with self._lock:
+      for held_timestamp, held_identity, _ in reversed(self._by_user.get(user, ())):
+        if held_timestamp < timestamp:
+          break
+        if held_timestamp == timestamp and held_identity == identity:
+          return False
+      self._add(user, timestamp, event)
+      if self.journal is not None:
+        self.journal.append(user, timestamp, event)
+      return True
+
+  def latest_for(self, user):
+    """Return the timestamp of the most recent event held for `user` (or `None`)."""
+    return self._latest_by_user.get(user)
+
+  def flush(self):
+    """Flush events added to the journal (if any) to disk."""
+    if self.journal is not None:
+      self.journal.flush()
+
+  def _add(self, user, timestamp, event):
+    events = self._by_user.get(user)
+    if events is None:
+      events = self._by_user[user] = collections.deque()
+    _insert(events, (timestamp, self._identity(event), event))
+    heapq.heappush(self._order, (timestamp, user))
+    latest = self._latest_by_user.get(user)
+    if latest is None or timestamp > latest:
+      self._latest_by_user[user] = timestamp
+    self.counts['added'] += 1
+    if self.latest is None or timestamp > self.latest:
+      self.latest = timestamp
+
+    if self.max_events is not None and len(self._order) > self.max_events:
+      self._evict_oldest()
+      self.counts['evicted_for_size'] += 1
+
+  def _evict_oldest(self):
+    # the oldest event held is also the oldest of its user's
+    _, user = heapq.heappop(self._order)
+    events = self._by_user[user]
+    events.popleft()
+    if len(events) == 0:
+      del self._by_user[user]
+      del self._latest_by_user[user]
+
+  def _cutoff(self, now=None):
+    if self.retention is None:
+      return None
+    return (self.clock() if now is None else now) - self.retention
+
+  def evict(self, now=None):
+    """Evict events older than the retention window."""
+    cutoff = self._cutoff(now)
+    if cutoff is None:
+      return
+    evicted = 0
+    with self._lock:
+      while len(self._order) > 0 and self._order[0][0] < cutoff:
+        self._evict_oldest()
+        evicted += 1
+    if evicted > 0:
+      self.counts['evicted_for_age'] += evicted
+      logger.debug("[{!s}] evicted {:d} events older than {!s}", self.name, evicted, cutoff)
+      if self.journal is not None:
+        self.journal.compact(cutoff)
+
+  def get(self, user):
+    """Return the events (oldest first) for `user` within the retention window."""
+    self.evict()
+    with self._lock:
+      return [event for _, _, event in self._by_user.get(user, ())]
+
+  def get_recent(self, user, before=None, limit=None):
+    """Return up to `limit` of `user`'s events (most recent first) which follow `before` (a
+    `stethoscope.utils.PageCursor` of a timestamp and an identity), if given.
+
+    Only the events returned (and any skipped for being too recent) are visited.
+    """
+    if before is not None and self.key is None:
+      before = before._replace(id=None)
+    self.evict()
+    recent = list()
+    with self._lock:
+      for timestamp, identity, event in reversed(self._by_user.get(user, ())):
+        if limit is not None and len(recent) >= limit:
+          break
+        if before is None or before.precedes(timestamp, identity):
+          recent.append(event)
+    return recent
+
+  def stats(self):
+    """Return the number of events and users held, and of events added and evicted."""
+    stats = dict((key, self.counts[key]) for key in ('added', 'evicted_for_age',
+                                                     'evicted_for_size'))
+    stats['events'] = len(self._order)
+    stats['users'] = len(self._by_user)
+    stats['oldest'] = self._order[0][0] if len(self._order) > 0 else None
+    stats['latest'] = self.latest
+    stats['journal'] = self.journal.stats() if self.journal is not None else None
+    return stats
@@ -0,0 +1,164 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+import datetime
+import io
+import json
+import os
+import re
+import threading
+
+import arrow
+import logbook
+import six
+
+
+logger = logbook.Logger(__name__)
+
+_SEGMENT_NAME = re.compile(r'^(\d+)\.jsonl$')
+
+DEFAULT_SEGMENT_SECONDS = 60 * 60
+
+
+def _encode_timestamp(obj):
+  # as seconds since the epoch, which is several times quicker to decode than ISO 8601 (cf.
+  # `stethoscope.utils.json_dumps_line`), since the whole journal is decoded on every startup
+  if isinstance(obj, (datetime.datetime, arrow.Arrow)):
+    return {'__timestamp__': arrow.get(obj).float_timestamp}
+  raise TypeError("{!r} is not JSON serializable".format(obj))
+
+
+def _decode_timestamp(obj):
+  if len(obj) == 1 and '__timestamp__' in obj:
+    return arrow.Arrow.utcfromtimestamp(obj['__timestamp__'])
+  return obj
+
+
+class EventJournal(object):
+  """Append-only on-disk journal of events, from which an `EventStore` is rebuilt on startup.
+
+  Events are appended (as JSON Lines, with timestamps preserved in UTC) to segment files in the
+  directory `path`, each segment holding the events whose timestamps fall in one
+  `segment_seconds`-long period and being named for the start of that period. Replaying the
+  journal reads the segments in order, so events come back in (roughly) the order they were added.
+  Compaction deletes whole segments once all of their events are older than the retention window;
+  nothing is ever rewritten. Members of events whose names start with an underscore (e.g., `_raw`)
+  aren't written.
+
+  >>> import tempfile
+  >>> journal = EventJournal(tempfile.mkdtemp(), segment_seconds=3600)
+  >>> journal.append('pfry', 9000, {'type': 'push'})
+  >>> journal.append('tleela', 9500, {'type': 'sms', '_raw': {}})
+  >>> journal.flush()
+  >>> journal.replay(lambda user, timestamp, event: print(user, timestamp, event['type']))
+  pfry 9000 push
+  tleela 9500 sms
+  2
+  >>> journal.compact(cutoff=7200 + 3600)
+  >>> journal.replay(lambda *args: None)
+  0
+
+  """
+
+  def __init__(self, path, segment_seconds=DEFAULT_SEGMENT_SECONDS, name=None):
+    self.path = path
+    self.segment_seconds = segment_seconds
+    self.name = name
+    self.counts = collections.Counter()
+
+    self._segment = None  # start of the segment `_file` appends to
+    self._file = None
+    self._lock = threading.Lock()
+    if not os.path.isdir(path):
+      os.makedirs(path)
+
+  def _segment_path(self, segment):
+    return os.path.join(self.path, '{:d}.jsonl'.format(segment))
+
+  def segments(self):
+    """Return the start of each segment in the journal, in order."""
+    segments = list()
+    for filename in os.listdir(self.path):
+      match = _SEGMENT_NAME.match(filename)
+      if match is not None:
+        segments.append(int(match.group(1)))
+    return sorted(segments)
+
+  def append(self, user, timestamp, event):
+    """Write an event for `user` (at `timestamp`, in seconds since the epoch) to its segment."""
+    segment = int(timestamp) // self.segment_seconds * self.segment_seconds
+    record = {
+      'user': user,
+      'timestamp': timestamp,
+      'event': dict((key, value) for key, value in six.iteritems(event)
+                    if not key.startswith('_')),
+    }
+    line = six.text_type(json.dumps(record, default=_encode_timestamp)) + '\n'
+    with self._lock:
+      if segment != self._segment:
+        self._close()
+        self._file = io.open(self._segment_path(segment), 'a', encoding='utf-8')
+        self._segment = segment
+      self._file.write(line)
+    self.counts['appended'] += 1
+
+  def flush(self):
+    with self._lock:
+      if self._file is not None:
+        self._file.flush()
+
+  def _close(self):
+    if self._file is not None:
+      self._file.close()
+    self._file = None
+    self._segment = None
+
+  def close(self):
+    with self._lock:
+      self._close()
+
+  def replay(self, callback, since=None):
+    """Call ``callback(user, timestamp, event)`` for each event journaled (at or after `since`).
+
+    Returns the number of events replayed. A truncated final line in a segment (e.g., from a crash
+    part-way through writing it) is ignored.
+    """
+    self.flush()
+    replayed = 0
+    for segment in self.segments():
+      if since is not None and segment + self.segment_seconds <= since:
+        continue
+      with io.open(self._segment_path(segment), 'r', encoding='utf-8') as fi:
+        for line in fi:
+          try:
+            record = json.loads(line, object_hook=_decode_timestamp)
+          except ValueError:
+            logger.warn("[{!s}] ignoring truncated line in segment {:d}", self.name, segment)
+            continue
+          if since is not None and record['timestamp'] < since:
+            continue
+          callback(record['user'], record['timestamp'], record['event'])
+          replayed += 1
+    self.counts['replayed'] += replayed
+    logger.info("[{!s}] replayed {:d} events from {!s}", self.name, replayed, self.path)
+    return replayed
+
+  def compact(self, cutoff):
+    """Delete the segments holding only events older than `cutoff`."""
+    with self._lock:
+      for segment in self.segments():
+        if segment + self.segment_seconds > cutoff:
+          break
+        if segment == self._segment:
+          self._close()
+        os.remove(self._segment_path(segment))
+        self.counts['compacted'] += 1
+        logger.debug("[{!s}] deleted segment {:d}", self.name, segment)
+
+  def stats(self):
+    """Return the number of segments, and of events appended and replayed and segments deleted."""
+    stats = dict((key, self.counts[key]) for key in ('appended', 'replayed', 'compacted'))
+    stats['segments'] = len(self.segments())
+    return stats
@@ -0,0 +1,64 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+import json
+import timeit
+
+import six
+
+
+class ResponseMetrics(object):
+  """Count the responses from an upstream service, their sizes and their decoding times.
+
+  Figures are kept per resource (e.g., ``'device'`` or ``'userinfo'``) so that the effect of
+  requesting less data for a given kind of lookup can be seen directly.
+
+  >>> metrics = ResponseMetrics('jamf')
+  >>> metrics.decode_json(b'{"computer": {"general": {}}}', 'device')
+  {'computer': {'general': {}}}
+  >>> stats = metrics.stats()['device']
+  >>> stats['responses'], stats['bytes'], stats['max_bytes']
+  (1, 29, 29)
+
+  """
+
+  def __init__(self, name=None, timer=timeit.default_timer):
+    self.name = name
+    self.timer = timer
+    self.counts = collections.defaultdict(collections.Counter)
+
+  def record(self, resource, size, seconds):
+    counts = self.counts[resource]
+    counts['responses'] += 1
+    counts['bytes'] += size
+    counts['max_bytes'] = max(counts['max_bytes'], size)
+    counts['decode_seconds'] += seconds
+
+  def decode_json(self, content, resource=None):
+    """Decode `content` as JSON, recording its size and how long it took to decode."""
+    started = self.timer()
+    data = json.loads(content)
+    self.record(resource, len(content), self.timer() - started)
+    return data
+
+  def finish_decoding(self, decoder, resource=None):
+    """Return the document decoded by a `StreamingJSONDecoder`, recording its size and time."""
+    data = decoder.close()
+    self.record(resource, decoder.size, decoder.seconds)
+    return data
+
+  def stats(self):
+    """Return response counts, total, mean and maximum sizes and decoding times per resource."""
+    stats = dict()
+    for resource, counts in six.iteritems(self.counts):
+      stats[resource] = {
+        'responses': counts['responses'],
+        'bytes': counts['bytes'],
+        'max_bytes': counts['max_bytes'],
+        'mean_bytes': float(counts['bytes']) / counts['responses'],
+        'decode_seconds': counts['decode_seconds'],
+        'mean_decode_ms': counts['decode_seconds'] * 1000 / counts['responses'],
+      }
+    return stats
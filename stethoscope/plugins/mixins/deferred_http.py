@@ -12,6 +12,7 @@ import txwebretry
 
 import stethoscope.api.utils
 import stethoscope.plugins.mixins.http
+import stethoscope.plugins.pool
 
 
 logger = logbook.Logger(__name__)
@@ -25,7 +26,7 @@ def _check_healthcheck_response(response):
 
 def _test_connectivity(self):
   """Method to bind to `DeferredHTTPMixin` instances with a configured `HEALTHCHECK_URL`."""
-  deferred = treq.get(self.config['HEALTHCHECK_URL'])
+  deferred = treq.get(self.config['HEALTHCHECK_URL'], pool=stethoscope.plugins.pool.pool_for(self))
   deferred.addCallback(_check_healthcheck_response)
   return deferred
 
@@ -47,6 +48,7 @@ class DeferredHTTPMixin(stethoscope.plugins.mixins.http.BaseHTTPMixin):
     return failure
 
   def _post(self, url, content, **kwargs):
+    kwargs.setdefault('pool', stethoscope.plugins.pool.pool_for(self))
     return txwebretry.ExponentialBackoffRetry(3)(treq.post, url, content, **kwargs)
 
   def post(self, payload, **kwargs):
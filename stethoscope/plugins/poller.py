@@ -0,0 +1,93 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+
+import logbook
+from twisted.internet import defer, task, threads
+
+
+logger = logbook.Logger(__name__)
+
+
+class Poller(object):
+  """Call a (blocking) function in a thread every `interval` seconds, e.g., to keep a store current.
+
+  Polling is driven by a `LoopingCall`, which doesn't schedule the next poll until the previous one
+  has finished, so polls never overlap. A poll which fails is logged; polling continues. `wait`
+  returns a `Deferred` which fires once the first poll has succeeded, so that callers can wait for
+  the initial state (e.g., a backfill) to be loaded but never wait after that. Until a poll has
+  succeeded, callers get the error of the latest poll instead (rather than an empty state).
+  """
+
+  def __init__(self, func, interval, name=None, clock=None):
+    self.func = func
+    self.interval = interval
+    self.name = name
+    self.polled = False
+    self.failure = None  # of the latest poll, until one succeeds
+    self.counts = collections.Counter()
+
+    self._loop = task.LoopingCall(self.poll)
+    if clock is not None:
+      self._loop.clock = clock
+    self._waiting = list()
+
+  @property
+  def running(self):
+    return self._loop.running
+
+  def start(self):
+    """Start polling (immediately), if not already started; polling stops when the reactor does."""
+    if self._loop.running:
+      return
+    from twisted.internet import reactor
+    self._loop.start(self.interval, now=True)
+    reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+
+  def stop(self):
+    if self._loop.running:
+      self._loop.stop()
+
+  def poll(self):
+    deferred = threads.deferToThread(self.func)
+    # an error must not propagate to the `LoopingCall`, which would stop polling altogether
+    deferred.addCallbacks(self._succeeded, self._failed)
+    return deferred
+
+  def _succeeded(self, _):
+    self.counts['polls'] += 1
+    self.polled = True
+    self.failure = None
+    for deferred in self._release_waiting():
+      deferred.callback(None)
+
+  def _failed(self, failure):
+    self.counts['failures'] += 1
+    logger.error("[{!s}] polling failed: {!s}", self.name, failure.getErrorMessage())
+    if not self.polled:
+      self.failure = failure
+      for deferred in self._release_waiting():
+        deferred.errback(failure)
+
+  def _release_waiting(self):
+    waiting, self._waiting = self._waiting, list()
+    return waiting
+
+  def wait(self):
+    """Return a `Deferred` which fires once the first poll has succeeded.
+
+    Until then, it fails if the latest poll failed (or, if none has finished, once the first does).
+    """
+    if self.polled:
+      return defer.succeed(None)
+    if self.failure is not None:
+      return defer.fail(self.failure)
+    deferred = defer.Deferred()
+    self._waiting.append(deferred)
+    return deferred
+
+  def stats(self):
+    """Return the number of polls which succeeded and failed."""
+    return dict((key, self.counts[key]) for key in ('polls', 'failures'))
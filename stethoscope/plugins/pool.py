@@ -0,0 +1,111 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+
+import logbook
+import six
+from twisted.internet import defer
+from twisted.web import client
+
+
+logger = logbook.Logger(__name__)
+
+DEFAULT_MAX_PERSISTENT_PER_HOST = 10
+DEFAULT_IDLE_TIMEOUT = 240
+
+# pools shared by all instances of a plugin, keyed by plugin name
+_pools = dict()
+
+
+def _host(key):
+  """Return ``scheme://host`` for a pool key of the form ``(scheme, host, port)``.
+
+  >>> _host((b'https', b'example.com', 443))
+  'https://example.com'
+
+  """
+  scheme, host = (part.decode('ascii') if isinstance(part, six.binary_type) else part
+                  for part in key[:2])
+  return '{!s}://{!s}'.format(scheme, host)
+
+
+class MeteredConnectionPool(client.HTTPConnectionPool):
+  """`HTTPConnectionPool` which counts how often requests reuse a cached connection.
+
+  ``counts['requests']`` is the number of connections handed out, ``counts['connections']`` the
+  number of new connections opened (each of which, for HTTPS, involves a TLS handshake), with both
+  also broken down by scheme and host (e.g., ``counts[('connections', 'https://example.com')]``).
+  """
+
+  def __init__(self, reactor, persistent=True, name=None):
+    client.HTTPConnectionPool.__init__(self, reactor, persistent=persistent)
+    self.name = name
+    self.counts = collections.Counter()
+
+  def getConnection(self, key, endpoint):
+    self.counts['requests'] += 1
+    self.counts[('requests', _host(key))] += 1
+    return client.HTTPConnectionPool.getConnection(self, key, endpoint)
+
+  def _newConnection(self, key, endpoint):
+    self.counts['connections'] += 1
+    self.counts[('connections', _host(key))] += 1
+    logger.debug("[{!s}] opening new connection for {!r}", self.name, key)
+    return client.HTTPConnectionPool._newConnection(self, key, endpoint)
+
+  def stats(self):
+    """Return request, connection and reuse counts (in total and per host) and idle connections."""
+    hosts = collections.defaultdict(dict)
+    for key, count in six.iteritems(self.counts):
+      if isinstance(key, tuple):
+        hosts[key[1]][key[0]] = count
+    for host in six.itervalues(hosts):
+      host['reused'] = host.get('requests', 0) - host.get('connections', 0)
+
+    return {
+      'requests': self.counts['requests'],
+      'connections': self.counts['connections'],
+      'reused': self.counts['requests'] - self.counts['connections'],
+      'idle': sum(len(connections) for connections in six.itervalues(self._connections)),
+      'max_persistent_per_host': self.maxPersistentPerHost,
+      'idle_timeout': self.cachedConnectionTimeout,
+      'hosts': dict(hosts),
+    }
+
+
+def get_pool(name, config, reactor=None):
+  """Return the connection pool for the plugin `name`, creating it from `config` if necessary.
+
+  Connections are persistent unless `config` sets ``HTTP_PERSISTENT`` to `False`; at most
+  ``HTTP_MAX_PERSISTENT_PER_HOST`` idle connections are kept per host, each for at most
+  ``HTTP_IDLE_TIMEOUT`` seconds. All instances of the plugin share a single pool.
+  """
+  if name not in _pools:
+    if reactor is None:
+      from twisted.internet import reactor
+    pool = MeteredConnectionPool(reactor, persistent=config.get('HTTP_PERSISTENT', True),
+        name=name)
+    pool.maxPersistentPerHost = config.get('HTTP_MAX_PERSISTENT_PER_HOST',
+        DEFAULT_MAX_PERSISTENT_PER_HOST)
+    pool.cachedConnectionTimeout = config.get('HTTP_IDLE_TIMEOUT', DEFAULT_IDLE_TIMEOUT)
+    _pools[name] = pool
+  return _pools[name]
+
+
+def pool_for(obj):
+  """Return the connection pool for the plugin instance `obj` (see `get_pool`).
+
+  The pool is also made available as ``obj.http_pool``.
+  """
+  if getattr(obj, 'http_pool', None) is None:
+    name = getattr(obj, 'plugin_name', None) or type(obj).__name__
+    obj.http_pool = get_pool(name, obj.config)
+  return obj.http_pool
+
+
+def close_pools():
+  """Close all cached connections in all pools (e.g., before the reactor stops)."""
+  return defer.DeferredList([pool.closeCachedConnections() for pool in
+    six.itervalues(_pools)])
@@ -0,0 +1,81 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+import copy
+
+import logbook
+from twisted.internet import defer
+from twisted.python import failure as twisted_failure
+
+
+logger = logbook.Logger(__name__)
+
+
+class SingleFlight(object):
+  """Share a single in-flight call among concurrent callers asking for the same key.
+
+  The first caller for a given key starts the call; any caller asking for that key before the call
+  completes waits on the same result rather than starting another call. Once the call completes,
+  the next caller for the key starts a new one (i.e., results are *not* cached).
+
+  Callers other than the first receive deep copies of the result, so each is free to modify what it
+  receives. Failures are passed to every caller.
+
+  >>> single_flight = SingleFlight()
+  >>> pending = defer.Deferred()
+  >>> first = single_flight.call('key', lambda: pending)
+  >>> second = single_flight.call('key', lambda: defer.succeed('unused'))
+  >>> pending.callback(['result'])
+  >>> first.result, second.result, first.result is second.result
+  (['result'], ['result'], False)
+  >>> stats = single_flight.stats()
+  >>> stats['calls'], stats['coalesced'], stats['in_flight']
+  (1, 1, 0)
+
+  """
+
+  def __init__(self, name=None):
+    self.name = name
+    self._waiting = dict()
+    self.counts = collections.Counter()
+
+  def __contains__(self, key):
+    return key in self._waiting
+
+  def stats(self):
+    """Return the number of calls made, the number saved by coalescing, and the number in flight."""
+    return {
+      'calls': self.counts['calls'],
+      'coalesced': self.counts['coalesced'],
+      'in_flight': len(self._waiting),
+    }
+
+  def call(self, key, func, *args, **kwargs):
+    """Return a `Deferred` firing with the result of `func(*args, **kwargs)`.
+
+    If a call for `key` is already in flight, `func` is not called and the returned `Deferred`
+    fires with the result of the in-flight call instead.
+    """
+    deferred = defer.Deferred()
+    if key in self._waiting:
+      self.counts['coalesced'] += 1
+      self._waiting[key].append(deferred)
+      logger.debug("[{!s}] joined in-flight call for {!r}", self.name, key)
+    else:
+      self.counts['calls'] += 1
+      # register the waiting deferred first: `func` may return an already-fired `Deferred`
+      self._waiting[key] = [deferred]
+      defer.maybeDeferred(func, *args, **kwargs).addBoth(self._resolve, key)
+    return deferred
+
+  def _resolve(self, result, key):
+    waiting = self._waiting.pop(key, [])
+    for index, deferred in enumerate(waiting):
+      if isinstance(result, twisted_failure.Failure):
+        deferred.errback(result)
+      elif index == 0:
+        deferred.callback(result)
+      else:
+        deferred.callback(copy.deepcopy(result))
@@ -2,6 +2,9 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+import collections
+import copy
+
 import arrow
 import logbook
 
@@ -27,6 +30,105 @@ def _get_mac_addrs(values):
   return list(stethoscope.validation.filter_macaddrs(mac_addresses))
 
 
+# parts of bitfit's responses which are read (specs for
+# `stethoscope.plugins.streaming.StreamingJSONDecoder`): the IDs from a user's list of assets, and
+# the parts of an asset used by `_process_device`
+ASSETS_SPEC = {'items': [('id',)]}
+ASSET_SPEC = {'item': {
+  'model': True,
+  'name': True,
+  'serial_number': True,
+  'image_url': True,
+  'photo_id': True,
+  'type': ('label_single',),
+  'config': ('type', 'image_url', 'photo_id'),
+  'customerStatus': ('label',),
+  'fields': [('base_name', 'value')],
+}}
+
+
+# bulk mode: users and assets are listed `BITFIT_PAGE_SIZE` at a time, and (in the API server)
+# re-listed every `BITFIT_BULK_REFRESH` seconds
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_MAX_PAGES = 1000
+DEFAULT_BULK_THRESHOLD = 500
+DEFAULT_BULK_REFRESH = 3600
+
+
+class AssetIndex(object):
+  """bitfit users and assets indexed by user email, serial number and MAC address.
+
+  Built by listing all of bitfit's users and assets (see `BitfitDataSourceBase._index_assets`).
+  Processed devices are kept (by asset ID) as they become available: straight from the listing if
+  it includes each asset's details, or else as each asset is first retrieved. MAC addresses are
+  only known for assets whose devices have been processed.
+
+  >>> index = AssetIndex()
+  >>> index.add_user({'id': 12345, 'email': 'PFry@planetexpress.com'})
+  >>> index.add_asset({'id': 55416, 'user_id': 12345, 'serial_number': 'C02'})
+  >>> index.add_device(55416, {'identifiers': {'mac_addresses': ['00:DE:CA:FB:AD:00']}})
+  >>> index.get_asset_ids_by_email('pfry@planetexpress.com'), index.get_asset_ids_by_email('x@y.z')
+  ([55416], None)
+  >>> index.get_asset_id_by_serial('C02'), index.get_asset_id_by_macaddr('00:de:ca:fb:ad:00')
+  (55416, 55416)
+
+  """
+
+  def __init__(self, created=None):
+    self.created = created
+    self.assets = set()
+    self.users_by_email = dict()
+    self.assets_by_user = collections.defaultdict(list)
+    self.by_serial = dict()
+    self.by_macaddr = dict()
+    self.devices = dict()
+
+  def __len__(self):
+    return len(self.assets)
+
+  def add_user(self, user):
+    if user.get('email'):
+      self.users_by_email[user['email'].lower()] = user
+
+  def add_asset(self, asset):
+    asset_id = asset['id']
+    self.assets.add(asset_id)
+    if asset.get('user_id') is not None:
+      self.assets_by_user[asset['user_id']].append(asset_id)
+    if asset.get('serial_number'):
+      self.by_serial[asset['serial_number']] = asset_id
+
+  def add_device(self, asset_id, device):
+    self.devices[asset_id] = copy.deepcopy(device)
+    for macaddr in device.get('identifiers', {}).get('mac_addresses', []):
+      self.by_macaddr[macaddr] = asset_id
+
+  def get_device(self, asset_id):
+    """Return (a copy of) the processed device for the given asset, if available, else `None`."""
+    device = self.devices.get(asset_id)
+    return copy.deepcopy(device) if device is not None else None
+
+  def get_user(self, email):
+    return self.users_by_email.get(email.lower())
+
+  def get_asset_ids_by_email(self, email):
+    """Return the IDs of the assets of the user with the given email (`None` if there is none)."""
+    user = self.get_user(email)
+    if user is None:
+      return None
+    return list(self.assets_by_user.get(user['id'], []))
+
+  def get_asset_id_by_serial(self, serial):
+    return self.by_serial.get(serial)
+
+  def get_asset_id_by_macaddr(self, addr):
+    try:
+      addr = stethoscope.validation.canonicalize_macaddr(addr)
+    except Exception:
+      return None
+    return self.by_macaddr.get(addr)
+
+
 class BitfitDataSourceBase(stethoscope.configurator.Configurator):
 
   config_keys = (
@@ -34,6 +136,9 @@ class BitfitDataSourceBase(stethoscope.configurator.Configurator):
       'BITFIT_BASE_URL',
   )
 
+  # populated in bulk mode (see `prefetch_devices`)
+  asset_index = None
+
   @staticmethod
   def _process_userinfo(userinfo_response, email):
     users = userinfo_response['items']
@@ -91,3 +196,25 @@ class BitfitDataSourceBase(stethoscope.configurator.Configurator):
 
     data['source'] = 'bitfit'
     return data
+
+  def _index_assets(self, users, assets, created=None):
+    """Index the given lists of all users and assets (see `AssetIndex`), replacing `asset_index`.
+
+    Assets are processed straight away if the listing includes their details (e.g., their fields);
+    those which can't be are retrieved individually when first looked up.
+    """
+    index = AssetIndex(created)
+    for user in users:
+      index.add_user(user)
+    for asset in assets:
+      index.add_asset(asset)
+      if 'fields' in asset:
+        try:
+          index.add_device(asset['id'], self._process_device({'item': asset}))
+        except (KeyError, TypeError):
+          pass
+
+    logger.info("indexed {:d} users and {:d} assets ({:d} with details)",
+                len(index.users_by_email), len(index), len(index.devices))
+    self.asset_index = index
+    return index
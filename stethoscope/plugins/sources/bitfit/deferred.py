@@ -5,14 +5,20 @@ from __future__ import absolute_import, print_function, unicode_literals
 import json
 import operator
 import sys
+import time
 
 import logbook
 import treq
 import txwebretry
 from twisted.internet import defer
 
+import stethoscope.api.exceptions
 import stethoscope.api.utils
+import stethoscope.plugins.concurrency
+import stethoscope.plugins.pool
+import stethoscope.plugins.singleflight
 import stethoscope.plugins.sources.bitfit.base
+import stethoscope.plugins.streaming
 
 
 logger = logbook.Logger(__name__)
@@ -24,38 +30,174 @@ def check_response(response, resource=None):
 
 class DeferredBitfitDataSource(stethoscope.plugins.sources.bitfit.base.BitfitDataSourceBase):
 
-  def get(self, path, **_params):
+  def __init__(self, *args, **kwargs):
+    super(DeferredBitfitDataSource, self).__init__(*args, **kwargs)
+    # concurrent lookups needing a (re)built index share a single listing
+    self.index_refresh = stethoscope.plugins.singleflight.SingleFlight('bitfit-index')
+
+  def get(self, path, timeout=None, read=None, **_params):
+    """Request `path`, calling `read` (if given) with the response to check it and read its body.
+
+    Each attempt at the request takes its own slot under the concurrency limit (if any); the body is
+    read before the slot is released, so that the limit covers the whole exchange rather than only
+    the wait for the response headers.
+    """
     url = self.config['BITFIT_BASE_URL'] + path
 
-    kwargs = {'timeout': self.config.get('BITFIT_TIMEOUT', self.config.get('DEFAULT_TIMEOUT', 2))}
+    if timeout is None:
+      timeout = self.config.get('BITFIT_TIMEOUT', self.config.get('DEFAULT_TIMEOUT', 2))
+    kwargs = {'timeout': timeout}
     kwargs.setdefault('headers', {'Accept': 'application/json'})
     kwargs.setdefault('params', {'api_token': self.config['BITFIT_API_TOKEN']})
     kwargs['params'].update(_params)
+    kwargs['pool'] = stethoscope.plugins.pool.pool_for(self)
 
-    return txwebretry.ExponentialBackoffRetry(3)(treq.get, url, **kwargs)
+    return stethoscope.plugins.concurrency.run_limited_with_retry(self,
+        txwebretry.ExponentialBackoffRetry(3), read, treq.get, url, **kwargs)
 
-  def get_userinfo_by_email(self, email):
-    deferred = self.get('users', search=email)
-    deferred.addCallback(check_response, resource='userinfo')
-    deferred.addCallback(treq.content)
+  @staticmethod
+  def _decode_response(response, spec=True):
+    """Decode a JSON response as its body arrives, keeping only the parts given by `spec`."""
+    decoder = stethoscope.plugins.streaming.StreamingJSONDecoder(spec)
+    deferred = treq.collect(response, decoder.feed)
+    deferred.addCallback(lambda _: decoder.close())
+    return deferred
+
+  def _get_all(self, path, spec, params=None, page=1, items=None, seen=None):
+    """Return all items of the list at `path`, requesting it one page at a time.
+
+    Listing stops at the first page which is short or holds no items not already listed (e.g., if
+    bitfit ignores the paging parameters and returns the whole list every time), and fails after
+    ``BITFIT_MAX_PAGES`` pages.
+    """
+    items = list() if items is None else items
+    seen = set() if seen is None else seen
+    page_size = self.config.get('BITFIT_PAGE_SIZE',
+        stethoscope.plugins.sources.bitfit.base.DEFAULT_PAGE_SIZE)
+    max_pages = self.config.get('BITFIT_MAX_PAGES',
+        stethoscope.plugins.sources.bitfit.base.DEFAULT_MAX_PAGES)
+    if page > max_pages:
+      raise Exception("bitfit listing of {!r} exceeded {:d} pages".format(path, max_pages))
+    _params = dict(params or {}, page=page, per_page=page_size)
+
+    deferred = self.get(path, timeout=self.config.get('BITFIT_BULK_TIMEOUT', 60),
+        read=lambda response: self._decode_response(check_response(response, resource=path), spec),
+        **_params)
+
+    def _next_page(response):
+      page_items = response.get('items', [])
+      new_items = [item for item in page_items if item.get('id') not in seen]
+      items.extend(new_items)
+      seen.update(item.get('id') for item in new_items)
+      if len(page_items) < page_size or len(new_items) == 0:
+        return items
+      return self._get_all(path, spec, params, page + 1, items, seen)
+    deferred.addCallback(_next_page)
+    return deferred
+
+  def _build_index(self):
+    started = time.time()
+    if self._debug:
+      asset_spec = True
+    else:
+      asset_spec = {'items': [dict(stethoscope.plugins.sources.bitfit.base.ASSET_SPEC['item'],
+                                   id=True, user_id=True)]}
+    deferred = defer.gatherResults([
+      self._get_all('users', True),
+      self._get_all('assets', asset_spec, self.config.get('BITFIT_ASSET_LIST_PARAMS')),
+    ], consumeErrors=True)
+    deferred.addCallback(lambda results: self._index_assets(*results, created=started))
+    deferred.addCallback(lambda _: None)
+    return deferred
+
+  def refresh_index(self):
+    """List all of bitfit's users and assets and rebuild `asset_index` from them."""
+    deferred = self.index_refresh.call('index', self._build_index)
+    deferred.addCallback(lambda _: self.asset_index)
+    return deferred
+
+  def prefetch_devices(self, emails=None):
+    """Index all users and assets ahead of many lookups (see `AssetIndex`).
+
+    The index is only built for many users (at least ``BITFIT_BULK_THRESHOLD``, by default 500), or
+    if `emails` is `None`.
+    """
+    threshold = self.config.get('BITFIT_BULK_THRESHOLD',
+        stethoscope.plugins.sources.bitfit.base.DEFAULT_BULK_THRESHOLD)
+    if emails is not None and len(emails) < threshold:
+      return defer.succeed(None)
+    return self.refresh_index()
+
+  def _get_index(self):
+    """Return a `Deferred` firing with the index to answer lookups from, or `None` if there is none.
+
+    With ``BITFIT_BULK_INDEX`` set (e.g., for the API server), the index is built on first use and
+    rebuilt (in the background, while lookups are still answered from the current index) once it is
+    ``BITFIT_BULK_REFRESH`` seconds old. If it can't be built, lookups fall back to searching
+    bitfit directly.
+    """
+    index = self.asset_index
+    if not self.config.get('BITFIT_BULK_INDEX', False):
+      return defer.succeed(index)
+
+    if index is None:
+      deferred = self.refresh_index()
+
+      def _fall_back(failure):
+        logger.warning("failed to index bitfit assets: {!s}", failure.getErrorMessage())
+        return None
+      deferred.addErrback(_fall_back)
+      return deferred
+
+    refresh = self.config.get('BITFIT_BULK_REFRESH',
+        stethoscope.plugins.sources.bitfit.base.DEFAULT_BULK_REFRESH)
+    if time.time() - index.created >= refresh and 'index' not in self.index_refresh:
+      self.refresh_index().addErrback(lambda failure: logger.warning(
+        "failed to refresh bitfit asset index: {!s}", failure.getErrorMessage()))
+    return defer.succeed(index)
+
+  @staticmethod
+  def _get_indexed_user(index, email):
+    user = index.get_user(email)
+    if user is None:
+      raise stethoscope.api.exceptions.UserNotFoundException(email)
+    return user
+
+  def _search_userinfo(self, email):
+    deferred = self.get('users', search=email,
+        read=lambda response: treq.content(check_response(response, resource='userinfo')))
     deferred.addCallback(json.loads)
     deferred.addCallback(self._process_userinfo, email)
     return deferred
 
+  def get_userinfo_by_email(self, email):
+    deferred = self._get_index()
+    deferred.addCallback(lambda index: self._search_userinfo(email) if index is None else
+                         self._get_indexed_user(index, email))
+    return deferred
+
   def _get_device_by_id(self, device_id):
-    deferred = self.get('/'.join(['assets', str(device_id)]))
-    deferred.addCallback(check_response, resource='device')
-    deferred.addCallback(treq.content)
-    # deferred.addCallback(stethoscope.api.utils.write_to_file,
-    #   filename="tmp/asset_response_{:d}.json".format(device_id))
-    deferred.addCallback(json.loads)
+    spec = True if self._debug else stethoscope.plugins.sources.bitfit.base.ASSET_SPEC
+    deferred = self.get('/'.join(['assets', str(device_id)]),
+        read=lambda response: self._decode_response(check_response(response, resource='device'),
+          spec))
     deferred.addCallback(self._process_device)
     return deferred
 
-  def _get_device_details(self, devices_response):
-    # logger.debug("bitfit devices:\n{!s}", json.dumps(devices_response, indent=2))
-    deferreds = [self._get_device_by_id(device['id'])
-        for device in devices_response.get('items', [])]
+  def _get_indexed_device(self, index, asset_id):
+    device = index.get_device(asset_id)
+    if device is not None:
+      return defer.succeed(device)
+
+    deferred = self._get_device_by_id(asset_id)
+
+    def _add_device(_device):
+      index.add_device(asset_id, _device)
+      return _device
+    deferred.addCallback(_add_device)
+    return deferred
+
+  def _get_devices(self, deferreds):
     deferred_list = defer.DeferredList(deferreds, consumeErrors=True)
 
     # shouldn't fail since we're working off bitfit's own data for the inputs
@@ -63,18 +205,57 @@ class DeferredBitfitDataSource(stethoscope.plugins.sources.bitfit.base.BitfitDat
         context=sys._getframe().f_code.co_name, level=logbook.ERROR)
     return deferred_list
 
+  def _get_device_details(self, devices_response):
+    # logger.debug("bitfit devices:\n{!s}", json.dumps(devices_response, indent=2))
+    return self._get_devices([self._get_device_by_id(device['id'])
+                              for device in devices_response.get('items', [])])
+
+  def _get_indexed_devices(self, index, asset_ids):
+    return self._get_devices([self._get_indexed_device(index, asset_id)
+                              for asset_id in asset_ids])
+
   def _get_devices_by_userid(self, userid):
-    deferred = self.get('/'.join(['users', str(userid), 'assets']))
-    deferred.addCallback(check_response, resource='user assets')
-    deferred.addCallback(treq.content)
-    # deferred.addCallback(stethoscope.api.utils.write_to_file,
-    #   filename="tmp/devices_response.json")
-    deferred.addCallback(json.loads)
+    spec = stethoscope.plugins.sources.bitfit.base.ASSETS_SPEC
+    deferred = self.get('/'.join(['users', str(userid), 'assets']),
+        read=lambda response: self._decode_response(check_response(response,
+          resource='user assets'), spec))
     deferred.addCallback(self._get_device_details)
     return deferred
 
-  def get_devices_by_email(self, email):
-    deferred = self.get_userinfo_by_email(email)
+  def _search_devices_by_email(self, email):
+    deferred = self._search_userinfo(email)
     deferred.addCallback(operator.itemgetter('id'))
     deferred.addCallback(self._get_devices_by_userid)
     return deferred
+
+  def _get_devices_by_email(self, index, email):
+    if index is None:
+      return self._search_devices_by_email(email)
+    asset_ids = index.get_asset_ids_by_email(email)
+    if asset_ids is None:
+      raise stethoscope.api.exceptions.UserNotFoundException(email)
+    return self._get_indexed_devices(index, asset_ids)
+
+  def get_devices_by_email(self, email):
+    deferred = self._get_index()
+    deferred.addCallback(self._get_devices_by_email, email)
+    return deferred
+
+  def _get_devices_by_asset_id(self, index, asset_id):
+    if asset_id is None:
+      return []
+    return self._get_indexed_devices(index, [asset_id])
+
+  def get_devices_by_serial(self, serial):
+    """Return the devices with the given serial number (only answered from the index)."""
+    deferred = self._get_index()
+    deferred.addCallback(lambda index: [] if index is None else
+                         self._get_devices_by_asset_id(index, index.get_asset_id_by_serial(serial)))
+    return deferred
+
+  def get_devices_by_macaddr(self, addr):
+    """Return the devices with the given MAC address (only answered from the index)."""
+    deferred = self._get_index()
+    deferred.addCallback(lambda index: [] if index is None else
+                         self._get_devices_by_asset_id(index, index.get_asset_id_by_macaddr(addr)))
+    return deferred
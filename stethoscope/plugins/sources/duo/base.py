@@ -7,9 +7,19 @@ import time
 import duo_client
 
 import stethoscope.configurator
+import stethoscope.plugins.events
+import stethoscope.plugins.journal
 import stethoscope.plugins.sources.duo.utils
 
 
+# authentication log entries are kept (and, on startup, backfilled) for `DUO_RETENTION` seconds, up
+# to `DUO_MAX_EVENTS` entries in all
+DEFAULT_RETENTION = 60 * 60 * 12
+DEFAULT_MAX_EVENTS = 500000
+# how often (in seconds) the deferred plugin polls for new authentication log entries
+DEFAULT_POLL_INTERVAL = 60
+
+
 class DuoDataSourceBase(stethoscope.configurator.Configurator):
 
   config_keys = (
@@ -19,25 +29,45 @@ class DuoDataSourceBase(stethoscope.configurator.Configurator):
   )
 
   def __init__(self, *args, **kwargs):
-    self._events = list()
     super(DuoDataSourceBase, self).__init__(*args, **kwargs)
+    # on startup, events are replayed from the journal (if any), so that only entries after the
+    # latest one journaled need be retrieved
+    journal = None
+    if self.config.get('DUO_EVENT_JOURNAL') is not None:
+      journal = stethoscope.plugins.journal.EventJournal(self.config['DUO_EVENT_JOURNAL'],
+          name='duo')
+    self.event_store = stethoscope.plugins.events.EventStore(
+        retention=self.config.get('DUO_RETENTION', DEFAULT_RETENTION),
+        max_events=self.config.get('DUO_MAX_EVENTS', DEFAULT_MAX_EVENTS), name='duo',
+        journal=journal, key=stethoscope.plugins.events.get_event_id)
 
   def connect(self):
     return duo_client.Admin(self.config['DUO_INTEGRATION_KEY'],
         self.config['DUO_SECRET_KEY'], self.config['DUO_API_HOSTNAME'])
 
   def update_events(self):
-    # TODO: fix so events list doesn't grow arbitrarily large over time
     end = int(time.time())
-    if len(self._events) > 0:
-      start = self._events[-1]['timestamp'].timestamp + 1
+    if self.event_store.latest is not None:
+      start = self.event_store.latest + 1
     else:
-      start = end - (60 * 60 * 12)
-    self._events.extend(stethoscope.plugins.sources.duo.utils.parse_duo_auth_log(
-      stethoscope.plugins.sources.duo.utils.get_auth_log(self.connection, start, end)))
+      start = end - self.event_store.retention
+    auth_log = stethoscope.plugins.sources.duo.utils.get_auth_log(self.connection, start, end)
+    events = stethoscope.plugins.sources.duo.utils.parse_duo_auth_log(auth_log,
+        include_raw=self._debug)
+    for entry, event in zip(auth_log, events):
+      self.event_store.add(entry['username'], entry['timestamp'], event)
+    self.event_store.flush()
 
-  def get_events_by_email(self, email):
-    """Retrieve Duo authentication log entries for given user."""
+  def get_events_by_email(self, email, before=None, limit=None):
+    """Retrieve Duo authentication log entries for given user (most recent first).
+
+    If given, only the `limit` most recent entries following `before` (a
+    `stethoscope.utils.PageCursor`) are returned.
+    """
     self.update_events()
-    username = email.split('@')[0]
-    return [event for event in self._events if event['username'] == username]
+    return self._get_stored_events(email, before=before, limit=limit)
+
+  def _get_stored_events(self, email, before=None, limit=None):
+    if before is not None:
+      before = before._replace(timestamp=before.timestamp.float_timestamp)
+    return self.event_store.get_recent(email.split('@')[0], before=before, limit=limit)
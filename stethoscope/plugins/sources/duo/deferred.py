@@ -3,9 +3,9 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import logbook
-from twisted.internet import threads
 
 import stethoscope.configurator
+import stethoscope.plugins.poller
 import stethoscope.plugins.sources.duo.base
 
 
@@ -16,11 +16,33 @@ class DeferredDuoDataSource(
     stethoscope.plugins.sources.duo.base.DuoDataSourceBase,
     stethoscope.configurator.Configurator,
   ):
+  """Serves authentication log entries from the event store, which is kept current by polling.
+
+  The first lookup starts a `Poller` which runs `update_events` in a thread every
+  ``DUO_POLL_INTERVAL`` seconds, using a single Duo client. Polls never overlap (or retrieve the
+  same entries twice). Lookups wait only for the first poll (which backfills the retention window);
+  after that, they read only the event store.
+  """
+
+  def __init__(self, *args, **kwargs):
+    super(DeferredDuoDataSource, self).__init__(*args, **kwargs)
+    self._connection = None
+    self.poller = stethoscope.plugins.poller.Poller(self.update_events,
+        self.config.get('DUO_POLL_INTERVAL',
+          stethoscope.plugins.sources.duo.base.DEFAULT_POLL_INTERVAL), name='duo')
+    if self.event_store.journal is not None:
+      from twisted.internet import reactor
+      reactor.addSystemEventTrigger('before', 'shutdown', self.event_store.journal.close)
 
   @property
   def connection(self):
-    # TODO: fix so that every request doesn't require a new connection
-    return self.connect()
-
-  def get_events_by_email(self, email):
-    return threads.deferToThread(super(DeferredDuoDataSource, self).get_events_by_email, email)
+    # used only from the poller's thread, one poll at a time
+    if self._connection is None:
+      self._connection = self.connect()
+    return self._connection
+
+  def get_events_by_email(self, email, before=None, limit=None):
+    self.poller.start()
+    deferred = self.poller.wait()
+    deferred.addCallback(lambda _: self._get_stored_events(email, before=before, limit=limit))
+    return deferred
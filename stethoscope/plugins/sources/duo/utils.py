@@ -2,6 +2,7 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+import hashlib
 from datetime import datetime
 
 import arrow
@@ -38,13 +39,30 @@ def get_auth_log(admin_api, start, end):
   return auth_log
 
 
-def parse_duo_auth_log(auth_log):
-  """Parse entries in Duo's authentication log format."""
+def get_entry_id(entry):
+  """Return an id for an authentication log entry: its ``txid``, if it has one, or else a digest of
+  the entry's values (which tells apart entries with the same timestamp).
+
+  >>> get_entry_id({'txid': 'abc', 'timestamp': 1500000000})
+  'abc'
+  >>> get_entry_id({'timestamp': 1500000000, 'ip': '192.0.2.1'})
+  'fc6c7e1b267920cb'
+
+  """
+  if entry.get('txid'):
+    return entry['txid']
+  values = '\x1f'.join('{!s}'.format(entry[key]) for key in sorted(entry))
+  return hashlib.sha1(values.encode('utf-8')).hexdigest()[:16]
+
+
+def parse_duo_auth_log(auth_log, include_raw=False):
+  """Parse entries in Duo's authentication log format (keeping the entries as `_raw` if asked)."""
   events = list()
   for entry in auth_log:
     dt = arrow.get(entry['timestamp'])
     event = {
       'source': 'duo',
+      'id': get_entry_id(entry),
       'type': entry['factor'],
       'reason': entry['reason'],
       'timestamp': dt,
@@ -62,8 +80,9 @@ def parse_duo_auth_log(auth_log):
         "Reason: {reason!s}<br/>"
         "Enrollment: {new_enrollment!s}<br/>"
       ).format(dt=dt, **entry),
-      '_raw': entry,
     }
+    if include_raw:
+      event['_raw'] = entry
     # logger.debug("DUO AUTH LOG ENTRY: {!s}\n  entry: {!r}\n  event: {!r}", dt, entry, event)
     events.append(event)
   return events
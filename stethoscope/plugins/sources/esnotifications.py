@@ -14,18 +14,79 @@ import stethoscope.plugins.mixins.es
 
 logger = logbook.Logger(__name__)
 
+# Elasticsearch's own default number of hits per search
+DEFAULT_MAX_RESULTS = 10
+# the field by which notifications are merged (see `ElasticSearchNotifications.normalize`)
+TIMESTAMP_FIELD = 'event_timestamp'
+
 
 class ElasticSearchNotifications(stethoscope.plugins.mixins.es.ElasticSearchMixin):
-  """Example of a notifications plugin which queries an Elasticsearch cluster."""
+  """Example of a notifications plugin which queries an Elasticsearch cluster.
+
+  Notifications are sorted (most recent first, by ``ELASTICSEARCH_TIMESTAMP_FIELD`` and then, for
+  notifications with the same timestamp, by ``ELASTICSEARCH_TIEBREAKER_FIELD``, if set), limited and
+  paged by the cluster, so each lookup costs only as much as the page of notifications returned.
+  """
+
+  def __init__(self, *args, **kwargs):
+    super(ElasticSearchNotifications, self).__init__(*args, **kwargs)
+    self.timestamp_field = self.config.get('ELASTICSEARCH_TIMESTAMP_FIELD', TIMESTAMP_FIELD)
+    # sorting by ``_id`` itself requires fielddata (deprecated in Elasticsearch 7.6 and disabled by
+    # default since 8.0), so the tiebreaker must be a field (with doc values) holding the ``_id``
+    self.tiebreaker_field = self.config.get('ELASTICSEARCH_TIEBREAKER_FIELD')
+    self.source_fields = self.config.get('ELASTICSEARCH_SOURCE_FIELDS')
+    if self.source_fields is not None and self.timestamp_field not in self.source_fields:
+      # required to merge notifications from multiple plugins
+      self.source_fields = list(self.source_fields) + [self.timestamp_field]
 
   def create_query_for_email(self, search, email):
     return search.query(elasticsearch_dsl.Q({"match": {'email': email}}))
 
-  def _get_notifications_by_email(self, email):
+  def create_search(self, email, before=None, limit=None):
+    """Return the search for (a page of) `email`'s notifications.
+
+    At most `limit` (or ``ELASTICSEARCH_MAX_RESULTS``) notifications are returned, most recent
+    first, following `before` (a `stethoscope.utils.PageCursor` of a timestamp and a notification's
+    ``_id``), if given, via ``search_after``. Without ``ELASTICSEARCH_TIEBREAKER_FIELD``, the
+    cursor's ``_id`` is ignored and notifications at its timestamp are excluded. Only the
+    ``ELASTICSEARCH_SOURCE_FIELDS`` of each notification's ``_source`` are returned, if set.
+    """
     search = elasticsearch_dsl.Search(using=self.client, index=self.config['ELASTICSEARCH_INDEX'],
       doc_type=self.config['ELASTICSEARCH_DOCTYPE'])
-
-    query = self.create_query_for_email(search, email)
+    search = self.create_query_for_email(search, email)
+
+    sort = [{self.timestamp_field: {'order': 'desc'}}]
+    if self.tiebreaker_field is not None:
+      sort.append({self.tiebreaker_field: {'order': 'desc'}})
+    search = search.sort(*sort)
+    if limit is None:
+      limit = self.config.get('ELASTICSEARCH_MAX_RESULTS', DEFAULT_MAX_RESULTS)
+    search = search.extra(size=limit)
+    if before is not None:
+      # sort values for dates are milliseconds since the epoch; without an id, no notification with
+      # the same timestamp sorts after the empty string
+      search_after = [int(before.timestamp.float_timestamp * 1000)]
+      if self.tiebreaker_field is not None:
+        search_after.append(before.id if before.id is not None else '')
+      search = search.extra(search_after=search_after)
+    if self.source_fields is not None:
+      search = search.source(includes=self.source_fields)
+    return search
+
+  def normalize(self, hit):
+    """Return `hit` as a `dict`, with its timestamp also as ``_source.event_timestamp`` (by which,
+    with its ``_id``, notifications from every plugin are merged) if
+    ``ELASTICSEARCH_TIMESTAMP_FIELD`` is another (possibly dotted) field."""
+    hit = hit.to_dict() if hasattr(hit, 'to_dict') else dict(hit)
+    if self.timestamp_field != TIMESTAMP_FIELD:
+      value = hit['_source']
+      for name in self.timestamp_field.split('.'):
+        value = value[name]
+      hit['_source'][TIMESTAMP_FIELD] = value
+    return hit
+
+  def _get_notifications_by_email(self, email, before=None, limit=None):
+    query = self.create_search(email, before=before, limit=limit)
 
     # logger.debug("query:\n{!s}", pprint.pformat(query.to_dict()))
 
@@ -35,10 +96,11 @@ class ElasticSearchNotifications(stethoscope.plugins.mixins.es.ElasticSearchMixi
       logger.exception("Exception caught in Elasticsearch query:\n  index: {!r}\n  doc_type: {!r}\n"
                        "  query: {!s}".format(self.config['ELASTICSEARCH_INDEX'],
                          self.config['ELASTICSEARCH_DOCTYPE'], pprint.pformat(query.to_dict())))
+      raise stethoscope.plugins.mixins.es.ElasticSearchException()
 
     # logger.debug("response:\n{!s}", pprint.pformat(response.to_dict()))
 
-    return response.hits.hits
+    return [self.normalize(hit) for hit in response.hits.hits]
 
   def get_notifications_by_email(self, *args, **kwargs):
     return threads.deferToThread(self._get_notifications_by_email, *args, **kwargs)
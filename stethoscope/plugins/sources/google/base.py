@@ -2,12 +2,16 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+import collections
+import itertools
+
 import arrow
 import logbook
 import pkg_resources
 import six
-from apiclient import discovery
 
+import stethoscope.plugins.events
+import stethoscope.plugins.journal
 import stethoscope.plugins.sources.google.utils as gutils
 import stethoscope.validation
 
@@ -100,24 +104,202 @@ def parse_os_information(os):
   return data
 
 
+# login events are kept for `GOOGLE_EVENT_RETENTION` seconds, up to `GOOGLE_MAX_EVENTS` in all, when
+# prefetched or journaled to `GOOGLE_EVENT_JOURNAL`
+DEFAULT_EVENT_RETENTION = 60 * 60 * 24 * 30
+DEFAULT_MAX_EVENTS = 500000
+# how often (in seconds) the deferred plugin polls for all users' login events, when prefetched
+DEFAULT_EVENT_POLL_INTERVAL = 60 * 5
+# how far (in seconds) before the latest login event stored each request for newer events starts, so
+# that events the reports API makes available late are still retrieved
+DEFAULT_EVENT_POLL_LAG = 60 * 60
+
+
+class DeviceIndex(object):
+  """Raw mobile and ChromeOS device records indexed by (lower-cased) user email.
+
+  If `emails` is `None`, the index covers every user in the domain; otherwise it covers only the
+  given users (and lookups for any other user must go to the API).
+  """
+
+  def __init__(self, emails=None):
+    self.emails = emails
+    self.mobile = collections.defaultdict(list)
+    self.chromeos = collections.defaultdict(list)
+
+  def __len__(self):
+    return sum(len(devices) for devices in six.itervalues(self.mobile)) + \
+        sum(len(devices) for devices in six.itervalues(self.chromeos))
+
+  def covers(self, email):
+    return self.emails is None or email.lower() in self.emails
+
+  def add_mobile_device(self, raw, email=None):
+    for owner in ([email] if email is not None else raw.get('email', [])):
+      self.mobile[owner.lower()].append(raw)
+
+  def add_chromeos_device(self, raw, email=None):
+    if email is None:
+      recent_users = raw.get('recentUsers', [])
+      email = recent_users[0].get('email') if len(recent_users) > 0 else None
+    if email is not None:
+      self.chromeos[email.lower()].append(raw)
+
+
 class GoogleDataSourceBase(object):
 
-  def get_events_by_email(self, email, max_results=500, batch_size=500):
-    service = discovery.build('admin', 'reports_v1', http=self.connection)
+  # populated by `prefetch_devices` for bulk (i.e., batch) lookups
+  device_index = None
+  # login events, if prefetched or journaled (see `_create_event_store`)
+  event_store = None
+
+  def _create_event_store(self):
+    """Return an `EventStore` for login events, if prefetched or journaled (else `None`).
+
+    Events are prefetched for all users if ``GOOGLE_EVENT_PREFETCH`` is set, and journaled to
+    ``GOOGLE_EVENT_JOURNAL`` if it is set.
+    """
+    journal = None
+    if self.config.get('GOOGLE_EVENT_JOURNAL') is not None:
+      journal = stethoscope.plugins.journal.EventJournal(self.config['GOOGLE_EVENT_JOURNAL'],
+          name='google')
+    elif not self.config.get('GOOGLE_EVENT_PREFETCH', False):
+      return None
+    return stethoscope.plugins.events.EventStore(
+        retention=self.config.get('GOOGLE_EVENT_RETENTION', DEFAULT_EVENT_RETENTION),
+        max_events=self.config.get('GOOGLE_MAX_EVENTS', DEFAULT_MAX_EVENTS), name='google',
+        journal=journal, key=stethoscope.plugins.events.get_event_id)
+
+  def _request_login_activities(self, user_key, batch_size=500, start_time=None, end_time=None):
+    """Return the reports API resource and the request for the first page of login activities for
+    `user_key` (between `start_time` and `end_time`, if given), most recent first."""
+    service = self.service('admin', 'reports_v1')
     resource = service.activities()
 
-    request = resource.list(applicationName='login', userKey=email,
-        maxResults=min([max_results, batch_size]))
-    activities = gutils.execute_batch(resource, request, 'items', max_results=max_results)
+    kwargs = {}
+    if start_time is not None:
+      kwargs['startTime'] = start_time.isoformat()
+    if end_time is not None:
+      kwargs['endTime'] = end_time.isoformat()
+    return resource, resource.list(applicationName='login', userKey=user_key,
+        maxResults=batch_size, **kwargs)
+
+  def _store_events(self, activities, email=None):
+    """Add events for `activities` (most recent first) to the event store, indexed by user.
+
+    Events are stored for `email`, if given, or else for each activity's actor. Events older than
+    the retention window, or already stored, are skipped.
+    """
+    cutoff = arrow.utcnow().float_timestamp - self.event_store.retention
+    added = 0
+    for activity in activities:
+      user = email if email is not None else activity.get('actor', {}).get('email')
+      if user is None:
+        continue
+      event = gutils.parse_activity(activity)
+      timestamp = event['timestamp'].float_timestamp
+      if timestamp >= cutoff:
+        if not self._debug:
+          del event['_raw']
+        added += self.event_store.add_new(user.lower(), timestamp, event)
+    self.event_store.flush()
+    return added
+
+  def _get_stored_events(self, email, max_results, before=None):
+    if before is not None:
+      before = before._replace(timestamp=before.timestamp.float_timestamp)
+    return self.event_store.get_recent(email.lower(), before=before, limit=max_results)
+
+  def _list_events(self, email, max_results, batch_size, before=None):
+    """Return `email`'s login events (at most `max_results`), most recent first, following `before`
+    (a `stethoscope.utils.PageCursor`), if given.
+
+    Since events with the same timestamp are ordered by id, every event with the timestamp of the
+    last one returned is retrieved before choosing among them.
+    """
+    end_time = None
+    if before is not None:
+      # the reports API's `endTime` may exclude events at `before` itself
+      end_time = before.timestamp.shift(microseconds=+1000)
+    resource, request = self._request_login_activities(email, min([max_results, batch_size]),
+        end_time=end_time)
+    activities = itertools.chain.from_iterable(gutils.execute_pages(resource, request, 'items'))
+    events = list()
+    for activity in activities:
+      event = gutils.parse_activity(activity)
+      if len(events) >= max_results and event['timestamp'] < events[-1]['timestamp']:
+        break
+      if before is None or before.precedes(event['timestamp'],
+                                           stethoscope.plugins.events.get_event_id(event)):
+        events.append(event)
+    events.sort(key=stethoscope.plugins.events.get_sort_key, reverse=True)
+    return events[:max_results]
+
+  def _get_start_time(self, latest):
+    """Return the time from which to request events newer than `latest` (or `None`), allowing
+    ``GOOGLE_EVENT_POLL_LAG`` seconds for events which the reports API makes available late."""
+    if latest is None:
+      return None
+    return arrow.get(latest - self.config.get('GOOGLE_EVENT_POLL_LAG', DEFAULT_EVENT_POLL_LAG))
+
+  def _update_user_events(self, email, batch_size):
+    """Add `email`'s login events since the most recent one stored for the user to the store.
 
-    if not activities:
+    The user's first lookup retrieves the whole retention window (however few events it returns).
+    Once a user's events have been stored (or replayed from the journal), each lookup retrieves only
+    recent events.
+    """
+    start_time = self._get_start_time(self.event_store.latest_for(email.lower()))
+    if start_time is None:
+      start_time = arrow.utcnow().shift(seconds=-self.event_store.retention)
+    resource, request = self._request_login_activities(email, batch_size=batch_size,
+        start_time=start_time)
+    for activities in gutils.execute_pages(resource, request, 'items'):
+      self._store_events(activities, email=email)
+
+  def update_events(self, batch_size=1000):
+    """Add every user's login events since the most recent one stored to the event store.
+
+    The first update retrieves the whole retention window. The reports API is thus queried once per
+    update (i.e., ``GOOGLE_EVENT_POLL_INTERVAL``) rather than once per user looked up. Events are
+    stored a page at a time, as they are retrieved.
+    """
+    start_time = self._get_start_time(self.event_store.latest)
+    if start_time is None:
+      start_time = arrow.utcnow().shift(seconds=-self.event_store.retention)
+    resource, request = self._request_login_activities('all', batch_size=batch_size,
+        start_time=start_time)
+    added = retrieved = 0
+    for activities in gutils.execute_pages(resource, request, 'items'):
+      added += self._store_events(activities)
+      retrieved += len(activities)
+    logger.debug("stored {:d} of {:d} login events since {!s}", added, retrieved, start_time)
+
+  def get_events_by_email(self, email, max_results=500, batch_size=500, before=None, limit=None):
+    """Return `email`'s login events (at most `max_results`, or `limit` if given), most recent
+    first, following `before` (a `stethoscope.utils.PageCursor`), if given.
+
+    Unless prefetched, events following `before` are requested from the reports API, since the
+    journaled events of a user need not reach back that far.
+    """
+    if limit is not None:
+      max_results = limit
+    if self.config.get('GOOGLE_EVENT_PREFETCH', False):
+      self.update_events()
+      events = self._get_stored_events(email, max_results, before=before)
+    elif self.event_store is not None and before is None:
+      self._update_user_events(email, batch_size)
+      events = self._get_stored_events(email, max_results)
+    else:
+      events = self._list_events(email, max_results, batch_size, before=before)
+
+    if not events:
       logger.warn("no google login events found for user '{:s}'", email)
       return []
-
-    return [gutils.parse_activity(activity) for activity in activities]
+    return events
 
   def get_userinfo_by_email(self, email):
-    directory = discovery.build('admin', 'directory_v1', http=self.connection)
+    directory = self.service('admin', 'directory_v1')
     return gutils.execute_request(directory.users().get(userKey=email))
 
   def get_account_by_email(self, email):
@@ -135,13 +317,13 @@ class GoogleDataSourceBase(object):
     }
 
   def get_userusage(self, email):
-    reports = discovery.build('admin', 'reports_v1', http=self.connection)
+    reports = self.service('admin', 'reports_v1')
     date = arrow.utcnow().replace(days=-3)
     reports_request = reports.userUsageReport().get(userKey=email, date=date.format('YYYY-MM-DD'))
     return gutils.execute_request(reports_request)
 
   def get_tokens(self, email):
-    directory = discovery.build('admin', 'directory_v1', http=self.connection)
+    directory = self.service('admin', 'directory_v1')
     return gutils.execute_request(directory.tokens().list(userKey=email))
 
   def _check_jailed(self, raw, last_updated):
@@ -264,34 +446,128 @@ class GoogleDataSourceBase(object):
     data['source'] = 'google'
     return data
 
+  def _mobile_devices_request(self, resource, email=None, batch_size=1000):
+    query = None if email is None else 'email:{!s}'.format(email)
+    return resource.list(customerId='my_customer', query=query, projection="FULL",
+        maxResults=batch_size)
+
+  def _chromeos_devices_request(self, resource, email=None, batch_size=1000):
+    query = None if email is None else 'recent_user:{!s}'.format(email)
+    return resource.list(customerId='my_customer', query=query, projection="FULL",
+        maxResults=batch_size)
+
   def _get_mobile_devices_by_email(self, email, batch_size=1000):
-    service = discovery.build('admin', 'directory_v1', http=self.connection)
-    resource = service.mobiledevices()
-    request = resource.list(customerId='my_customer', query='email:{!s}'.format(email),
-        projection="FULL", maxResults=batch_size)
-    mobile_devices = gutils.execute_batch(resource, request, 'mobiledevices')
+    index = self.device_index
+    if index is not None and index.covers(email):
+      mobile_devices = index.mobile.get(email.lower(), [])
+    else:
+      service = self.service('admin', 'directory_v1')
+      resource = service.mobiledevices()
+      request = self._mobile_devices_request(resource, email, batch_size=batch_size)
+      mobile_devices = gutils.execute_batch(resource, request, 'mobiledevices')
     # logger.debug("found {:d} mobile devices", len(mobile_devices))
     # logger.debug("mobile devices:\n{!s}", pprint.pformat(mobile_devices))
     return [self._process_mobile_device(raw) for raw in mobile_devices]
 
   def _get_chromeos_devices_by_email(self, email, batch_size=1000):
-    service = discovery.build('admin', 'directory_v1', http=self.connection)
-    resource = service.chromeosdevices()
-    request = resource.list(customerId='my_customer', query='recent_user:{!s}'.format(email),
-        projection="FULL", maxResults=batch_size)
-    chromeos_devices = gutils.execute_batch(resource, request, 'chromeosdevices')
+    index = self.device_index
+    if index is not None and index.covers(email):
+      chromeos_devices = index.chromeos.get(email.lower(), [])
+    else:
+      service = self.service('admin', 'directory_v1')
+      resource = service.chromeosdevices()
+      request = self._chromeos_devices_request(resource, email, batch_size=batch_size)
+      chromeos_devices = gutils.execute_batch(resource, request, 'chromeosdevices')
     # logger.debug("found {:d} chrome OS devices", len(chromeos_devices))
     # logger.debug("chrome OS devices:\n{!s}", pprint.pformat(chromeos_devices))
     return [self._process_chromeos_device(raw)
             for raw in chromeos_devices if filter_recent_users(raw, email)]
 
+  def prefetch_all_devices(self, batch_size=1000):
+    """Page through every mobile and ChromeOS device in the domain once, indexing them by user.
+
+    Subsequent calls to `get_devices_by_email` are served from the index (see `device_index`).
+    """
+    service = self.service('admin', 'directory_v1')
+    index = DeviceIndex()
+
+    resource = service.mobiledevices()
+    request = self._mobile_devices_request(resource, batch_size=batch_size)
+    for raw in gutils.execute_batch(resource, request, 'mobiledevices'):
+      index.add_mobile_device(raw)
+
+    resource = service.chromeosdevices()
+    request = self._chromeos_devices_request(resource, batch_size=batch_size)
+    for raw in gutils.execute_batch(resource, request, 'chromeosdevices'):
+      index.add_chromeos_device(raw)
+
+    logger.info("indexed {:d} devices for {:d} users", len(index),
+        len(set(index.mobile) | set(index.chromeos)))
+    self.device_index = index
+    return index
+
+  def prefetch_devices_by_emails(self, emails, batch_size=1000, requests_per_batch=50):
+    """Retrieve the devices of each of the given users using batch HTTP requests.
+
+    Users for whom either request fails are left out of the index (and so are looked up
+    individually later).
+    """
+    service = self.service('admin', 'directory_v1')
+    resources = {
+      'mobiledevices': (service.mobiledevices(), self._mobile_devices_request),
+      'chromeosdevices': (service.chromeosdevices(), self._chromeos_devices_request),
+    }
+
+    requests = collections.OrderedDict()
+    for idx, email in enumerate(emails):
+      for key, (resource, make_request) in six.iteritems(resources):
+        requests['{!s}-{:d}'.format(key, idx)] = make_request(resource, email,
+            batch_size=batch_size)
+    results = gutils.execute_batched(service, requests, batch_size=requests_per_batch)
+
+    index = DeviceIndex(emails=set())
+    for idx, email in enumerate(emails):
+      found = dict()
+      for key, (resource, _) in six.iteritems(resources):
+        request_id = '{!s}-{:d}'.format(key, idx)
+        response, exception = results.get(request_id, (None, None))
+        if response is None:
+          logger.warning("failed to prefetch {!s} for '{!s}': {!s}", key, email, exception)
+          break
+        found[key] = response.get(key, [])
+        if response.get('nextPageToken'):
+          found[key].extend(gutils.execute_batch(resource,
+            resource.list_next(requests[request_id], response), key))
+      else:
+        for raw in found['mobiledevices']:
+          index.add_mobile_device(raw, email=email)
+        for raw in found['chromeosdevices']:
+          index.add_chromeos_device(raw, email=email)
+        index.emails.add(email.lower())
+
+    logger.info("indexed {:d} devices for {:d} of {:d} users", len(index), len(index.emails),
+        len(emails))
+    self.device_index = index
+    return index
+
+  def prefetch_devices(self, emails=None):
+    """Index devices for `emails` (or all users) ahead of many calls to `get_devices_by_email`.
+
+    For many users (at least ``GOOGLE_BULK_THRESHOLD``, by default 500), or if `emails` is `None`,
+    all devices in the domain are listed once; for fewer, each user's devices are retrieved using
+    batch HTTP requests.
+    """
+    if emails is None or len(emails) >= self.config.get('GOOGLE_BULK_THRESHOLD', 500):
+      return self.prefetch_all_devices()
+    return self.prefetch_devices_by_emails(emails)
+
   def get_devices_by_email(self, email, batch_size=1000):
     return self._get_mobile_devices_by_email(email, batch_size=batch_size) + \
       self._get_chromeos_devices_by_email(email, batch_size=batch_size)
 
   def test_connectivity(self):
     """Executes a basic API call with no side-effects to ensure we can talk to Google."""
-    service = discovery.build('discovery', 'v1', http=self.connection)
+    service = self.service('discovery', 'v1')
     request = service.apis().list(name="discovery", preferred=True)
     response = gutils.execute_request(request)
     # logger.debug("connectivity test response:\n{:s}", pprint.pformat(response))
@@ -3,14 +3,18 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import sys
+import threading
 from itertools import chain
 
 import httplib2
 import logbook
+from apiclient import discovery
 from twisted.internet import defer, threads
 
 import stethoscope.api.utils
 import stethoscope.configurator
+import stethoscope.plugins.concurrency
+import stethoscope.plugins.poller
 import stethoscope.plugins.sources.google.base
 
 
@@ -18,6 +22,13 @@ logger = logbook.Logger(__name__)
 
 
 class GoogleAPIConnection(stethoscope.configurator.Configurator):
+  """Provides authorized connections to, and service objects for, Google's APIs.
+
+  `httplib2.Http` objects are not thread-safe, so each thread (e.g., of the reactor's thread pool)
+  gets its own authorized `httplib2.Http` and its own service objects built on it; these are cached
+  for the thread's lifetime rather than being rebuilt (and the discovery document re-parsed) for
+  every API call. The credentials (and therefore the access token) are shared by all threads.
+  """
 
   config_keys = (
     'GOOGLE_API_SECRETS',
@@ -25,25 +36,66 @@ class GoogleAPIConnection(stethoscope.configurator.Configurator):
     'GOOGLE_API_SCOPES',
   )
 
+  def __init__(self, *args, **kwargs):
+    super(GoogleAPIConnection, self).__init__(*args, **kwargs)
+    self._local = threading.local()
+    self._credentials_lock = threading.Lock()
+
   @property
   def connection(self):
-    return self.connect()
+    """The calling thread's authorized `httplib2.Http` object."""
+    http = getattr(self._local, 'http', None)
+    if http is None:
+      http = self._local.http = self.connect()
+    return http
 
   @property
   def credentials(self):
     if getattr(self, '_credentials', None) is None:
-      try:
-        self._credentials = self.get_google_api_credentials()
-      except Exception as exc:
-        raise RuntimeError("Unable to get credentials for Google API access: {!s}".format(exc))
+      with self._credentials_lock:
+        if getattr(self, '_credentials', None) is None:
+          try:
+            self._credentials = self.get_google_api_credentials()
+          except Exception as exc:
+            raise RuntimeError("Unable to get credentials for Google API access: {!s}".format(exc))
     return self._credentials
 
   def connect(self, http=None):
-    """Get an authorized `httplib2.Http` object for interacting with Google APIs."""
+    """Get a new authorized `httplib2.Http` object for interacting with Google APIs."""
     if http is None:
       http = httplib2.Http()
     return self.credentials.authorize(http)
 
+  def refresh_token(self):
+    """Fetch a new access token if the current one is missing or expired.
+
+    Called before handing out service objects so that, when the token expires, one thread fetches
+    a new token while the others wait for it (rather than each thread refreshing independently
+    after its next request is rejected).
+    """
+    credentials = self.credentials
+    if getattr(credentials, 'access_token', None) is not None and \
+        not getattr(credentials, 'access_token_expired', False):
+      return
+    with self._credentials_lock:
+      if credentials.access_token is None or credentials.access_token_expired:
+        logger.debug("refreshing Google API access token")
+        credentials.refresh(httplib2.Http())
+
+  def build_service(self, name, version, http):
+    """Build a new service object for the given API; override to, e.g., use a local document."""
+    return discovery.build(name, version, http=http)
+
+  def service(self, name, version):
+    """Return the calling thread's service object for API `name` (at `version`)."""
+    self.refresh_token()
+    services = getattr(self._local, 'services', None)
+    if services is None:
+      services = self._local.services = dict()
+    if (name, version) not in services:
+      services[(name, version)] = self.build_service(name, version, http=self.connection)
+    return services[(name, version)]
+
   def get_google_api_credentials(self):
     """Create a credentials object for talking to Google APIs."""
     secrets = self.config['GOOGLE_API_SECRETS']
@@ -69,21 +121,47 @@ class DeferredGoogleDataSource(
     stethoscope.plugins.sources.google.base.GoogleDataSourceBase,
   ):
 
-  def get_events_by_email(self, email, **kwargs):
-    return threads.deferToThread(super(DeferredGoogleDataSource, self).get_events_by_email, email,
+  def __init__(self, *args, **kwargs):
+    super(DeferredGoogleDataSource, self).__init__(*args, **kwargs)
+    self.event_store = self._create_event_store()
+    if self.event_store is not None and self.event_store.journal is not None:
+      from twisted.internet import reactor
+      reactor.addSystemEventTrigger('before', 'shutdown', self.event_store.journal.close)
+
+    # with ``GOOGLE_EVENT_PREFETCH``, every user's login events are polled for (starting with the
+    # first lookup), and lookups wait only for the first poll
+    self.poller = None
+    if self.config.get('GOOGLE_EVENT_PREFETCH', False):
+      self.poller = stethoscope.plugins.poller.Poller(self.update_events,
+          self.config.get('GOOGLE_EVENT_POLL_INTERVAL',
+            stethoscope.plugins.sources.google.base.DEFAULT_EVENT_POLL_INTERVAL), name='google')
+
+  def _defer_to_thread(self, func, *args, **kwargs):
+    return stethoscope.plugins.concurrency.run_limited(self, threads.deferToThread, func, *args,
         **kwargs)
 
+  def get_events_by_email(self, email, max_results=500, before=None, limit=None, **kwargs):
+    if self.poller is None:
+      return self._defer_to_thread(super(DeferredGoogleDataSource, self).get_events_by_email,
+          email, max_results=max_results, before=before, limit=limit, **kwargs)
+    self.poller.start()
+    deferred = self.poller.wait()
+    deferred.addCallback(lambda _: self._get_stored_events(email,
+      limit if limit is not None else max_results, before=before))
+    return deferred
+
   def get_userinfo_by_email(self, email):
-    return threads.deferToThread(super(DeferredGoogleDataSource, self).get_userinfo_by_email, email)
+    return self._defer_to_thread(super(DeferredGoogleDataSource, self).get_userinfo_by_email,
+        email)
 
   def get_account_by_email(self, email):
-    return threads.deferToThread(super(DeferredGoogleDataSource, self).get_account_by_email, email)
+    return self._defer_to_thread(super(DeferredGoogleDataSource, self).get_account_by_email, email)
 
   def get_devices_by_email(self, email):
     deferred_list = defer.DeferredList([
-        threads.deferToThread(super(DeferredGoogleDataSource, self)._get_mobile_devices_by_email,
+        self._defer_to_thread(super(DeferredGoogleDataSource, self)._get_mobile_devices_by_email,
           email),
-        threads.deferToThread(super(DeferredGoogleDataSource, self)._get_chromeos_devices_by_email,
+        self._defer_to_thread(super(DeferredGoogleDataSource, self)._get_chromeos_devices_by_email,
           email),
       ], consumeErrors=True)
     deferred_list.addCallback(stethoscope.api.utils.filter_by_status,
@@ -92,5 +170,8 @@ class DeferredGoogleDataSource(
     deferred_list.addCallback(list)
     return deferred_list
 
+  def prefetch_devices(self, emails=None):
+    return threads.deferToThread(super(DeferredGoogleDataSource, self).prefetch_devices, emails)
+
   def test_connectivity(self):
     return threads.deferToThread(super(DeferredGoogleDataSource, self).test_connectivity)
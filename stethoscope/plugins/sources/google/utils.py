@@ -32,6 +32,8 @@ def parse_activity(activity):
       result=result)
   event = {
     'source': 'google',
+    # distinguishes activities with the same time
+    'id': activity['id'].get('uniqueQualifier'),
     'type': 'logout' if result == 'logout' else params['login_type'],
     'success': (result in ['login_success', 'logout']),
     'reason': params.get('login_failure_type', ''),
@@ -46,16 +48,41 @@ def parse_activity(activity):
   return event
 
 
+def execute_pages(resource, request, result_key):
+  """Yield the results from each of the paginated responses to a Google API request in turn."""
+  while request:
+    response = execute_request(request)
+    yield response.get(result_key, [])
+    request = resource.list_next(request, response)
+
+
 def execute_batch(resource, request, result_key, max_results=None):
   """Get accumulated results from paginated responses to Google API requests."""
   results = list()
-  while request:
-    response = execute_request(request)
-    if result_key in response:
-      results.extend(response[result_key])
+  for page in execute_pages(resource, request, result_key):
+    results.extend(page)
     if max_results is not None and len(results) >= max_results:
       return results[:max_results]
-    request = resource.list_next(request, response)
+  return results
+
+
+def execute_batched(service, requests, batch_size=50):
+  """Execute many Google API requests using batch HTTP requests of up to `batch_size` requests each.
+
+  `requests` maps (string) request IDs to requests; returns a `dict` mapping request IDs to
+  ``(response, exception)`` pairs (one of which will be `None`).
+  """
+  results = dict()
+
+  def callback(request_id, response, exception):
+    results[request_id] = (response, exception)
+
+  items = list(six.iteritems(requests))
+  for start in six.moves.range(0, len(items), batch_size):
+    batch = service.new_batch_http_request(callback=callback)
+    for request_id, request in items[start:start + batch_size]:
+      batch.add(request, request_id=request_id)
+    batch.execute()
   return results
 
 
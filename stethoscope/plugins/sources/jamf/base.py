@@ -2,6 +2,8 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+import collections
+
 import arrow
 import logbook
 
@@ -14,6 +16,150 @@ import stethoscope.validation
 logger = logbook.Logger(__name__)
 
 
+# sections of JAMF's computer records (as named by the `/computers/.../subset/...` endpoints) which
+# `_process_device` reads: for basic information and identifiers (including the wireless MAC address
+# extension attribute), for the software inventory, and for each practice
+INFORMATION_SECTIONS = ('General', 'Hardware', 'Location', 'ExtensionAttributes')
+SOFTWARE_SECTIONS = ('Software',)
+PRACTICE_SECTIONS = {
+  'encryption': ('Hardware',),
+  'uptodate': ('Software',),
+  'autoupdate': ('ExtensionAttributes',),
+  'firewall': ('ExtensionAttributes',),
+  'screenlock': ('ExtensionAttributes',),
+  'remotelogin': ('ExtensionAttributes',),
+}
+
+
+def get_sections(practices, software=True):
+  """Return the sections of a computer record needed for the given practices (and software).
+
+  >>> get_sections(['encryption', 'firewall'], software=False)
+  ['General', 'Hardware', 'Location', 'ExtensionAttributes']
+  >>> get_sections(['uptodate'])
+  ['General', 'Hardware', 'Location', 'ExtensionAttributes', 'Software']
+
+  """
+  sections = list(INFORMATION_SECTIONS)
+  needed = list(SOFTWARE_SECTIONS) if software else []
+  for practice in practices:
+    needed.extend(PRACTICE_SECTIONS[practice])
+  for section in needed:
+    if section not in sections:
+      sections.append(section)
+  return sections
+
+
+def get_device_spec(practices, software=True):
+  """Return the parts of a computer record which `_process_device` reads for the given practices.
+
+  The result is a spec for `stethoscope.plugins.streaming.StreamingJSONDecoder`.
+
+  >>> spec = get_device_spec(['encryption'], software=False)
+  >>> sorted(spec['computer'])
+  ['extension_attributes', 'general', 'hardware', 'location']
+  >>> spec['computer']['hardware']
+  ('model', 'os_name', 'os_version', 'storage')
+
+  """
+  computer = {
+    'general': ('id', 'name', 'platform', 'serial_number', 'udid', 'mac_address', 'alt_mac_address',
+                'report_date_utc'),
+    'hardware': ('model', 'os_name', 'os_version'),
+    'location': ('email_address',),
+    'extension_attributes': True,
+  }
+  if 'encryption' in practices:
+    computer['hardware'] += ('storage',)
+
+  software_spec = dict()
+  if software:
+    software_spec['applications'] = True
+    software_spec['running_services'] = True
+  if 'uptodate' in practices:
+    software_spec['available_software_updates'] = True
+  if len(software_spec) > 0:
+    computer['software'] = software_spec
+  return {'computer': computer}
+
+
+# display fields of an advanced computer search (as named in its results) used to index computers
+SEARCH_EMAIL_FIELD = 'Email_Address'
+SEARCH_USERNAME_FIELD = 'Username'
+SEARCH_SERIAL_FIELD = 'Serial_Number'
+SEARCH_MACADDR_FIELDS = ('MAC_Address', 'Alternate_MAC_Address')
+SEARCH_SPEC = {'advanced_computer_search': {'computers': [
+  ('id', SEARCH_EMAIL_FIELD, SEARCH_USERNAME_FIELD, SEARCH_SERIAL_FIELD) + SEARCH_MACADDR_FIELDS,
+]}}
+
+DEFAULT_BULK_THRESHOLD = 500
+
+
+class ComputerIndex(object):
+  """JAMF computer IDs indexed by user email, username, serial number and MAC address.
+
+  Built from the results of an advanced computer search covering the whole fleet (see
+  `JAMFDataSourceBase._index_computers`).
+
+  >>> index = ComputerIndex()
+  >>> index.add({'id': 3001, 'Email_Address': 'PFry@example.com', 'Username': 'pfry',
+  ...            'Serial_Number': 'C02', 'MAC_Address': '00:DE:CA:FB:AD:00'})
+  >>> index.add({'id': 3002, 'Username': 'pfry'})
+  >>> index.get_ids_by_email('pfry@example.com')
+  [3001, 3002]
+  >>> index.get_id_by_serial('C02'), index.get_id_by_macaddr('00:de:ca:fb:ad:00')
+  (3001, 3001)
+
+  """
+
+  def __init__(self):
+    self.ids = set()
+    self.by_email = collections.defaultdict(list)
+    self.by_username = collections.defaultdict(list)
+    self.by_serial = dict()
+    self.by_macaddr = dict()
+
+  def __len__(self):
+    return len(self.ids)
+
+  def add(self, computer):
+    computer_id = computer['id']
+    self.ids.add(computer_id)
+    if computer.get(SEARCH_EMAIL_FIELD):
+      self.by_email[computer[SEARCH_EMAIL_FIELD].lower()].append(computer_id)
+    if computer.get(SEARCH_USERNAME_FIELD):
+      self.by_username[computer[SEARCH_USERNAME_FIELD].lower()].append(computer_id)
+    if computer.get(SEARCH_SERIAL_FIELD):
+      self.by_serial[computer[SEARCH_SERIAL_FIELD]] = computer_id
+    for field in SEARCH_MACADDR_FIELDS:
+      try:
+        macaddr = stethoscope.validation.canonicalize_macaddr(computer[field])
+      except Exception:
+        continue
+      self.by_macaddr[macaddr] = computer_id
+
+  def get_ids_by_email(self, email):
+    """Return the IDs of computers assigned to the user with the given email (or its username).
+
+    Individual lookups resolve users by username (i.e., the email's local part), so computers
+    assigned to that username are included along with those assigned to the email address.
+    """
+    ids = list(self.by_email.get(email.lower(), []))
+    for computer_id in self.by_username.get(email.split('@')[0].lower(), []):
+      if computer_id not in ids:
+        ids.append(computer_id)
+    return ids
+
+  def get_id_by_serial(self, serial):
+    return self.by_serial.get(serial)
+
+  def get_id_by_macaddr(self, addr):
+    try:
+      return self.by_macaddr.get(stethoscope.validation.canonicalize_macaddr(addr))
+    except Exception:
+      return None
+
+
 def inject_last_updated(data, last_updated):
   data['last_updated'] = last_updated
   return data
@@ -27,6 +173,29 @@ class JAMFDataSourceBase(stethoscope.configurator.Configurator):
     'JAMF_API_HOSTADDR',
   )
 
+  # populated by `prefetch_devices` for bulk (i.e., batch) lookups
+  computer_index = None
+
+  def __init__(self, *args, **kwargs):
+    super(JAMFDataSourceBase, self).__init__(*args, **kwargs)
+
+    self.practices = set(self.config.get('JAMF_PRACTICES', PRACTICE_SECTIONS))
+    self.include_software = self.config.get('JAMF_SOFTWARE', True)
+    self.sections = get_sections(sorted(self.practices), software=self.include_software)
+    # parts of computer records to decode (all of them if raw records are kept, for debugging)
+    self.device_spec = True if self._debug else get_device_spec(self.practices,
+        software=self.include_software)
+
+  def _computer_path(self, path):
+    """Return the path of the subset of the computer record at `path` which we use.
+
+    Full records (which also include, e.g., every certificate, plugin, font and configuration
+    profile) are requested instead if ``JAMF_SUBSET`` is `False`.
+    """
+    if not self.config.get('JAMF_SUBSET', True):
+      return path
+    return '{!s}/subset/{!s}'.format(path, '&'.join(self.sections))
+
   def _check_uptodate(self, raw):
     updates = raw['computer']['software']['available_software_updates']
 
@@ -102,7 +271,7 @@ class JAMFDataSourceBase(stethoscope.configurator.Configurator):
     computer = raw['computer']
     # logger.debug("computer:\n{:s}".format(pprint.pformat(computer)))
 
-    attributes = jutils._parse_parameter_list(computer['extension_attributes'])
+    attributes = jutils._parse_parameter_list(computer.get('extension_attributes', []))
     # logger.debug("extension attributes:\n{:s}".format(pprint.pformat(attributes)))
 
     # INFORMATION
@@ -130,31 +299,38 @@ class JAMFDataSourceBase(stethoscope.configurator.Configurator):
 
     data['last_sync'] = last_updated
 
-    # PRACTICES
+    # PRACTICES (only those enabled, whose sections were requested; see `get_sections`)
     data['practices'] = dict()
-    data['practices']['encryption'] = inject_last_updated(self._check_encryption(raw), last_updated)
-    data['practices']['uptodate'] = inject_last_updated(self._check_uptodate(raw), last_updated)
-    data['practices']['autoupdate'] = inject_last_updated(self._check_autoupdate(attributes),
-        last_updated)
-
-    data['software'] = {'last_scan_date': last_updated}
-    data['software']['installed'] = [self._normalize_software_entry(entry) for entry in
-        raw['computer']['software']['applications']]
-    data['software']['services'] = [{'name': service} for service in
-        raw['computer']['software']['running_services']]
-
-    try:
-      practice = {'value': int(attributes['Firewall Status']) > 0}
-    except (KeyError, ValueError):
-      practice = {}
-    data['practices']['firewall'] = inject_last_updated(practice, last_updated)
+    if 'encryption' in self.practices:
+      data['practices']['encryption'] = inject_last_updated(self._check_encryption(raw),
+          last_updated)
+    if 'uptodate' in self.practices:
+      data['practices']['uptodate'] = inject_last_updated(self._check_uptodate(raw), last_updated)
+    if 'autoupdate' in self.practices:
+      data['practices']['autoupdate'] = inject_last_updated(self._check_autoupdate(attributes),
+          last_updated)
+
+    if self.include_software:
+      data['software'] = {'last_scan_date': last_updated}
+      data['software']['installed'] = [self._normalize_software_entry(entry) for entry in
+          raw['computer']['software']['applications']]
+      data['software']['services'] = [{'name': service} for service in
+          raw['computer']['software']['running_services']]
+
+    if 'firewall' in self.practices:
+      try:
+        practice = {'value': int(attributes['Firewall Status']) > 0}
+      except (KeyError, ValueError):
+        practice = {}
+      data['practices']['firewall'] = inject_last_updated(practice, last_updated)
 
     for key, attr, ok_value in [
       ('screenlock', 'Screen Saver Lock Enabled', 'Enabled'),
       ('remotelogin', 'Remote Login', 'Off'),
     ]:
-      practice = {} if attr not in attributes else {'value': attributes[attr] == ok_value}
-      data['practices'][key] = inject_last_updated(practice, last_updated)
+      if key in self.practices:
+        practice = {} if attr not in attributes else {'value': attributes[attr] == ok_value}
+        data['practices'][key] = inject_last_updated(practice, last_updated)
 
     # IDENTIFIERS
     mac_addrs = list(stethoscope.validation.filter_macaddrs(set(map(
@@ -176,6 +352,16 @@ class JAMFDataSourceBase(stethoscope.configurator.Configurator):
     # logger.debug("returned info:\n{:s}".format(pprint.pformat(data)))
     return data
 
+  def _index_computers(self, search_response):
+    """Index the computers in an advanced computer search's results (see `ComputerIndex`)."""
+    index = ComputerIndex()
+    for computer in search_response.get('advanced_computer_search', {}).get('computers', []):
+      index.add(computer)
+    logger.info("indexed {:d} computers for {:d} users", len(index),
+        len(set(index.by_email) | set(index.by_username)))
+    self.computer_index = index
+    return index
+
   @staticmethod
   def _extract_device_ids_from_userinfo(userinfo_response):
     return JAMFDataSourceBase._extract_device_ids_from_response(
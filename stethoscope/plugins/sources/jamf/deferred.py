@@ -3,7 +3,7 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import copy
-import json
+import functools
 import sys
 
 import logbook
@@ -13,7 +13,12 @@ from twisted.internet import defer
 
 import stethoscope.api.exceptions
 import stethoscope.api.utils
+import stethoscope.plugins.concurrency
+import stethoscope.plugins.metrics
+import stethoscope.plugins.pool
 import stethoscope.plugins.sources.jamf.base
+import stethoscope.plugins.store
+import stethoscope.plugins.streaming
 import stethoscope.utils
 
 
@@ -60,36 +65,100 @@ class DeferredJAMFDataSource(stethoscope.plugins.sources.jamf.base.JAMFDataSourc
       'auth': (self.config['JAMF_API_USERNAME'], self.config['JAMF_API_PASSWORD']),
       'headers': {'Accept': 'application/json'},
     }
-
-  def get(self, path, **_kwargs):
+    self.response_metrics = stethoscope.plugins.metrics.ResponseMetrics('jamf')
+
+    # processed devices from previous runs, reused while their `report_date_utc` is unchanged
+    self.device_store = None
+    self.report_dates = dict()
+    if self.config.get('JAMF_DEVICE_STORE') is not None:
+      self.device_store = stethoscope.plugins.store.DeviceStore(self.config['JAMF_DEVICE_STORE'],
+          fingerprint=self._store_fingerprint(), name='jamf')
+      from twisted.internet import reactor
+      reactor.addSystemEventTrigger('before', 'shutdown', self.save_state)
+
+  def get(self, path, read=None, **_kwargs):
+    """Request `path`, calling `read` (if given) with the response to check it and read its body.
+
+    Each attempt at the request takes its own slot under the concurrency limit (if any); the body is
+    read before the slot is released, so that the limit covers the whole exchange rather than only
+    the wait for the response headers.
+    """
     url = self.config['JAMF_API_HOSTADDR'].rstrip('/') + path
 
     kwargs = copy.deepcopy(self.kwargs)
     kwargs.update(_kwargs)
+    kwargs.setdefault('pool', stethoscope.plugins.pool.pool_for(self))
 
     logger.debug("GET '{:s}'", url)
-    return txwebretry.ExponentialBackoffRetry(3)(treq.get, url, **kwargs)
+    return stethoscope.plugins.concurrency.run_limited_with_retry(self,
+        txwebretry.ExponentialBackoffRetry(3), read, treq.get, url, **kwargs)
 
   def get_userinfo_by_email(self, email):
-    deferred = self.get('/users/name/{:s}'.format(email.split('@')[0]))
-    deferred.addCallback(check_userinfo_response, email)
-    deferred.addCallback(treq.content)
-    deferred.addCallback(json.loads)
+    deferred = self.get('/users/name/{:s}'.format(email.split('@')[0]),
+        read=lambda response: treq.content(check_userinfo_response(response, email)))
+    deferred.addCallback(self.response_metrics.decode_json, 'userinfo')
     return deferred
 
-  def _process_device_response(self, deferred):
-    deferred.addCallback(check_response, resource='device')
-    deferred.addCallback(treq.content)
-    # deferred.addCallback(stethoscope.api.utils.write_to_file, filename="device.json")
-    deferred.addCallback(json.loads)
-    deferred.addCallback(self._process_device)
+  def _decode_response(self, response, resource, spec=True):
+    """Decode a JSON response as its body arrives, keeping only the parts given by `spec`."""
+    decoder = stethoscope.plugins.streaming.StreamingJSONDecoder(spec)
+    deferred = treq.collect(response, decoder.feed)
+    deferred.addCallback(lambda _: self.response_metrics.finish_decoding(decoder, resource))
     return deferred
 
-  def _get_device_by_id(self, device_id):
-    deferred = self.get('/computers/id/{:d}'.format(device_id))
-    deferred = self._process_device_response(deferred)
+  def _get_device(self, path, check=None):
+    if check is None:
+      check = functools.partial(check_response, resource='device')
+    deferred = self.get(path, read=lambda response:
+                        self._decode_response(check(response), 'device', self.device_spec))
+    deferred.addCallback(self._process_and_store_device)
     return deferred
 
+  def _store_fingerprint(self):
+    return '&'.join(self.sections) + ';' + ','.join(sorted(self.practices)) + \
+        ';software={!s};debug={!s}'.format(self.include_software, self._debug)
+
+  def _process_and_store_device(self, raw):
+    device = self._process_device(raw)
+    if self.device_store is not None and device is not None:
+      general = raw['computer']['general']
+      self.device_store.put(general['id'], general.get('report_date_utc'), device)
+    return device
+
+  def _fetch_device_by_id(self, device_id):
+    return self._get_device(self._computer_path('/computers/id/{:d}'.format(device_id)))
+
+  def _get_stored_device(self, report_date, device_id):
+    device = self.device_store.get(device_id, report_date)
+    if device is None:
+      return self._fetch_device_by_id(device_id)
+    return device
+
+  def _get_report_date(self, device_id):
+    deferred = self.get('/computers/id/{:d}/subset/General'.format(device_id),
+        read=lambda response: self._decode_response(check_response(response, resource='device'),
+          'device_general', {'computer': {'general': ('report_date_utc',)}}))
+    deferred.addCallback(lambda raw: raw['computer']['general'].get('report_date_utc'))
+    return deferred
+
+  def _get_device_by_id(self, device_id):
+    """Return the device with the given ID, reusing its stored copy if it has not been updated.
+
+    A computer's report date is known without a request after a bulk prefetch (see
+    `prefetch_devices`); otherwise, it is retrieved (using the small ``General`` subset) only for
+    computers which are in the store.
+    """
+    if self.device_store is None:
+      return self._fetch_device_by_id(device_id)
+
+    if device_id in self.report_dates:
+      return defer.maybeDeferred(self._get_stored_device, self.report_dates[device_id], device_id)
+    if device_id in self.device_store:
+      deferred = self._get_report_date(device_id)
+      deferred.addCallback(self._get_stored_device, device_id)
+      return deferred
+    return defer.maybeDeferred(self._get_stored_device, None, device_id)
+
   def _get_devices_by_id(self, device_ids):
     deferred_list = defer.DeferredList([self._get_device_by_id(device_id) for device_id in
       device_ids], consumeErrors=True)
@@ -100,29 +169,89 @@ class DeferredJAMFDataSource(stethoscope.plugins.sources.jamf.base.JAMFDataSourc
     return deferred_list
 
   def get_devices_by_serial(self, serial):
-    deferred = self.get('/computers/serialnumber/{!s}'.format(serial))
-    deferred.addCallback(check_device_response, "serial: '{!s}'".format(serial))
-    deferred = self._process_device_response(deferred)
+    computer_id = self.computer_index.get_id_by_serial(serial) if self.computer_index else None
+    if computer_id is not None:
+      return self._get_devices_by_id([computer_id])
+
+    deferred = self._get_device(self._computer_path('/computers/serialnumber/{!s}'.format(serial)),
+        check=functools.partial(check_device_response, identifier="serial: '{!s}'".format(serial)))
     deferred.addCallback(lambda x: [x])
     return deferred
 
   def get_devices_by_macaddr(self, addr):
-    deferred = self.get('/computers/macaddress/{!s}'.format(addr))
-    deferred.addCallback(check_device_response, "macaddr: '{!s}'".format(addr))
-    deferred = self._process_device_response(deferred)
+    computer_id = self.computer_index.get_id_by_macaddr(addr) if self.computer_index else None
+    if computer_id is not None:
+      return self._get_devices_by_id([computer_id])
+
+    deferred = self._get_device(self._computer_path('/computers/macaddress/{!s}'.format(addr)),
+        check=functools.partial(check_device_response, identifier="macaddr: '{!s}'".format(addr)))
     deferred.addCallback(lambda x: [x])
     return deferred
 
   def get_devices_by_email(self, email):
+    # users missing from the index (e.g., with computers added since it was built) are still
+    # resolved individually
+    computer_ids = self.computer_index.get_ids_by_email(email) if self.computer_index else None
+    if computer_ids:
+      return self._get_devices_by_id(computer_ids)
+
     deferred = self.get_userinfo_by_email(email)
     deferred.addCallback(self._extract_device_ids_from_userinfo)
     deferred.addCallback(self._get_devices_by_id)
     return deferred
 
+  def _get_bulk(self, path, resource, spec):
+    return self.get(path, timeout=self.config.get('JAMF_BULK_TIMEOUT', 120),
+        read=lambda response: self._decode_response(check_response(response, resource=resource),
+          resource, spec))
+
+  def _index_report_dates(self, response):
+    self.report_dates = dict((computer['id'], computer.get('report_date_utc'))
+                             for computer in response.get('computers', []))
+    logger.info("retrieved report dates for {:d} computers", len(self.report_dates))
+    # computers which are no longer listed have been removed from JAMF
+    self.device_store.retain(self.report_dates)
+    return self.report_dates
+
+  def prefetch_devices(self, emails=None):
+    """Index the fleet's computers ahead of many calls to `get_devices_by_email`.
+
+    For many users (at least ``JAMF_BULK_THRESHOLD``, by default 500), or if `emails` is `None`, the
+    advanced computer search ``JAMF_ADVANCED_SEARCH_ID`` (which must cover every computer and
+    display the email address, username, serial number and MAC addresses) is retrieved in a single
+    request, so users need not be resolved one at a time through `/users/name/...` (users not found
+    in the search still are). If a device
+    store is configured, every computer's report date is also retrieved (from
+    `/computers/subset/basic`), so that unchanged computers are served from the store without
+    any requests, and computers no longer listed are dropped from the store.
+    """
+    threshold = self.config.get('JAMF_BULK_THRESHOLD',
+        stethoscope.plugins.sources.jamf.base.DEFAULT_BULK_THRESHOLD)
+    if emails is not None and len(emails) < threshold:
+      return defer.succeed(None)
+
+    deferreds = list()
+    search_id = self.config.get('JAMF_ADVANCED_SEARCH_ID')
+    if search_id is not None:
+      deferred = self._get_bulk('/advancedcomputersearches/id/{!s}'.format(search_id),
+          'advancedcomputersearch', stethoscope.plugins.sources.jamf.base.SEARCH_SPEC)
+      deferred.addCallback(self._index_computers)
+      deferreds.append(deferred)
+    if self.device_store is not None:
+      deferred = self._get_bulk('/computers/subset/basic', 'computers_basic',
+          {'computers': [('id', 'report_date_utc')]})
+      deferred.addCallback(self._index_report_dates)
+      deferreds.append(deferred)
+    return defer.gatherResults(deferreds, consumeErrors=True)
+
+  def save_state(self):
+    """Persist the device store (if any); called at the end of batch runs and at shutdown."""
+    if self.device_store is not None:
+      self.device_store.save()
+
   def test_connectivity(self):
-    deferred = self.get('/jssuser')
-    deferred.addCallback(_check_connectivity_response)
-    deferred.addCallback(treq.content)
-    deferred.addCallback(json.loads)
+    deferred = self.get('/jssuser',
+        read=lambda response: treq.content(_check_connectivity_response(response)))
+    deferred.addCallback(self.response_metrics.decode_json, 'jssuser')
     deferred.addCallback(_log_server_information)
     return deferred
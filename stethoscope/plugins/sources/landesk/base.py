@@ -3,6 +3,10 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import collections
+import copy
+import functools
+import itertools
+import operator
 import re
 
 import _mssql
@@ -12,6 +16,8 @@ import six
 
 import stethoscope.api.exceptions
 import stethoscope.configurator
+import stethoscope.plugins.sources.landesk.pool
+import stethoscope.plugins.sources.landesk.rules
 import stethoscope.utils
 import stethoscope.validation
 
@@ -54,6 +60,40 @@ ORDER BY A0.LASTUPDINVSVR DESC
 """
 
 
+# per-table queries for the details of a set of computers (see `_get_details_by_computer_ids`),
+# selecting only the columns which are used; `ids` is filled with one `%d` per computer ID and
+# `condition` with the vulnerability rules' filter (see `rules.RuleSet.sql_filter`)
+VULNERABILITY_COLUMNS = ('Computer_Idn', 'Vul_ID', 'VulType', 'VulSeverity', 'Title', 'Reason')
+
+VULNERABILITIES_FOR_COMPUTERS = """
+SELECT Computer_Idn, Vul_ID, VulType, VulSeverity, Title, Reason
+FROM CVDetectedV (nolock)
+WHERE Computer_Idn IN ({ids:s}) AND ({condition:s})
+"""
+
+# NOTE: firewall information is also stored with network adapters
+ADAPTER_COLUMNS = ('Computer_Idn', 'PhysAddress', 'FirewallEnabled')
+
+ADAPTERS_FOR_COMPUTERS = """
+SELECT Computer_Idn, PhysAddress, FirewallEnabled
+FROM BoundAdapter (nolock)
+WHERE Computer_Idn IN ({ids:s})
+"""
+
+SOFTWARE_COLUMNS = ('Computer_Idn', 'InstallDate', 'Publisher', 'SuiteName', 'Version')
+
+SOFTWARE_FOR_COMPUTERS = """
+SELECT DISTINCT Computer_Idn, InstallDate, Publisher, SuiteName, Version
+FROM AppSoftwareSuites (nolock)
+WHERE Computer_Idn IN ({ids:s})
+"""
+
+# SQL Server accepts at most 2100 parameters per query
+DEFAULT_IN_CHUNK_SIZE = 1000
+
+DEFAULT_BULK_THRESHOLD = 500
+
+
 ATTRIBUTES_TO_COPY = [
     'manufacturer',
     'model',
@@ -153,8 +193,65 @@ def _reformat_screenlock_reason(reason_string):
   return "\n".join("  • " + reason for reason in reasons)
 
 
+def _chunks(iterable, size):
+  """Yield successive lists of at most `size` items from `iterable`, consuming it lazily.
+
+  >>> list(_chunks(iter(range(5)), 2))
+  [[0, 1], [2, 3], [4]]
+
+  """
+  iterator = iter(iterable)
+  while True:
+    chunk = list(itertools.islice(iterator, size))
+    if len(chunk) == 0:
+      return
+    yield chunk
+
+
+def project_rows(rows, columns):
+  """Convert `pymssql` rows into dictionaries of only the given `columns`.
+
+  Cheaper than `row_to_dict` for rows of a projected query, as only the named columns are visited.
+
+  >>> project_rows([{0: 12345, 'Computer_Idn': 12345, 1: 'No', 'FirewallEnabled': 'No'}],
+  ...              ('Computer_Idn', 'FirewallEnabled')) == [{'Computer_Idn': 12345,
+  ...                                                        'FirewallEnabled': 'No'}]
+  True
+
+  """
+  getter = operator.itemgetter(*columns)
+  return [dict(zip(columns, getter(row))) for row in rows]
+
+
+class DeviceIndex(object):
+  """Processed devices indexed by (lower-cased) user email.
+
+  If `emails` is `None`, the index covers every user; otherwise it covers only the given users
+  (and lookups for any other user must go to the database).
+  """
+
+  def __init__(self, emails=None):
+    self.emails = emails
+    self.devices = collections.defaultdict(list)
+
+  def __len__(self):
+    return sum(len(devices) for devices in six.itervalues(self.devices))
+
+  def covers(self, email):
+    return email is not None and (self.emails is None or email.lower() in self.emails)
+
+  def add_device(self, email, device):
+    self.devices[email.lower()].append(device)
+
+  def get_devices(self, email):
+    return copy.deepcopy(self.devices.get(email.lower(), []))
+
+
 class LandeskSQLDataSourceBase(stethoscope.configurator.Configurator):
 
+  # populated by `prefetch_devices` for bulk (i.e., batch) lookups
+  device_index = None
+
   config_keys = (
       'LANDESK_SQL_USERNAME',
       'LANDESK_SQL_PASSWORD',
@@ -174,16 +271,28 @@ class LandeskSQLDataSourceBase(stethoscope.configurator.Configurator):
       'database': self.config['LANDESK_SQL_DATABASE'],
     }
 
+    pool = stethoscope.plugins.sources.landesk.pool
+    self.connection_pool = pool.ConnectionPool(
+      functools.partial(_mssql.connect, **self._conn_kwargs),
+      max_size=self.config.get('LANDESK_POOL_SIZE', pool.DEFAULT_MAX_SIZE),
+      max_lifetime=self.config.get('LANDESK_POOL_MAX_LIFETIME', pool.DEFAULT_MAX_LIFETIME),
+      max_idle=self.config.get('LANDESK_POOL_MAX_IDLE', pool.DEFAULT_MAX_IDLE),
+      ping_after=self.config.get('LANDESK_POOL_PING_AFTER', pool.DEFAULT_PING_AFTER),
+      timeout=self.config.get('LANDESK_POOL_TIMEOUT', pool.DEFAULT_TIMEOUT),
+      # connections are only discarded for driver and database errors, not (e.g.) lookup misses
+      discard_on=(_mssql.MSSQLException,),
+      name='landesk',
+    )
+
+    rules = stethoscope.plugins.sources.landesk.rules
+    self.vuln_rules = rules.RuleSet(rules.get_rules(self.config))
+
   def _get_vulnerabilities(self, conn, computer_id):
-    conn.execute_query("""SELECT * FROM CVDetectedV (nolock) WHERE Computer_Idn = %d""",
-        computer_id)
-    return [row_to_dict(row) for row in conn]
+    return self._get_vulnerabilities_by_computer_ids(conn, [computer_id]).get(computer_id, [])
 
   def _get_adapters(self, conn, computer_id):
-    # NOTE: firewall information is also stored with network adapters
-    conn.execute_query("""SELECT * FROM BoundAdapter (nolock) WHERE Computer_Idn = %d""",
-        computer_id)
-    return [row_to_dict(row) for row in conn]
+    return self._query_by_computer_ids(conn, ADAPTERS_FOR_COMPUTERS, ADAPTER_COLUMNS,
+        [computer_id]).get(computer_id, [])
 
   def _normalize_software_row(self, row):
     """Convert row of software information returned from DB to common software list format."""
@@ -196,49 +305,68 @@ class LandeskSQLDataSourceBase(stethoscope.configurator.Configurator):
 
   def _get_software(self, conn, computer_id):
     """Use our SQL connection to get the list of installed software given the computer ID."""
-    conn.execute_query("""SELECT DISTINCT InstallDate, Publisher, SuiteName, Version
-                          FROM AppSoftwareSuites (nolock)
-                          WHERE Computer_Idn = %d""", computer_id)
-    return [self._normalize_software_row(row) for row in conn]
-
-  def _check_screenlock(self, raw):
-    data = {'value': True}
-
-    for vuln in raw['vulns']:
-      if vuln['Vul_ID'] == self.config.get('LANDESK_SCREENLOCK_VULN_ID', 'ST000202'):
-        data['value'] = False
-        data['details'] = _reformat_screenlock_reason(vuln['Reason'])
-        logger.debug("screenlock reason:\n{!r}", data['details'])
-
-    if raw.get('sw_last_scan_date') is not None:
-      data['last_updated'] = arrow.get(raw['sw_last_scan_date'], 'US/Pacific')
-
-    return data
-
-  def _check_autoupdate(self, raw):
-    data = {'value': True}
-
-    for vuln in raw['vulns']:
-      if vuln['Vul_ID'] == 'ST000003v2':
-        data['value'] = False
-        data['details'] = vuln['Reason']
-
-    if raw.get('sw_last_scan_date') is not None:
-      data['last_updated'] = arrow.get(raw['sw_last_scan_date'], 'US/Pacific')
-
-    return data
-
-  def _check_uptodate(self, raw):
-    vulns = [vuln for vuln in raw['vulns'] if
-        # not vuln['Vul_ID'].startswith('AV-') and
-        vuln['VulType'] == 'Vulnerability' and
-        vuln['VulSeverity'] in ('Critical', 'High')]
-
+    return [self._normalize_software_row(row) for row in self._query_by_computer_ids(conn,
+        SOFTWARE_FOR_COMPUTERS, SOFTWARE_COLUMNS, [computer_id]).get(computer_id, [])]
+
+  def _query_by_computer_ids(self, conn, query, columns, computer_ids, condition='', params=()):
+    """Run `query` for each chunk of `computer_ids`, returning its rows grouped by computer ID."""
+    chunk_size = self.config.get('LANDESK_IN_CHUNK_SIZE', DEFAULT_IN_CHUNK_SIZE)
+    grouped = collections.defaultdict(list)
+    for start in six.moves.range(0, len(computer_ids), chunk_size):
+      chunk = computer_ids[start:start + chunk_size]
+      conn.execute_query(query.format(ids=', '.join(['%d'] * len(chunk)), condition=condition),
+          tuple(chunk) + params)
+      for row in project_rows(conn, columns):
+        grouped[row['Computer_Idn']].append(row)
+    return grouped
+
+  def _get_vulnerabilities_by_computer_ids(self, conn, computer_ids):
+    """Return the vulnerabilities matched by any of the vulnerability rules, by computer ID.
+
+    Vulnerabilities which no rule matches are filtered out by the database rather than being sent.
+    """
+    condition, params = self.vuln_rules.sql_filter()
+    if condition == '':
+      return {}
+    return self._query_by_computer_ids(conn, VULNERABILITIES_FOR_COMPUTERS, VULNERABILITY_COLUMNS,
+        computer_ids, condition, params)
+
+  def _get_details_by_computer_ids(self, conn, computer_ids):
+    """Return vulnerabilities, adapters and software (each keyed by computer ID) for all computers.
+
+    Rather than querying each table once per computer, each table is queried once per (up to)
+    ``LANDESK_IN_CHUNK_SIZE`` computers and the results are grouped here.
+    """
+    computer_ids = sorted(set(computer_ids))
+    if len(computer_ids) == 0:
+      return {}, {}, {}
+
+    vulns = self._get_vulnerabilities_by_computer_ids(conn, computer_ids)
+    adapters = self._query_by_computer_ids(conn, ADAPTERS_FOR_COMPUTERS, ADAPTER_COLUMNS,
+        computer_ids)
+    software = dict((computer_id, [self._normalize_software_row(row) for row in rows])
+        for computer_id, rows in six.iteritems(self._query_by_computer_ids(conn,
+          SOFTWARE_FOR_COMPUTERS, SOFTWARE_COLUMNS, computer_ids)))
+    return vulns, adapters, software
+
+  def _check_vulnerability_rule(self, raw, rule, vulns):
+    """Return practice data for a vulnerability `rule` given the vulnerabilities it matched.
+
+    The practice fails if any vulnerability matched; its details are the (last) vulnerability's
+    reason (``'reason'``, reformatted for ``'screenlock'``) or a list of titles (``'titles'``).
+    """
     data = {'value': (len(vulns) == 0)}
+
     if len(vulns) > 0:
-      data['details'] = "Missing Updates:\n"
-      for vuln in vulns:
-        data['details'] += "    {Title!s}\n".format(**vuln)
+      details = rule.get('details', 'titles')
+      if details == 'screenlock':
+        data['details'] = _reformat_screenlock_reason(vulns[-1]['Reason'])
+        logger.debug("screenlock reason:\n{!r}", data['details'])
+      elif details == 'reason':
+        data['details'] = vulns[-1]['Reason']
+      else:
+        data['details'] = "Missing Updates:\n" + "".join("    {!s}\n".format(vuln['Title'])
+                                                        for vuln in vulns)
 
     if raw.get('sw_last_scan_date') is not None:
       data['last_updated'] = arrow.get(raw['sw_last_scan_date'], 'US/Pacific')
@@ -304,9 +432,9 @@ class LandeskSQLDataSourceBase(stethoscope.configurator.Configurator):
 
     # PRACTICES
     device['practices'] = dict()
-    device['practices']['screenlock'] = self._check_screenlock(raw)
-    device['practices']['autoupdate'] = self._check_autoupdate(raw)
-    device['practices']['uptodate'] = self._check_uptodate(raw)
+    for name, vulns in six.iteritems(self.vuln_rules.evaluate(raw['vulns'])):
+      device['practices'][name] = self._check_vulnerability_rule(raw, self.vuln_rules.rules[name],
+          vulns)
     device['practices']['encryption'] = self._check_encryption(raw)
     device['practices']['firewall'] = self._check_firewall(raw)
 
@@ -327,7 +455,7 @@ class LandeskSQLDataSourceBase(stethoscope.configurator.Configurator):
     return device
 
   def get_devices_by_serial(self, serial):
-    with _mssql.connect(**self._conn_kwargs) as conn:
+    with self.connection_pool.connection() as conn:
       conn.execute_query(DEVICES_FOR_USER.format("WHERE A2.SERIALNUM = %s"), serial)
       devices = self._get_devices_by_email(conn)
       if len(devices) == 0:
@@ -337,7 +465,7 @@ class LandeskSQLDataSourceBase(stethoscope.configurator.Configurator):
 
   def get_devices_by_macaddr(self, _addr):
     addr = _addr.upper().replace(':', '')  # landesk uses all-uppercase MACs with no delimiters
-    with _mssql.connect(**self._conn_kwargs) as conn:
+    with self.connection_pool.connection() as conn:
       conn.execute_query("""SELECT Computer_Idn FROM BoundAdapter WHERE PhysAddress = %s""", addr)
       rows = [row_to_dict(row) for row in conn]
       if len(rows) == 0:
@@ -352,19 +480,78 @@ class LandeskSQLDataSourceBase(stethoscope.configurator.Configurator):
             'landesk')
       return devices
 
+  def _add_details(self, conn, raws):
+    """Add vulnerabilities, adapters and software to each of the computer rows in `raws`."""
+    vulns, adapters, software = self._get_details_by_computer_ids(conn,
+        [raw['Computer_Idn'] for raw in raws])
+    for raw in raws:
+      raw['vulns'] = list(vulns.get(raw['Computer_Idn'], []))
+      raw['adapters'] = list(adapters.get(raw['Computer_Idn'], []))
+      raw['software'] = list(software.get(raw['Computer_Idn'], []))
+
+  def _index_devices(self, index, conn, rows):
+    chunk_size = self.config.get('LANDESK_IN_CHUNK_SIZE', DEFAULT_IN_CHUNK_SIZE)
+    for raws in _chunks(rows, chunk_size):
+      self._add_details(conn, raws)
+      for raw in raws:
+        index.add_device(raw['email'], self._process_device(raw))
+
+  def prefetch_all_devices(self, emails=None):
+    """Scan every computer once, indexing the processed devices by user (or only those of `emails`).
+
+    Computer rows are streamed from one connection while their details are queried, one chunk of
+    ``LANDESK_IN_CHUNK_SIZE`` computers at a time, on another; only processed devices are kept, so
+    memory use does not grow with the size of the vulnerability and software tables. Subsequent
+    calls to `get_devices_by_email` are served from the index (see `device_index`).
+    """
+    index = DeviceIndex(emails=None if emails is None else set(email.lower() for email in emails))
+    with self.connection_pool.connection() as conn:
+      conn.execute_query(DEVICES_FOR_USER.format("WHERE A1.EMAILADDR IS NOT NULL"))
+      rows = (raw for raw in (row_to_dict(row) for row in conn) if index.covers(raw['email']))
+      if self.connection_pool.max_size > 1:
+        with self.connection_pool.connection() as details_conn:
+          self._index_devices(index, details_conn, rows)
+      else:
+        # with a single connection, every row must be read before querying for details
+        self._index_devices(index, conn, list(rows))
+
+    logger.info("indexed {:d} devices for {:d} users", len(index), len(index.devices))
+    self.device_index = index
+    return index
+
+  def prefetch_devices(self, emails=None):
+    """Index devices for `emails` (or all users) ahead of many calls to `get_devices_by_email`.
+
+    The whole fleet is scanned (see `prefetch_all_devices`) for many users (at least
+    ``LANDESK_BULK_THRESHOLD``, by default 500) or if `emails` is `None`; for fewer, users are
+    looked up individually as usual.
+    """
+    if emails is None or \
+        len(emails) >= self.config.get('LANDESK_BULK_THRESHOLD', DEFAULT_BULK_THRESHOLD):
+      return self.prefetch_all_devices(emails)
+    return None
+
   def _get_devices_by_email(self, conn):
-    devices = list()
-    for row in conn:
-      raw = row_to_dict(row)
-      raw['vulns'] = self._get_vulnerabilities(conn, row['Computer_Idn'])
-      raw['adapters'] = self._get_adapters(conn, row['Computer_Idn'])
-      raw['software'] = self._get_software(conn, row['Computer_Idn'])
-      # logger.debug("software:\n{!s}", pprint.pformat(raw['software']))
-      devices.append(self._process_device(raw))
-    return devices
+    # read every device row before issuing further queries on the same connection (which would
+    # otherwise discard any rows not yet read)
+    raws = [row_to_dict(row) for row in conn]
+
+    if self.config.get('LANDESK_SET_QUERIES', True):
+      self._add_details(conn, raws)
+    else:
+      for raw in raws:
+        raw['vulns'] = self._get_vulnerabilities(conn, raw['Computer_Idn'])
+        raw['adapters'] = self._get_adapters(conn, raw['Computer_Idn'])
+        raw['software'] = self._get_software(conn, raw['Computer_Idn'])
+
+    return [self._process_device(raw) for raw in raws]
 
   def get_devices_by_email(self, email):
-    with _mssql.connect(**self._conn_kwargs) as conn:
+    index = self.device_index
+    if index is not None and index.covers(email):
+      return index.get_devices(email)
+
+    with self.connection_pool.connection() as conn:
       conn.execute_query(DEVICES_FOR_USER.format("WHERE A1.EMAILADDR = %s"), email)
       return self._get_devices_by_email(conn)
 
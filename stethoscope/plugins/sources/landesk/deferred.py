@@ -3,8 +3,10 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import logbook
-from twisted.internet import threads
+from twisted.internet import task, threads
+from twisted.python import threadpool
 
+import stethoscope.plugins.concurrency
 import stethoscope.plugins.sources.landesk.base
 
 
@@ -15,17 +17,51 @@ class DeferredLandeskSQLDataSource(
     stethoscope.plugins.sources.landesk.base.LandeskSQLDataSourceBase,
   ):
 
+  _threadpool = None
+
+  def _get_threadpool(self):
+    """Return the thread pool dedicated to LANDESK queries, starting it if necessary.
+
+    The pool has one thread per pooled connection, so queries never wait on each other for a
+    connection and never occupy the reactor's own thread pool. Idle connections are reaped every
+    ``LANDESK_POOL_MAX_IDLE`` seconds, and all connections are closed when the reactor stops.
+    """
+    if self._threadpool is None:
+      from twisted.internet import reactor
+      self._threadpool = threadpool.ThreadPool(minthreads=0,
+          maxthreads=self.connection_pool.max_size, name='landesk')
+      self._threadpool.start()
+      self._reaper = task.LoopingCall(threads.deferToThreadPool, reactor, self._threadpool,
+          self.connection_pool.reap)
+      self._reaper.start(self.connection_pool.max_idle, now=False)
+      reactor.addSystemEventTrigger('during', 'shutdown', self._shutdown)
+    return self._threadpool
+
+  def _shutdown(self):
+    self._reaper.stop()
+    self._threadpool.stop()
+    self.connection_pool.close()
+
+  def _defer_to_thread(self, func, *args, **kwargs):
+    from twisted.internet import reactor
+    return stethoscope.plugins.concurrency.run_limited(self, threads.deferToThreadPool, reactor,
+        self._get_threadpool(), func, *args, **kwargs)
+
   def get_devices_by_email(self, email):
-    return threads.deferToThread(super(DeferredLandeskSQLDataSource, self).get_devices_by_email,
+    return self._defer_to_thread(super(DeferredLandeskSQLDataSource, self).get_devices_by_email,
         email)
 
   def get_devices_by_serial(self, serial):
-    return threads.deferToThread(super(DeferredLandeskSQLDataSource, self).get_devices_by_serial,
+    return self._defer_to_thread(super(DeferredLandeskSQLDataSource, self).get_devices_by_serial,
         serial)
 
   def get_devices_by_macaddr(self, macaddr):
-    return threads.deferToThread(super(DeferredLandeskSQLDataSource, self).get_devices_by_macaddr,
+    return self._defer_to_thread(super(DeferredLandeskSQLDataSource, self).get_devices_by_macaddr,
         macaddr)
 
+  def prefetch_devices(self, emails=None):
+    return self._defer_to_thread(super(DeferredLandeskSQLDataSource, self).prefetch_devices,
+        emails)
+
   def test_connectivity(self):
     return threads.deferToThread(super(DeferredLandeskSQLDataSource, self).test_connectivity)
@@ -0,0 +1,236 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+import contextlib
+import threading
+import time
+
+import logbook
+
+
+logger = logbook.Logger(__name__)
+
+DEFAULT_MAX_SIZE = 4
+DEFAULT_MAX_LIFETIME = 3600
+DEFAULT_MAX_IDLE = 300
+DEFAULT_PING_AFTER = 30
+DEFAULT_TIMEOUT = 30
+
+
+class PoolTimeoutError(Exception):
+  """Raised when no connection becomes available within the pool's timeout."""
+
+
+class _Connection(object):
+
+  def __init__(self, conn, now):
+    self.conn = conn
+    self.created = now
+    self.last_used = now
+
+
+class ConnectionPool(object):
+  """Bounded, thread-safe pool of database connections (e.g., from `_mssql.connect`).
+
+  At most `max_size` connections are open at once; threads checking out a connection while all of
+  them are in use wait up to `timeout` seconds for one to be returned. Connections are closed
+  rather than reused once they are older than `max_lifetime` seconds or have sat idle for longer
+  than `max_idle` seconds, and are health-checked (with ``SELECT 1``) before reuse if they have
+  been idle for at least `ping_after` seconds. A connection in use when one of the exceptions
+  `discard_on` (e.g., the database driver's) is raised is closed rather than returned to the pool;
+  other exceptions (e.g., a lookup finding nothing) leave it healthy. Connection ages are measured
+  with `clock`; waits for a connection always use wall-clock time. Connections are only ever closed
+  outside of the pool's lock.
+
+  >>> class Connection(object):
+  ...   connected = True
+  ...   def close(self):
+  ...     self.connected = False
+  >>> pool = ConnectionPool(Connection, max_size=2)
+  >>> with pool.connection() as conn:
+  ...   conn.connected
+  True
+  >>> with pool.connection() as conn:
+  ...   pass
+  >>> stats = pool.stats()
+  >>> stats['checkouts'], stats['opened'], stats['idle']
+  (2, 1, 1)
+
+  """
+
+  def __init__(self, connect, max_size=DEFAULT_MAX_SIZE, max_lifetime=DEFAULT_MAX_LIFETIME,
+               max_idle=DEFAULT_MAX_IDLE, ping_after=DEFAULT_PING_AFTER, timeout=DEFAULT_TIMEOUT,
+               discard_on=(Exception,), clock=time.time, name=None):
+    self.connect = connect
+    self.max_size = max_size
+    self.max_lifetime = max_lifetime
+    self.max_idle = max_idle
+    self.ping_after = ping_after
+    self.timeout = timeout
+    self.discard_on = discard_on
+    self.clock = clock
+    self.name = name
+
+    self.size = 0  # number of open connections, idle or checked out
+    self._idle = collections.deque()
+    self._condition = threading.Condition()
+    self.counts = collections.Counter()
+    self.wait_time = 0.0
+    self.max_wait_time = 0.0
+
+  def stats(self):
+    """Return connection counts, current usage and time spent waiting for a connection."""
+    stats = dict((key, 0) for key in ('checkouts', 'waits', 'opened', 'reused', 'expired',
+                                      'reaped', 'unhealthy', 'discarded'))
+    with self._condition:
+      stats.update(self.counts)
+      stats.update({
+        'size': self.size,
+        'idle': len(self._idle),
+        'in_use': self.size - len(self._idle),
+        'max_size': self.max_size,
+        'wait_time': self.wait_time,
+        'max_wait_time': self.max_wait_time,
+      })
+    return stats
+
+  @contextlib.contextmanager
+  def connection(self):
+    """Context manager which checks out a connection and returns it to the pool afterwards."""
+    conn = self.checkout()
+    try:
+      yield conn.conn
+    except self.discard_on:
+      self._discard(conn, 'discarded')
+      raise
+    except Exception:
+      self.checkin(conn)
+      raise
+    else:
+      self.checkin(conn)
+
+  def checkout(self):
+    started = time.time()
+    deadline = started + self.timeout
+    stale = list()
+    with self._condition:
+      self.counts['checkouts'] += 1
+      waited = False
+      while True:
+        conn = self._pop_idle(stale)
+        if conn is not None or self.size < self.max_size:
+          break
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          raise PoolTimeoutError("no connection available from pool {!s} within {!s} seconds"
+                                 "".format(self.name, self.timeout))
+        if not waited:
+          waited = True
+          self.counts['waits'] += 1
+        self._condition.wait(remaining)
+      if conn is None:
+        # reserve a slot for the new connection, which is opened outside of the lock
+        self.size += 1
+      wait = time.time() - started
+      self.wait_time += wait
+      self.max_wait_time = max(self.max_wait_time, wait)
+    for stale_conn in stale:
+      self._close(stale_conn)
+
+    if conn is not None:
+      if self._is_healthy(conn):
+        with self._condition:
+          self.counts['reused'] += 1
+        return conn
+      with self._condition:
+        self.counts['unhealthy'] += 1
+      # its slot is kept for the replacement connection
+      self._close(conn)
+
+    try:
+      conn = _Connection(self.connect(), self.clock())
+    except Exception:
+      with self._condition:
+        self.size -= 1
+        self._condition.notify()
+      raise
+    with self._condition:
+      self.counts['opened'] += 1
+    logger.debug("[{!s}] opened new connection ({:d} open)", self.name, self.size)
+    return conn
+
+  def checkin(self, conn):
+    now = self.clock()
+    if now - conn.created >= self.max_lifetime:
+      self._discard(conn, 'expired')
+      return
+    conn.last_used = now
+    with self._condition:
+      self._idle.append(conn)
+      self._condition.notify()
+
+  def reap(self):
+    """Close idle connections which have exceeded their idle time or lifetime."""
+    with self._condition:
+      now = self.clock()
+      keep = collections.deque()
+      stale = list()
+      for conn in self._idle:
+        if now - conn.last_used >= self.max_idle or now - conn.created >= self.max_lifetime:
+          stale.append(conn)
+        else:
+          keep.append(conn)
+      self._idle = keep
+    for conn in stale:
+      self._discard(conn, 'reaped')
+
+  def close(self):
+    """Close all idle connections; connections currently checked out are closed on return."""
+    self.max_lifetime = 0
+    with self._condition:
+      idle, self._idle = list(self._idle), collections.deque()
+    for conn in idle:
+      self._discard(conn, 'discarded')
+
+  def _pop_idle(self, stale):
+    # called with the lock held; the most recently used connection is the least likely to be stale.
+    # Stale connections are removed from the pool and added to `stale` to be closed by the caller.
+    now = self.clock()
+    while self._idle:
+      conn = self._idle.pop()
+      if now - conn.last_used < self.max_idle and now - conn.created < self.max_lifetime:
+        return conn
+      self._remove('reaped')
+      stale.append(conn)
+    return None
+
+  def _is_healthy(self, conn):
+    if not getattr(conn.conn, 'connected', True):
+      return False
+    if self.clock() - conn.last_used < self.ping_after:
+      return True
+    try:
+      conn.conn.execute_scalar("SELECT 1")
+    except Exception:
+      logger.exception("[{!s}] connection failed health check", self.name)
+      return False
+    return True
+
+  def _remove(self, reason):
+    # called with the lock held, for a connection which is about to be closed
+    self.size -= 1
+    self.counts[reason] += 1
+    self._condition.notify()
+
+  def _close(self, conn):
+    try:
+      conn.conn.close()
+    except Exception:
+      logger.exception("[{!s}] failed to close connection", self.name)
+
+  def _discard(self, conn, reason):
+    with self._condition:
+      self._remove(reason)
+    self._close(conn)
@@ -0,0 +1,188 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+import copy
+import itertools
+import operator
+
+import six
+
+
+# practices determined by LANDESK's detected vulnerabilities (`CVDetectedV`): each rule gives
+# either the `Vul_ID`s whose detection fails the practice or the `VulType`s and/or `VulSeverity`s
+# which do, and how to describe the offending vulnerabilities (see
+# `LandeskSQLDataSourceBase._check_vulnerability_rule`)
+DEFAULT_RULES = {
+  'screenlock': {
+    'vul_ids': ['ST000202'],
+    'details': 'screenlock',
+  },
+  'autoupdate': {
+    'vul_ids': ['ST000003v2'],
+    'details': 'reason',
+  },
+  'uptodate': {
+    'types': ['Vulnerability'],
+    'severities': ['Critical', 'High'],
+    'details': 'titles',
+  },
+}
+
+
+def get_rules(config):
+  """Return the vulnerability rules for `config`: `DEFAULT_RULES` updated by ``LANDESK_VULN_RULES``.
+
+  Setting a practice's rule to `None` in ``LANDESK_VULN_RULES`` removes it.
+
+  >>> sorted(get_rules({'LANDESK_VULN_RULES': {'uptodate': None, 'av': {'vul_ids': ['AV-1']}}}))
+  ['autoupdate', 'av', 'screenlock']
+  >>> get_rules({'LANDESK_SCREENLOCK_VULN_ID': 'ST000999'})['screenlock']['vul_ids']
+  ['ST000999']
+
+  """
+  rules = copy.deepcopy(DEFAULT_RULES)
+  if 'LANDESK_SCREENLOCK_VULN_ID' in config:
+    rules['screenlock']['vul_ids'] = [config['LANDESK_SCREENLOCK_VULN_ID']]
+  for name, rule in six.iteritems(config.get('LANDESK_VULN_RULES', {})):
+    if rule is None:
+      rules.pop(name, None)
+    else:
+      rules[name] = rule
+  return rules
+
+
+# the number of rules from which a single pass over the vulnerabilities beats one scan per rule (see
+# benchmarks/bench_landesk_vulns.py)
+SINGLE_PASS_MIN_RULES = 6
+
+_vuln_key = operator.itemgetter('Vul_ID', 'VulType', 'VulSeverity')
+
+
+class _MatchCache(dict):
+  """Memo of the rules matched by each ``(Vul_ID, VulType, VulSeverity)``, filled on demand."""
+
+  def __init__(self, match):
+    super(_MatchCache, self).__init__()
+    self.match = match
+
+  def __missing__(self, key):
+    names = self[key] = self.match(*key)
+    return names
+
+
+class RuleSet(object):
+  """Vulnerability rules, evaluated against a device's vulnerabilities or pushed into SQL.
+
+  For a single pass over a device's vulnerabilities, rules are indexed by the `Vul_ID` and by the
+  ``(VulType, VulSeverity)`` pair (either of which may be a wildcard) they match. The rules matched
+  by each distinct ``(Vul_ID, VulType, VulSeverity)`` are then memoized (there are only as many as
+  LANDESK has vulnerability definitions), so each vulnerability costs a single dictionary lookup
+  regardless of the number of rules. With only a few rules, scanning the vulnerabilities once per
+  rule (testing only the columns the rule matches on) is faster still; unless `single_pass` is
+  given, the single pass is used for `SINGLE_PASS_MIN_RULES` or more rules.
+
+  >>> rules = RuleSet(DEFAULT_RULES)
+  >>> matches = rules.evaluate([
+  ...   {'Vul_ID': 'ST000202', 'VulType': 'Security Threat', 'VulSeverity': 'High'},
+  ...   {'Vul_ID': 'JAVAv8u92', 'VulType': 'Vulnerability', 'VulSeverity': 'Critical'},
+  ...   {'Vul_ID': 'FLASH23', 'VulType': 'Vulnerability', 'VulSeverity': 'Low'},
+  ... ])
+  >>> [[vuln['Vul_ID'] for vuln in matches[name]] for name in sorted(matches)]
+  [[], ['ST000202'], ['JAVAv8u92']]
+
+  """
+
+  def __init__(self, rules, single_pass=None):
+    self.rules = rules
+    if single_pass is None:
+      single_pass = len(rules) >= SINGLE_PASS_MIN_RULES
+    self.single_pass = single_pass
+
+    self._by_id = collections.defaultdict(list)
+    self._by_class = collections.defaultdict(list)
+    # for each rule, the `Vul_ID`s, types and severities it matches (`None` matching any)
+    self._columns = dict()
+
+    for name, rule in six.iteritems(rules):
+      if rule.get('vul_ids'):
+        for vul_id in rule['vul_ids']:
+          self._by_id[vul_id].append(name)
+        self._columns[name] = (frozenset(rule['vul_ids']), None, None)
+      elif rule.get('types') or rule.get('severities'):
+        for vul_type in rule.get('types') or [None]:
+          for severity in rule.get('severities') or [None]:
+            self._by_class[(vul_type, severity)].append(name)
+        self._columns[name] = (None,) + tuple(frozenset(rule[key]) if rule.get(key) else None
+                                              for key in ('types', 'severities'))
+      else:
+        raise ValueError("vulnerability rule {!r} must give 'vul_ids', 'types' or 'severities'"
+                         "".format(name))
+
+    self._cache = _MatchCache(self.match)
+
+  def sql_filter(self):
+    """Return a SQL condition (and its parameters) selecting only vulnerabilities a rule matches.
+
+    >>> condition, params = RuleSet(DEFAULT_RULES).sql_filter()
+    >>> print(condition)
+    Vul_ID IN (%s, %s) OR (VulType IN (%s) AND VulSeverity IN (%s, %s))
+    >>> params == ('ST000003v2', 'ST000202', 'Vulnerability', 'Critical', 'High')
+    True
+
+    The condition is empty if there are no rules.
+    """
+    clauses = list()
+    params = list()
+
+    vul_ids = sorted(self._by_id)
+    if len(vul_ids) > 0:
+      clauses.append("Vul_ID IN ({:s})".format(', '.join(['%s'] * len(vul_ids))))
+      params.extend(vul_ids)
+
+    for name in sorted(self.rules):
+      rule = self.rules[name]
+      if rule.get('vul_ids'):
+        continue
+      parts = list()
+      for column, key in (('VulType', 'types'), ('VulSeverity', 'severities')):
+        if rule.get(key):
+          parts.append("{:s} IN ({:s})".format(column, ', '.join(['%s'] * len(rule[key]))))
+          params.extend(rule[key])
+      clauses.append("({:s})".format(' AND '.join(parts)))
+
+    return ' OR '.join(clauses), tuple(params)
+
+  def match(self, vul_id, vul_type, severity):
+    """Return the names of the rules matching a vulnerability with the given attributes."""
+    names = list(self._by_id.get(vul_id, []))
+    for key in ((vul_type, severity), (vul_type, None), (None, severity)):
+      names.extend(self._by_class.get(key, []))
+    return tuple(names)
+
+  def evaluate(self, vulns):
+    """Return a `dict` mapping each rule's name to the vulnerabilities (in order) it matches."""
+    if self.single_pass:
+      return self._evaluate_single_pass(vulns)
+    return self._evaluate_per_rule(vulns)
+
+  def _evaluate_per_rule(self, vulns):
+    matches = dict()
+    for name, (vul_ids, types, severities) in six.iteritems(self._columns):
+      if vul_ids is not None:
+        matches[name] = [vuln for vuln in vulns if vuln['Vul_ID'] in vul_ids]
+      else:
+        matches[name] = [vuln for vuln in vulns if
+                         (types is None or vuln['VulType'] in types) and
+                         (severities is None or vuln['VulSeverity'] in severities)]
+    return matches
+
+  def _evaluate_single_pass(self, vulns):
+    matches = dict((name, []) for name in self.rules)
+    matched_names = list(map(self._cache.__getitem__, map(_vuln_key, vulns)))
+    # most vulnerabilities match no rule; skip them without a trip through the loop below
+    for vuln, names in itertools.compress(six.moves.zip(vulns, matched_names), matched_names):
+      for name in names:
+        matches[name].append(vuln)
+    return matches
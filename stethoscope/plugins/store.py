@@ -0,0 +1,126 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import collections
+import copy
+import io
+import json
+import os
+
+import logbook
+import six
+
+import stethoscope.utils
+
+
+logger = logbook.Logger(__name__)
+
+
+class DeviceStore(object):
+  """Persistent store of processed devices, each tagged with the version of its upstream record.
+
+  A plugin which can cheaply learn whether a device's upstream record has changed (e.g., from a
+  timestamp) can reuse the device it processed previously instead of retrieving and processing the
+  whole record again: `get` returns the stored device only if its version matches.
+
+  The store is kept in memory and written to `path` (as JSON Lines, with timestamps preserved) by
+  `save`. `fingerprint` describes whatever else determines how records are processed (e.g., the
+  practices enabled); a store saved with a different fingerprint is discarded when loaded.
+
+  >>> import os, tempfile
+  >>> path = os.path.join(tempfile.mkdtemp(), 'devices.jsonl')
+  >>> store = DeviceStore(path, fingerprint='v1')
+  >>> store.put(3001, '2016-06-03 14:35:13', {'serial': 'C02'})
+  >>> store.save()
+  >>> store = DeviceStore(path, fingerprint='v1')
+  >>> store.get(3001, '2016-06-03 14:35:13'), store.get(3001, '2016-06-04 09:00:00')
+  ({'serial': 'C02'}, None)
+  >>> len(DeviceStore(path, fingerprint='v2'))
+  0
+
+  """
+
+  def __init__(self, path, fingerprint=None, name=None):
+    self.path = path
+    self.fingerprint = fingerprint
+    self.name = name
+    self.records = dict()
+    self.counts = collections.Counter()
+    self._dirty = False
+    self.load()
+
+  def __len__(self):
+    return len(self.records)
+
+  def __contains__(self, key):
+    return six.text_type(key) in self.records
+
+  def load(self):
+    if not os.path.exists(self.path):
+      return
+    with io.open(self.path, 'r', encoding='utf-8') as fi:
+      header = json.loads(fi.readline() or '{}')
+      if header.get('fingerprint') != self.fingerprint:
+        logger.info("[{!s}] discarding {!s}: saved with different settings", self.name, self.path)
+        return
+      for line in fi:
+        if line.strip():
+          record = stethoscope.utils.json_loads_line(line)
+          self.records[record['key']] = (record['version'], record['device'])
+    logger.info("[{!s}] loaded {:d} devices from {!s}", self.name, len(self.records), self.path)
+
+  def save(self):
+    """Write the store to disk (atomically replacing the previous copy), if it has changed."""
+    if not self._dirty:
+      return
+    temporary = self.path + '.tmp'
+    with io.open(temporary, 'w', encoding='utf-8') as fo:
+      fo.write(six.text_type(json.dumps({'fingerprint': self.fingerprint})) + '\n')
+      for key, (version, device) in six.iteritems(self.records):
+        fo.write(six.text_type(stethoscope.utils.json_dumps_line({'key': key, 'version': version,
+          'device': device})) + '\n')
+    os.rename(temporary, self.path)
+    self._dirty = False
+    logger.info("[{!s}] saved {:d} devices to {!s}", self.name, len(self.records), self.path)
+
+  def get(self, key, version):
+    """Return (a copy of) the device stored for `key` if stored for `version`, else `None`."""
+    stored = self.records.get(six.text_type(key))
+    if stored is None:
+      self.counts['misses'] += 1
+      return None
+    if stored[0] != version:
+      self.counts['stale'] += 1
+      return None
+    self.counts['hits'] += 1
+    return copy.deepcopy(stored[1])
+
+  def put(self, key, version, device):
+    self.records[six.text_type(key)] = (version, copy.deepcopy(device))
+    self.counts['updates'] += 1
+    self._dirty = True
+
+  def retain(self, keys):
+    """Drop the devices stored for any key not in `keys` (e.g., computers since removed upstream).
+
+    Returns the number of devices dropped.
+    """
+    keys = set(six.text_type(key) for key in keys)
+    removed = [key for key in self.records if key not in keys]
+    for key in removed:
+      del self.records[key]
+    if len(removed) > 0:
+      self.counts['pruned'] += len(removed)
+      self._dirty = True
+      logger.info("[{!s}] dropped {:d} devices no longer present upstream", self.name, len(removed))
+    return len(removed)
+
+  def stats(self):
+    """Return the number of stored devices, lookup outcomes and hit rate."""
+    stats = dict((key, self.counts[key])
+                 for key in ('hits', 'misses', 'stale', 'updates', 'pruned'))
+    lookups = stats['hits'] + stats['misses'] + stats['stale']
+    stats['entries'] = len(self.records)
+    stats['hit_rate'] = float(stats['hits']) / lookups if lookups > 0 else None
+    return stats
@@ -0,0 +1,273 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import codecs
+import json
+import numbers
+import re
+import timeit
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_SEPARATOR = re.compile(r'[ \t\n\r]*,[ \t\n\r]*')
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+
+# parser states
+_VALUE = 'value'              # expecting a value
+_KEY_OR_END = 'key_or_end'    # after '{'
+_KEY = 'key'                  # after ',' in an object
+_COLON = 'colon'              # after a key
+_ELEMENT_OR_END = 'element_or_end'  # after '['
+_AFTER_VALUE = 'after_value'  # expecting ',' or the end of the container
+
+_NEED_MORE = object()
+_PUSHED = object()
+
+# specs with which arrays kept whole, and arrays and objects which are skipped, are still decoded
+# one element or member at a time, so that large ones aren't rescanned as chunks arrive
+_KEEP_ELEMENTS = [True]
+_SKIP_ELEMENTS = [None]
+_SKIP_MEMBERS = {}
+
+
+class _Frame(object):
+  """A container (or the document itself, for ``kind == 'root'``) being decoded."""
+
+  __slots__ = ('kind', 'spec', 'container', 'state', 'key')
+
+  def __init__(self, kind, spec, container, state):
+    self.kind = kind
+    self.spec = spec
+    self.container = container
+    self.state = state
+    self.key = None
+
+  def value_spec(self):
+    if self.kind == 'object':
+      return self.spec.get(self.key)
+    elif self.kind == 'array':
+      return self.spec[0]
+    return self.spec
+
+
+class StreamingJSONDecoder(object):
+  """Incrementally decode a JSON document, as its chunks arrive, keeping only the parts specified.
+
+  `spec` describes which parts of the document to keep:
+
+  - `True` keeps a value as decoded.
+  - A `tuple` of keys keeps only those members of an object.
+  - A `dict` decodes an object one member at a time (so the rest of the document need not have
+    arrived), applying each key's spec to its value; members whose keys are not given (or whose
+    spec is `None`) are skipped.
+  - A `list` holding a single spec decodes an array one element at a time, applying that spec to
+    each element.
+
+  Values which aren't the container their spec expects are kept as decoded. Each member or element
+  which is kept or skipped is decoded by `json`'s own (C) scanner, so only the text of the member
+  currently being decoded is held in memory rather than the whole response body, and the tree for
+  the parts which are skipped is never kept.
+
+  >>> decoder = StreamingJSONDecoder({'item': {'name': True, 'type': ('label',)}})
+  >>> decoder.feed(b'{"item": {"name": "Fry\\'s Laptop", "fields": [1, 2, 3], "ty')
+  >>> decoder.feed(b'pe": {"label": "Laptop", "id": 42}}}')
+  >>> decoder.close() == {'item': {'name': "Fry's Laptop", 'type': {'label': 'Laptop'}}}
+  True
+  >>> decoder = StreamingJSONDecoder({'items': [('id',)]})
+  >>> decoder.feed(b'{"items": [{"id": 1, "notes": "..."}, {"id": 2}], "total": 2}')
+  >>> decoder.close()
+  {'items': [{'id': 1}, {'id': 2}]}
+
+  `size` and `seconds` give the number of bytes fed and the time spent decoding them.
+  """
+
+  def __init__(self, spec=True, encoding='utf-8', timer=timeit.default_timer):
+    self.spec = spec
+    self.timer = timer
+    self.size = 0
+    self.seconds = 0.0
+
+    self._text = codecs.getincrementaldecoder(encoding)()
+    self._decoder = json.JSONDecoder()
+    self._buffer = ''
+    self._pos = 0
+    # when a value is incomplete, don't try again until this much undecoded text is buffered, so
+    # that a large value isn't rescanned as each chunk arrives
+    self._retry_length = 0
+    self._closed = False
+    self._stack = [_Frame('root', spec, None, _VALUE)]
+    self._done = False
+
+  def feed(self, data):
+    """Decode as much of the document as possible given the next chunk, `data`, of its body."""
+    started = self.timer()
+    self.size += len(data)
+    self._buffer = self._buffer[self._pos:] + self._text.decode(data)
+    self._pos = 0
+    self._parse()
+    self.seconds += self.timer() - started
+
+  def close(self):
+    """Finish decoding and return the document (raising `ValueError` if it is not valid JSON)."""
+    started = self.timer()
+    self._buffer = self._buffer[self._pos:] + self._text.decode(b'', True)
+    self._pos = 0
+    self._closed = True
+    self._parse()
+    self.seconds += self.timer() - started
+
+    if not self._done:
+      raise ValueError("incomplete JSON document")
+    if self._skip_whitespace() != len(self._buffer):
+      raise ValueError("extra data after JSON document")
+    return self._stack[0].container
+
+  def _skip_whitespace(self):
+    self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+    return self._pos
+
+  def _error(self, expected):
+    raise ValueError("expecting {!s} at char {:d}".format(expected, self._pos))
+
+  def _decode(self):
+    """Decode the value at the current position, or return `_NEED_MORE` if it is incomplete."""
+    pending = len(self._buffer) - self._pos
+    if pending < self._retry_length and not self._closed:
+      return _NEED_MORE
+
+    try:
+      value, end = self._decoder.raw_decode(self._buffer, self._pos)
+    except ValueError:
+      if self._closed:
+        raise
+      self._retry_length = 2 * pending
+      return _NEED_MORE
+
+    # a number may continue in the next chunk (e.g., '-0.' may be the start of '-0.5')
+    if not self._closed and isinstance(value, numbers.Number) and not isinstance(value, bool) and \
+        _NUMBER_TAIL.match(self._buffer, end).end() == len(self._buffer):
+      return _NEED_MORE
+
+    self._retry_length = 0
+    self._pos = end
+    return value
+
+  def _start_value(self, spec):
+    char = self._buffer[self._pos]
+    if char == '[' and (spec is True or spec is None):
+      spec = _KEEP_ELEMENTS if spec is True else _SKIP_ELEMENTS
+    elif char == '{' and spec is None:
+      spec = _SKIP_MEMBERS
+
+    if isinstance(spec, dict) and char == '{':
+      self._pos += 1
+      self._stack.append(_Frame('object', spec, dict(), _KEY_OR_END))
+      return _PUSHED
+    if isinstance(spec, list) and char == '[':
+      self._pos += 1
+      self._stack.append(_Frame('array', spec, list(), _ELEMENT_OR_END))
+      return _PUSHED
+
+    value = self._decode()
+    if isinstance(spec, tuple) and isinstance(value, dict):
+      value = {key: value[key] for key in spec if key in value}
+    return value
+
+  def _decode_elements(self, frame):
+    """Decode consecutive elements of an array whose elements are each decoded whole.
+
+    This is the same as going through `_parse` for each element, without the per-element overhead
+    (for, e.g., the thousands of computers in an advanced search).
+    """
+    spec = frame.spec[0]
+    prune = isinstance(spec, tuple)
+    append = frame.container.append
+    while True:
+      value = self._decode()
+      if value is _NEED_MORE:
+        return _NEED_MORE
+      if prune and isinstance(value, dict):
+        value = {key: value[key] for key in spec if key in value}
+      if spec is not None:
+        append(value)
+
+      separator = _SEPARATOR.match(self._buffer, self._pos)
+      if separator is None:
+        frame.state = _AFTER_VALUE
+        return None
+      self._pos = separator.end()
+      if self._pos == len(self._buffer):
+        return _NEED_MORE
+
+  def _store(self, frame, value):
+    if frame.kind == 'object':
+      if frame.spec.get(frame.key) is not None:
+        frame.container[frame.key] = value
+    elif frame.kind == 'array':
+      if frame.spec[0] is not None:
+        frame.container.append(value)
+    else:
+      frame.container = value
+      self._done = True
+    frame.state = _AFTER_VALUE
+
+  def _end_container(self, char):
+    frame = self._stack[-1]
+    if char != ('}' if frame.kind == 'object' else ']'):
+      self._error("',' or end of container")
+    self._pos += 1
+    self._stack.pop()
+    self._store(self._stack[-1], frame.container)
+
+  def _parse(self):
+    while not self._done:
+      if self._skip_whitespace() == len(self._buffer):
+        return
+
+      frame = self._stack[-1]
+      char = self._buffer[self._pos]
+
+      if frame.state == _VALUE and frame.kind == 'array' and \
+          not isinstance(frame.spec[0], (dict, list)):
+        if self._decode_elements(frame) is _NEED_MORE:
+          return
+
+      elif frame.state == _VALUE:
+        spec = frame.value_spec()
+        value = self._start_value(spec)
+        if value is _NEED_MORE:
+          return
+        elif value is not _PUSHED:
+          self._store(frame, value)
+
+      elif frame.state in (_KEY_OR_END, _KEY):
+        if char == '}' and frame.state == _KEY_OR_END:
+          self._end_container(char)
+          continue
+        if char != '"':
+          self._error("property name")
+        key = self._decode()
+        if key is _NEED_MORE:
+          return
+        frame.key = key
+        frame.state = _COLON
+
+      elif frame.state == _COLON:
+        if char != ':':
+          self._error("':'")
+        self._pos += 1
+        frame.state = _VALUE
+
+      elif frame.state == _ELEMENT_OR_END:
+        if char == ']':
+          self._end_container(char)
+        else:
+          frame.state = _VALUE
+
+      elif frame.state == _AFTER_VALUE:
+        if char == ',':
+          self._pos += 1
+          frame.state = _KEY if frame.kind == 'object' else _VALUE
+        else:
+          self._end_container(char)
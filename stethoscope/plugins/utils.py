@@ -6,6 +6,9 @@ import logbook
 import six
 import stevedore.named
 
+import stethoscope.plugins.cache
+import stethoscope.plugins.concurrency
+
 
 logger = logbook.Logger(__name__)
 
@@ -28,6 +31,8 @@ def instantiate_plugins(config, **kwargs):
     plugin_config.setdefault('DEFAULT_TIMEOUT', config.get('DEFAULT_TIMEOUT', False))
     plugin.obj = plugin.plugin(plugin_config)
     plugin.obj.plugin_name = plugin.name
+    plugin.obj.limiter = stethoscope.plugins.concurrency.get_limiter(plugin.name, plugin_config)
+    stethoscope.plugins.cache.wrap_lookups(plugin.obj, plugin_config)
   logger.debug("'{!s}' plugins: instantiated {!s}", kwargs['namespace'], plugins.names())
   return plugins
 
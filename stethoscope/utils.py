@@ -2,7 +2,9 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+import collections
 import datetime
+import heapq
 import json
 
 import arrow
@@ -51,6 +53,38 @@ def json_serialize_datetime(obj):
   raise TypeError("{!r} is not JSON serializable".format(obj))
 
 
+def _encode_datetime(obj):
+  if isinstance(obj, (datetime.datetime, arrow.Arrow)):
+    return {'__datetime__': obj.isoformat(b'T' if six.PY2 else 'T')}
+  raise TypeError("{!r} is not JSON serializable".format(obj))
+
+
+def _decode_datetime(obj):
+  if len(obj) == 1 and '__datetime__' in obj:
+    return arrow.get(obj['__datetime__'])
+  return obj
+
+
+def json_dumps_line(obj):
+  """Serialize `obj` as a single line of JSON, preserving `datetime`s and `arrow.Arrow`s.
+
+  >>> json_dumps_line({'last_sync': arrow.get("2015-05-16 10:37")})
+  '{"last_sync": {"__datetime__": "2015-05-16T10:37:00+00:00"}}'
+
+  """
+  return json.dumps(obj, default=_encode_datetime)
+
+
+def json_loads_line(line):
+  """Inverse of `json_dumps_line`; timestamps are returned as `arrow.Arrow` objects.
+
+  >>> json_loads_line(json_dumps_line({'last_sync': arrow.get("2015-05-16 10:37")}))['last_sync']
+  <Arrow [2015-05-16T10:37:00+00:00]>
+
+  """
+  return json.loads(line, object_hook=_decode_datetime)
+
+
 def json_pp(obj):
   """Encodes the given object as pretty-printed JSON and returns the resulting string."""
   return json.dumps(obj, sort_keys=True, indent=4, separators=(',', ': '),
@@ -71,6 +105,77 @@ def grouper(iterable, n, fillvalue=None):
   return six.moves.zip_longest(fillvalue=fillvalue, *args)
 
 
+class _MergeEntry(object):
+  """The next item of one of the iterables being merged by `merge_sorted`."""
+
+  __slots__ = ('key', 'index', 'item', 'iterator', 'reverse')
+
+  def __init__(self, key, index, item, iterator, reverse):
+    self.key = key
+    self.index = index
+    self.item = item
+    self.iterator = iterator
+    self.reverse = reverse
+
+  def __lt__(self, other):
+    if self.key == other.key:
+      return self.index < other.index
+    return self.key > other.key if self.reverse else self.key < other.key
+
+
+def merge_sorted(iterables, key, reverse=False):
+  """Lazily merge iterables, each already sorted by `key`, into a single sorted iterator.
+
+  This is `heapq.merge` with its `key` and `reverse` arguments (which require Python 3.5): only one
+  item from each iterable is held at a time, so taking the first few items of the result costs
+  little however long the iterables are. Items with equal keys keep the order of their iterables.
+
+  >>> list(merge_sorted([[5, 3, 1], [4, 3], []], key=lambda x: x, reverse=True))
+  [5, 4, 3, 3, 1]
+
+  """
+  heap = list()
+  for index, iterable in enumerate(iterables):
+    iterator = iter(iterable)
+    for item in iterator:
+      heap.append(_MergeEntry(key(item), index, item, iterator, reverse))
+      break
+  heapq.heapify(heap)
+
+  while len(heap) > 0:
+    entry = heap[0]
+    yield entry.item
+    for item in entry.iterator:
+      entry.key, entry.item = key(item), item
+      heapq.heapreplace(heap, entry)
+      break
+    else:
+      heapq.heappop(heap)
+
+
+class PageCursor(collections.namedtuple('PageCursor', ('timestamp', 'id'))):
+  """Position in records sorted most recent first, by timestamp and then (for records with the same
+  timestamp) by id, just after a page's last record: later pages hold the records it `precedes`.
+
+  Without an `id`, the cursor precedes only records older than its `timestamp`.
+
+  >>> cursor = PageCursor(200, 'b')
+  >>> [cursor.precedes(*record) for record in [(300, 'c'), (200, 'c'), (200, 'b'), (200, 'a')]]
+  [False, False, False, True]
+  >>> cursor.precedes(100, 'c'), PageCursor(200, None).precedes(200, 'a')
+  (True, False)
+
+  """
+
+  __slots__ = ()
+
+  def precedes(self, timestamp, record_id):
+    """Return whether the record with `timestamp` and `record_id` belongs after the cursor."""
+    if timestamp != self.timestamp:
+      return timestamp < self.timestamp
+    return self.id is not None and record_id < self.id
+
+
 def setup_logbook(logfile, logfile_kwargs=None):
   """Return a basic `logbook` setup which logs to `stderr` and to file."""
 
@@ -0,0 +1,100 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import argparse
+
+import arrow
+import pytest
+
+import stethoscope.batch.run
+import stethoscope.batch.spool
+
+
+@pytest.fixture
+def spool(tmpdir):
+  with stethoscope.batch.spool.DeviceSpool(str(tmpdir.join('devices.jsonl'))) as spool:
+    yield spool
+
+
+def test_roundtrip(spool):
+  last_sync = arrow.get("2017-03-01T12:00:00-08:00")
+  spool['a@example.com'] = [{'serial': 'a', 'last_sync': last_sync, 'practices': {}}]
+  spool['b@example.com'] = []
+  spool['c@example.com'] = [{'serial': 'c1'}, {'serial': 'c2'}]
+
+  items = list(spool.items())
+  assert [email for email, _ in items] == ['a@example.com', 'b@example.com', 'c@example.com']
+  assert items[0][1][0]['last_sync'] == last_sync
+  assert items[2][1] == [{'serial': 'c1'}, {'serial': 'c2'}]
+  assert len(spool) == 3
+  assert spool.num_devices == 3
+
+
+def test_write_after_read(spool):
+  spool['a@example.com'] = [{'serial': 'a'}]
+  assert len(list(spool.values())) == 1
+  spool['b@example.com'] = [{'serial': 'b'}]
+  assert len(list(spool.values())) == 2
+
+
+def test_gather_statistics(spool):
+  user = [{'practices': {'foo': {'status': 'warn'}, 'bar': {'status': 'nudge'}}}]
+  spool['user_a'] = user
+  spool['user_b'] = user
+  assert stethoscope.batch.run.gather_statistics(spool) == \
+      stethoscope.batch.run.gather_statistics({'user_a': user, 'user_b': user})
+
+
+def test_resume(tmpdir):
+  path = str(tmpdir.join('devices.jsonl'))
+  with stethoscope.batch.spool.DeviceSpool(path) as spool:
+    spool['a@example.com'] = [{'serial': 'a'}]
+    spool['b@example.com'] = [{'serial': 'b1'}, {'serial': 'b2'}]
+
+  # simulate a crash part-way through writing the next record
+  with open(path, 'a') as fo:
+    fo.write('{"email": "c@example.com", "dev')
+
+  with stethoscope.batch.spool.DeviceSpool(path, resume=True) as spool:
+    assert list(spool.completed) == ['a@example.com', 'b@example.com']
+    assert 'c@example.com' not in spool
+    assert spool.num_devices == 3
+    assert spool['b@example.com'] == [{'serial': 'b1'}, {'serial': 'b2'}]
+    spool['c@example.com'] = [{'serial': 'c'}]
+    assert [email for email, _ in spool.items()] == \
+        ['a@example.com', 'b@example.com', 'c@example.com']
+
+  with stethoscope.batch.spool.DeviceSpool(path, resume=True) as spool:
+    assert len(spool) == 3
+
+  with stethoscope.batch.spool.DeviceSpool(path) as spool:
+    assert len(spool) == 0
+    assert list(spool.items()) == []
+
+
+def test_resume_truncated_journal(tmpdir):
+  path = str(tmpdir.join('devices.jsonl'))
+  with stethoscope.batch.spool.DeviceSpool(path) as spool:
+    spool['a@example.com'] = [{'serial': 'a'}]
+  with open(path + '.journal', 'a') as fo:
+    fo.write('{"email": "b@exa')
+
+  with stethoscope.batch.spool.DeviceSpool(path, resume=True) as spool:
+    spool['b@example.com'] = [{'serial': 'b'}]
+  assert list(stethoscope.batch.spool.read_journal(path + '.journal')) == \
+      ['a@example.com', 'b@example.com']
+
+
+@pytest.mark.parametrize('value', ['1', '4/4', '-1/4', 'a/b', '1/2/3'])
+def test_parse_shard_invalid(value):
+  with pytest.raises(argparse.ArgumentTypeError):
+    stethoscope.batch.run.parse_shard(value)
+
+
+def test_shards_partition():
+  emails = ['user{:d}@example.com'.format(idx) for idx in range(1000)]
+  shards = [[email for email in emails if stethoscope.batch.run.in_shard(email, (idx, 4))]
+            for idx in range(4)]
+  assert sorted(sum(shards, [])) == sorted(emails)
+  assert all(150 < len(shard) < 350 for shard in shards)
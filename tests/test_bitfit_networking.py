@@ -2,6 +2,8 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+import json
+
 import mock
 import treq
 from twisted.internet.defer import succeed
@@ -29,6 +31,7 @@ class DeferredBitfitTestCase(unittest.TestCase):
 
     if body is not None:
       self.treq.content.return_value = succeed(body)
+      self.treq.collect.side_effect = lambda _, collector: succeed(collector(body))
 
     self.treq.get.return_value = succeed(response)
     return response
@@ -62,3 +65,136 @@ class DeferredBitfitTestCase(unittest.TestCase):
     self.set_response(code=500)
     deferred = self.datasource.get_devices_by_email('user@example.com')
     return self.failUnlessFailure(deferred, stethoscope.api.exceptions.InvalidResponseException)
+
+  def test_device_streaming(self):
+    with open("tests/fixtures/bitfit/asset_response_lgml-pfry.json", 'rb') as fo:
+      body = fo.read()
+    self.set_response(body=body)
+    deferred = self.datasource._get_device_by_id(0)
+
+    def check(device):
+      # only the parts of the asset which are used were decoded, but the result is the same
+      self.assertEqual(device, self.datasource._process_device(json.loads(body.decode('utf-8'))))
+
+    deferred.addCallback(check)
+    return deferred
+
+
+def load_asset(name):
+  with open("tests/fixtures/bitfit/asset_response_{!s}.json".format(name), 'rb') as fo:
+    return fo.read()
+
+
+class DeferredBitfitIndexTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.datasource = stethoscope.plugins.sources.bitfit.deferred.DeferredBitfitDataSource({
+      'BITFIT_API_TOKEN': '',
+      'BITFIT_BASE_URL': '',
+      'BITFIT_PAGE_SIZE': 2,
+    })
+
+    self.treq = mock.patch('stethoscope.plugins.sources.bitfit.deferred.treq', wraps=treq).start()
+    self.addCleanup(mock.patch.stopall)
+
+    # the listed asset includes its details; the other one must be retrieved individually
+    listed = json.loads(load_asset('lgml-pfry').decode('utf-8'))['item']
+    self.responses = {
+      ('users', 1): {'items': [{'id': 12345, 'email': 'pfry@planetexpress.com'},
+                               {'id': 12346, 'email': 'tleela@planetexpress.com'}]},
+      ('users', 2): {'items': [{'id': 12347, 'email': 'bender@planetexpress.com'}]},
+      ('assets', 1): {'items': [listed, {'id': 55417, 'user_id': 12345,
+                                         'serial_number': 'DECAFBAD01'}]},
+      ('assets', 2): {'items': []},
+      ('assets/55417', None): json.loads(load_asset('lgmd-pfry').decode('utf-8')),
+    }
+
+    def get(url, **kwargs):
+      response = mock.Mock()
+      response.code = 200
+      response.body = json.dumps(self.responses[(url, kwargs['params'].get('page'))])
+      return succeed(response)
+    self.treq.get.side_effect = get
+    self.treq.collect.side_effect = lambda response, collector: succeed(
+        collector(response.body.encode('utf-8')))
+
+  def requested(self):
+    return [(call[0][0], call[1]['params'].get('page')) for call in self.treq.get.call_args_list]
+
+  def test_prefetch_devices(self):
+    deferred = self.datasource.prefetch_devices(None)
+
+    def check_index(index):
+      self.assertEqual(sorted(self.requested()), [('assets', 1), ('assets', 2), ('users', 1),
+                                                  ('users', 2)])
+      self.assertIs(index, self.datasource.asset_index)
+      self.assertEqual(len(index), 2)
+      self.assertEqual(list(index.devices), [12345])
+      return self.datasource.get_devices_by_email('PFry@planetexpress.com')
+    deferred.addCallback(check_index)
+
+    def check_devices(devices):
+      self.assertEqual(sorted(device['serial'] for device in devices), ['DECAFBAD00', 'DECAFBAD01'])
+      # only the asset whose details weren't listed was retrieved
+      self.assertEqual(self.requested()[4:], [('assets/55417', None)])
+      return self.datasource.get_devices_by_macaddr('00:de:ca:fb:ad:00')
+    deferred.addCallback(check_devices)
+
+    def check_macaddr(devices):
+      self.assertEqual([device['serial'] for device in devices], ['DECAFBAD00'])
+      return self.datasource.get_devices_by_serial('DECAFBAD01')
+    deferred.addCallback(check_macaddr)
+
+    def check_serial(devices):
+      self.assertEqual([device['serial'] for device in devices], ['DECAFBAD01'])
+      self.assertEqual(self.treq.get.call_count, 5)
+      return self.datasource.get_devices_by_email('zoidberg@planetexpress.com')
+    deferred.addCallback(check_serial)
+    return self.failUnlessFailure(deferred, stethoscope.api.exceptions.UserNotFoundException)
+
+  def test_prefetch_devices_below_threshold(self):
+    deferred = self.datasource.prefetch_devices(['pfry@planetexpress.com'])
+    deferred.addCallback(self.assertIsNone)
+    deferred.addCallback(lambda _: self.assertFalse(self.treq.get.called))
+    return deferred
+
+  def test_bulk_index_refresh(self):
+    self.datasource.config['BITFIT_BULK_INDEX'] = True
+    deferred = self.datasource.get_userinfo_by_email('tleela@planetexpress.com')
+
+    def check_built(userinfo):
+      self.assertEqual(userinfo['id'], 12346)
+      self.assertEqual(self.treq.get.call_count, 4)
+      self.datasource.get_userinfo_by_email('bender@planetexpress.com')
+      self.assertEqual(self.treq.get.call_count, 4)
+
+      # once stale, the index is rebuilt
+      first = self.datasource.asset_index
+      first.created -= 3600
+      _deferred = self.datasource.get_userinfo_by_email('bender@planetexpress.com')
+      _deferred.addCallback(lambda _: self.assertEqual(self.treq.get.call_count, 8))
+      _deferred.addCallback(lambda _: self.assertIsNot(self.datasource.asset_index, first))
+      return _deferred
+    deferred.addCallback(check_built)
+    return deferred
+
+  def test_paging_ignored(self):
+    # bitfit returns the whole list for every page
+    users = {'items': [{'id': 12345}, {'id': 12346}, {'id': 12347}]}
+    self.responses[('users', 1)] = self.responses[('users', 2)] = users
+    deferred = self.datasource._get_all('users', True)
+
+    def check(items):
+      self.assertEqual([item['id'] for item in items], [12345, 12346, 12347])
+      self.assertEqual(self.requested(), [('users', 1), ('users', 2)])
+    deferred.addCallback(check)
+    return deferred
+
+  def test_max_pages(self):
+    self.datasource.config['BITFIT_MAX_PAGES'] = 1
+    self.responses[('users', 2)] = {'items': [{'id': 12347}, {'id': 12348}]}
+    deferred = self.datasource._get_all('users', True)
+    deferred.addCallback(lambda _: self.fail("listing should stop after BITFIT_MAX_PAGES"))
+    deferred.addErrback(lambda failure: self.assertIn('exceeded 1 pages',
+                                                      failure.getErrorMessage()))
+    return deferred
@@ -0,0 +1,142 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import mock
+from twisted.internet import defer, task
+from twisted.trial import unittest
+
+import stethoscope.api.exceptions
+import stethoscope.plugins.cache
+
+
+class DeferredCacheTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = task.Clock()
+    self.cache = stethoscope.plugins.cache.DeferredCache(10, stale_ttl=20, clock=self.clock)
+    self.func = mock.Mock(side_effect=lambda arg: defer.succeed([{'serial': arg}]))
+
+  def test_hit(self):
+    self.assertEqual(self.successResultOf(self.cache.get('key', self.func, 'foo')),
+                     [{'serial': 'foo'}])
+    self.clock.advance(5)
+    self.assertEqual(self.successResultOf(self.cache.get('key', self.func, 'foo')),
+                     [{'serial': 'foo'}])
+    self.assertEqual(self.func.call_count, 1)
+    self.assertEqual(self.cache.stats()['hits'], 1)
+    self.assertEqual(self.cache.stats()['misses'], 1)
+
+  def test_results_are_copies(self):
+    self.successResultOf(self.cache.get('key', self.func, 'foo'))[0]['serial'] = 'bar'
+    self.assertEqual(self.successResultOf(self.cache.get('key', self.func, 'foo')),
+                     [{'serial': 'foo'}])
+
+  def test_stale_while_revalidate(self):
+    self.successResultOf(self.cache.get('key', self.func, 'foo'))
+    self.clock.advance(15)
+
+    pending = defer.Deferred()
+    self.func.side_effect = lambda arg: pending
+    self.assertEqual(self.successResultOf(self.cache.get('key', self.func, 'foo')),
+                     [{'serial': 'foo'}])
+    self.assertEqual(self.cache.stats()['stale'], 1)
+
+    # refresh is in flight; a second stale read doesn't start another one
+    self.successResultOf(self.cache.get('key', self.func, 'foo'))
+    self.assertEqual(self.func.call_count, 2)
+
+    pending.callback([{'serial': 'refreshed'}])
+    self.assertEqual(self.successResultOf(self.cache.get('key', self.func, 'foo')),
+                     [{'serial': 'refreshed'}])
+    self.assertEqual(self.func.call_count, 2)
+
+  def test_expired(self):
+    self.successResultOf(self.cache.get('key', self.func, 'foo'))
+    self.clock.advance(30)
+    self.successResultOf(self.cache.get('key', self.func, 'foo'))
+    self.assertEqual(self.func.call_count, 2)
+    self.assertEqual(self.cache.stats()['misses'], 2)
+
+  def test_coalesces_concurrent_misses(self):
+    pending = defer.Deferred()
+    self.func.side_effect = lambda arg: pending
+    first = self.cache.get('key', self.func, 'foo')
+    second = self.cache.get('key', self.func, 'foo')
+    self.assertNoResult(first)
+    self.assertEqual(self.func.call_count, 1)
+    self.assertEqual(self.cache.stats()['coalesced'], 1)
+
+    pending.callback([{'serial': 'foo'}])
+    self.assertEqual(self.successResultOf(first), self.successResultOf(second))
+
+  def test_failures_not_cached(self):
+    self.func.side_effect = lambda arg: defer.fail(RuntimeError())
+    self.failureResultOf(self.cache.get('key', self.func, 'foo'), RuntimeError)
+    self.failureResultOf(self.cache.get('key', self.func, 'foo'), RuntimeError)
+    self.assertEqual(self.func.call_count, 2)
+    self.assertEqual(len(self.cache), 0)
+
+  def test_not_found_cached(self):
+    exc = stethoscope.api.exceptions.UserNotFoundException('foo', service='test')
+    self.func.side_effect = lambda arg: defer.fail(exc)
+    self.failureResultOf(self.cache.get('key', self.func, 'foo'),
+        stethoscope.api.exceptions.UserNotFoundException)
+    self.failureResultOf(self.cache.get('key', self.func, 'foo'),
+        stethoscope.api.exceptions.UserNotFoundException)
+    self.assertEqual(self.func.call_count, 1)
+
+  def test_lru_eviction(self):
+    size = stethoscope.plugins.cache.approximate_size([{'serial': 'foo'}])
+    self.cache.max_bytes = size * 2
+    for key in ('foo', 'bar'):
+      self.successResultOf(self.cache.get(key, self.func, key))
+    self.successResultOf(self.cache.get('foo', self.func, 'foo'))  # 'bar' is now least-recent
+    self.successResultOf(self.cache.get('baz', self.func, 'baz'))
+
+    self.assertEqual(self.cache.stats()['evictions'], 1)
+    self.successResultOf(self.cache.get('foo', self.func, 'foo'))
+    self.assertEqual(self.func.call_count, 3)
+    self.successResultOf(self.cache.get('bar', self.func, 'bar'))
+    self.assertEqual(self.func.call_count, 4)
+
+
+class WrapLookupsTestCase(unittest.TestCase):
+
+  def test_single_flight_without_ttl(self):
+    obj = mock.Mock(spec=['get_devices_by_email'])
+    pending = defer.Deferred()
+    obj.get_devices_by_email.return_value = pending
+    lookup = obj.get_devices_by_email
+
+    stethoscope.plugins.cache.wrap_lookups(obj, {})
+    self.assertIsNone(obj.response_cache)
+    first = obj.get_devices_by_email('user@example.com')
+    second = obj.get_devices_by_email('user@example.com')
+    pending.callback([{'serial': 'foo'}])
+
+    lookup.assert_called_once_with('user@example.com')
+    self.assertEqual(self.successResultOf(first), self.successResultOf(second))
+    self.assertEqual(obj.single_flight.stats()['coalesced'], 1)
+
+  def test_disabled(self):
+    obj = mock.Mock(spec=['get_devices_by_email'])
+    lookup = obj.get_devices_by_email
+    stethoscope.plugins.cache.wrap_lookups(obj, {'SINGLE_FLIGHT': False})
+    self.assertIsNone(obj.single_flight)
+    self.assertIs(obj.get_devices_by_email, lookup)
+
+  def test_wraps_lookup_methods(self):
+    obj = mock.Mock(spec=['get_devices_by_email', 'get_devices_by_serial'])
+    obj.get_devices_by_email.return_value = defer.succeed([])
+    obj.get_devices_by_serial.return_value = defer.succeed([])
+    lookup = obj.get_devices_by_email
+
+    stethoscope.plugins.cache.wrap_lookups(obj, {'CACHE_TTL': 60}, clock=task.Clock())
+    for _ in range(3):
+      self.successResultOf(obj.get_devices_by_email('user@example.com'))
+      self.successResultOf(obj.get_devices_by_serial('user@example.com'))
+
+    lookup.assert_called_once_with('user@example.com')
+    self.assertEqual(obj.response_cache.stats()['misses'], 2)
+    self.assertEqual(obj.response_cache.stats()['hits'], 4)
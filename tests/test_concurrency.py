@@ -0,0 +1,175 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+from twisted.internet import defer, task
+from twisted.python import failure
+from twisted.trial import unittest
+
+import stethoscope.api.exceptions
+import stethoscope.plugins.concurrency
+
+
+class AdaptiveLimiterTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = task.Clock()
+    self.limiter = stethoscope.plugins.concurrency.AdaptiveLimiter(2, max_limit=4,
+        latency_target=5, clock=self.clock)
+
+  def test_queues_beyond_limit(self):
+    pending = [defer.Deferred() for _ in range(3)]
+    results = [self.limiter.run(lambda d=d: d) for d in pending]
+    self.assertEqual(self.limiter.active, 2)
+    self.assertEqual(self.limiter.stats()['waiting'], 1)
+
+    pending[0].callback('foo')
+    self.assertEqual(self.successResultOf(results[0]), 'foo')
+    self.assertEqual(self.limiter.active, 2)
+    self.assertEqual(self.limiter.stats()['waiting'], 0)
+
+    pending[2].callback('baz')
+    pending[1].callback('bar')
+    self.assertEqual(self.successResultOf(results[2]), 'baz')
+    self.assertEqual(self.limiter.active, 0)
+
+  def test_additive_increase(self):
+    for _ in range(20):
+      self.successResultOf(self.limiter.run(defer.succeed, None))
+    self.assertEqual(self.limiter.limit, 4)
+    self.assertEqual(self.limiter.window, 4)
+
+  def test_multiplicative_decrease(self):
+    self.limiter.window = 4
+    exc = stethoscope.api.exceptions.InvalidResponseException(429, service='test')
+    self.failureResultOf(self.limiter.run(defer.fail, exc))
+    self.assertEqual(self.limiter.limit, 2)
+
+    self.clock.advance(1)
+    exc = stethoscope.api.exceptions.InvalidResponseException(503, service='test')
+    self.failureResultOf(self.limiter.run(defer.fail, exc))
+    self.assertEqual(self.limiter.limit, 1)
+
+    # not-found is not a sign of overload
+    exc = stethoscope.api.exceptions.InvalidResponseException(404, service='test')
+    self.failureResultOf(self.limiter.run(defer.fail, exc))
+    self.assertEqual(self.limiter.limit, 1)
+
+  def test_decreases_once_per_burst(self):
+    self.limiter.window = 4
+    pending = [defer.Deferred() for _ in range(4)]
+    results = [self.limiter.run(lambda d=d: d) for d in pending]
+    self.clock.advance(1)
+    for deferred in pending:
+      deferred.errback(stethoscope.api.exceptions.InvalidResponseException(500))
+    for result in results:
+      self.failureResultOf(result)
+    self.assertEqual(self.limiter.limit, 2)
+    self.assertEqual(self.limiter.stats()['decreases'], 1)
+
+  def test_slow_responses(self):
+    pending = defer.Deferred()
+    result = self.limiter.run(lambda: pending)
+    self.clock.advance(10)
+    pending.callback('foo')
+    self.successResultOf(result)
+    self.assertEqual(self.limiter.limit, 1)
+
+  def test_synchronous_results(self):
+    self.limiter = stethoscope.plugins.concurrency.AdaptiveLimiter(1, max_limit=1,
+        clock=self.clock)
+    blocker = defer.Deferred()
+    self.limiter.run(lambda: blocker)
+    results = [self.limiter.run(defer.succeed, idx) for idx in range(5000)]
+    blocker.callback(None)
+    self.assertEqual([self.successResultOf(result) for result in results], list(range(5000)))
+
+
+class Response(object):
+
+  def __init__(self, code):
+    self.code = code
+
+
+class RunLimitedWithRetryTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.clock = task.Clock()
+    self.limiter = stethoscope.plugins.concurrency.AdaptiveLimiter(2, max_limit=4,
+        clock=self.clock)
+    self.attempts = list()
+
+  def retry(self, func, delay=10, retry_on=None):
+    """Call `func` until it succeeds with a result other than `retry_on`, with `delay` between."""
+    def _retry(result):
+      if len(self.attempts) < 3 and (isinstance(result, failure.Failure) or
+                                     getattr(result, 'code', None) == retry_on):
+        return task.deferLater(self.clock, delay, self.retry, func, delay, retry_on)
+      return result
+    self.attempts.append(func)
+    return defer.maybeDeferred(func).addBoth(_retry)
+
+  def run_limited(self, read, request, retry_on=None):
+    return stethoscope.plugins.concurrency.run_limited_with_retry(self,
+        lambda func: self.retry(func, retry_on=retry_on), read, request)
+
+  def test_releases_slot_while_backing_off(self):
+    responses = [defer.fail(Exception('connection refused')), defer.succeed(Response(200))]
+    body = defer.Deferred()
+    result = self.run_limited(lambda response: body, lambda: responses[len(self.attempts) - 1])
+
+    # the first attempt failed, and no slot is held while waiting to retry
+    self.assertEqual(len(self.attempts), 1)
+    self.assertEqual(self.limiter.active, 0)
+
+    # the second attempt holds its slot until its body has been read
+    self.clock.advance(10)
+    self.assertEqual(len(self.attempts), 2)
+    self.assertEqual(self.limiter.active, 1)
+    body.callback('body')
+    self.assertEqual(self.successResultOf(result), 'body')
+    self.assertEqual(self.limiter.active, 0)
+
+  def test_releases_slot_of_retried_response(self):
+    responses = [Response(503), Response(200)]
+    result = self.run_limited(lambda response: response.code,
+                              lambda: responses[len(self.attempts) - 1], retry_on=503)
+    self.assertEqual(self.limiter.active, 1)
+
+    # the retried response's slot is released (as overloaded) when the next attempt starts
+    self.clock.advance(10)
+    self.assertEqual(len(self.attempts), 2)
+    self.assertEqual(self.limiter.stats()['decreases'], 1)
+    self.assertEqual(self.successResultOf(result), 200)
+    self.assertEqual(self.limiter.active, 0)
+
+  def test_read_failures_not_retried(self):
+    def read(response):
+      raise stethoscope.api.exceptions.InvalidResponseException(response.code, service='test')
+
+    result = self.run_limited(read, lambda: Response(503))
+    self.failureResultOf(result, stethoscope.api.exceptions.InvalidResponseException)
+    self.assertEqual(len(self.attempts), 1)
+    self.assertEqual(self.limiter.active, 0)
+    self.assertEqual(self.limiter.stats()['decreases'], 1)
+
+  def test_not_limited(self):
+    self.limiter = None
+    result = self.run_limited(lambda response: response.code, lambda: Response(200))
+    self.assertEqual(self.successResultOf(result), 200)
+
+
+class GetLimiterTestCase(unittest.TestCase):
+
+  def tearDown(self):
+    stethoscope.plugins.concurrency._limiters.pop('test', None)
+
+  def test_not_configured(self):
+    self.assertIsNone(stethoscope.plugins.concurrency.get_limiter('test', {}))
+
+  def test_shared(self):
+    config = {'CONCURRENCY_LIMIT': 4, 'CONCURRENCY_MAX': 16}
+    limiter = stethoscope.plugins.concurrency.get_limiter('test', config, clock=task.Clock())
+    self.assertEqual(limiter.limit, 4)
+    self.assertEqual(limiter.max_limit, 16)
+    self.assertIs(stethoscope.plugins.concurrency.get_limiter('test', config), limiter)
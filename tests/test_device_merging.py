@@ -3,6 +3,8 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import copy
+import itertools
+import random
 import unittest
 
 import arrow
@@ -125,6 +127,116 @@ def test_group_devices_by_multiple():
   assert third in groups[0]
 
 
+def test_group_devices_with_conflict():
+  this = {'identifiers': {'mac_addresses': [DECAFBAD], 'serial': '0xDECAFBAD'}}
+  other = {'identifiers': {'mac_addresses': [DECAFBAD], 'serial': '0xDEADBEEF'}}
+  third = {'identifiers': {'mac_addresses': [DECAFBAD, DEADBEEF]}}
+
+  # 'this' and 'other' conflict on serial, so 'third' joins only the first of them
+  groups = stethoscope.api.devices.group_devices([this, other, third])
+  assert groups == [[this, third], [other]]
+
+  groups = stethoscope.api.devices.group_devices([third, this, other])
+  assert groups == [[third, this], [other]]
+
+  groups = stethoscope.api.devices.group_devices([this, other])
+  assert groups == [[this], [other]]
+
+
+def test_merge_devices_with_conflict_matches_pairwise():
+  devices = [
+    {'source': 'google', 'identifiers': {'mac_addresses': [DECAFBAD]}},
+    {'source': 'jamf', 'identifiers': {'mac_addresses': [DECAFBAD], 'serial': '0xDECAFBAD'}},
+    {'source': 'landesk', 'identifiers': {'mac_addresses': [DECAFBAD], 'serial': '0xDEADBEEF'}},
+  ]
+
+  expected = [stethoscope.api.devices.merge_device_group(group) for group in
+              stethoscope.api.devices.group_devices_pairwise(copy.deepcopy(devices))]
+  merged = stethoscope.api.devices.merge_devices(devices)
+  assert merged == expected
+  assert [device['sources'] for device in merged] == [['google', 'jamf'], ['landesk']]
+
+
+def _random_devices(rng, count):
+  """Generate devices which share (and often conflict on) a small pool of identifiers."""
+  pool_size = max(2, count // 3)
+  serials = ['SERIAL{:04d}'.format(idx) for idx in range(pool_size)]
+  macaddrs = ['00:DE:CA:{:02X}:{:02X}:00'.format(idx // 256, idx % 256) for idx in range(pool_size)]
+
+  devices = list()
+  for _ in range(count):
+    identifiers = {}
+    if rng.random() < 0.6:
+      identifiers['serial'] = rng.choice(serials)
+    if rng.random() < 0.6:
+      identifiers['mac_addresses'] = rng.sample(macaddrs + [LOCALMAC, ZERODMAC], 2)
+    if rng.random() < 0.2:
+      identifiers['udid'] = rng.choice(serials).lower()
+    devices.append({'identifiers': identifiers})
+  return devices
+
+
+def _physical_devices(rng, count):
+  """Generate devices which each report a subset of the identifiers of one physical device."""
+  devices = list()
+  for _ in range(count):
+    physical = rng.randrange(max(2, count // 3))
+    macaddrs = ['00:DE:CA:{:02X}:{:02X}:00'.format(physical, nic) for nic in range(2)]
+
+    identifiers = {}
+    if rng.random() < 0.6:
+      identifiers['serial'] = 'SERIAL{:04d}'.format(physical)
+    if rng.random() < 0.6:
+      identifiers['mac_addresses'] = rng.sample(macaddrs, rng.randint(1, 2))
+      if rng.random() < 0.3:
+        identifiers['mac_addresses'].append(LOCALMAC)
+    if rng.random() < 0.2:
+      identifiers['udid'] = 'udid{:04d}'.format(physical)
+    devices.append({'identifiers': identifiers})
+  return devices
+
+
+def _as_index_sets(groups, devices):
+  ids = [id(device) for device in devices]
+  return sorted(sorted(ids.index(id(device)) for device in group) for group in groups)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_group_devices_matches_pairwise(seed):
+  # `group_devices_pairwise` updates identifiers in place (and so can disagree with itself about
+  # conflicting devices), so compare the two only on devices without conflicts
+  devices = _physical_devices(random.Random(seed), 30)
+  reference = copy.deepcopy(devices)
+
+  expected = _as_index_sets(stethoscope.api.devices.group_devices_pairwise(reference), reference)
+  assert _as_index_sets(stethoscope.api.devices.group_devices(devices), devices) == expected
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_group_devices_with_conflicts(seed):
+  devices = _random_devices(random.Random(seed), 30)
+  original = copy.deepcopy(devices)
+  groups = stethoscope.api.devices.group_devices(devices)
+  assert devices == original
+  assert sorted(itertools.chain.from_iterable(_as_index_sets(groups, devices))) == \
+      list(range(len(devices)))
+
+  # every group can be merged...
+  merged = [stethoscope.api.devices.merge_identifiers(
+            copy.deepcopy([device['identifiers'] for device in group])) for group in groups]
+
+  # ...and any two groups with matching devices conflict
+  group_of = dict((id(device), idx) for idx, group in enumerate(groups) for device in group)
+  for this, other in itertools.combinations(devices, 2):
+    this_idx, other_idx = group_of[id(this)], group_of[id(other)]
+    if this_idx == other_idx:
+      continue
+    if stethoscope.api.devices.compare_identifiers(this['identifiers'], other['identifiers']):
+      with pytest.raises(stethoscope.api.devices.MergeConflict):
+        stethoscope.api.devices.merge_identifiers(
+          copy.deepcopy([merged[this_idx], merged[other_idx]]))
+
+
 def test_merge_identifiers():
   this = {
     "mac_addresses": [
@@ -0,0 +1,197 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import time
+
+import arrow
+import pytest
+from twisted.internet import defer
+from twisted.trial import unittest
+
+import stethoscope.plugins.sources.duo.base
+import stethoscope.plugins.sources.duo.deferred
+import stethoscope.utils
+
+
+def auth_log_entry(timestamp, username):
+  return {
+    'timestamp': timestamp,
+    'username': username,
+    'factor': 'Duo Push',
+    'reason': 'User approved',
+    'result': 'SUCCESS',
+    'ip': '192.0.2.1',
+    'eventtype': 'authentication',
+    'device': '555-123-4567',
+    'integration': 'VPN',
+    'new_enrollment': False,
+  }
+
+
+class FakeAdmin(object):
+
+  def __init__(self, entries):
+    self.entries = entries
+    self.requests = list()
+
+  def get_authentication_log(self, mintime):
+    self.requests.append(mintime)
+    if isinstance(self.entries, Exception):
+      raise self.entries
+    return [entry for entry in self.entries if entry['timestamp'] >= mintime]
+
+
+class DuoDataSource(stethoscope.plugins.sources.duo.base.DuoDataSourceBase):
+
+  connection = None
+
+
+@pytest.fixture
+def now():
+  return int(time.time())
+
+
+@pytest.fixture
+def datasource(now):
+  datasource = DuoDataSource({
+    'DUO_INTEGRATION_KEY': '',
+    'DUO_SECRET_KEY': '',
+    'DUO_API_HOSTNAME': '',
+  })
+  datasource.connection = FakeAdmin([
+    auth_log_entry(now - 7200, 'pfry'),
+    auth_log_entry(now - 3600, 'tleela'),
+    auth_log_entry(now - 60, 'pfry'),
+  ])
+  return datasource
+
+
+def test_get_events_by_email(datasource, now):
+  events = datasource.get_events_by_email('pfry@example.com')
+  assert [event['timestamp'] for event in events] == [arrow.get(now - 60), arrow.get(now - 7200)]
+  assert all(event['username'] == 'pfry' for event in events)
+  assert '_raw' not in events[0]
+  # backfilled from the start of the retention window
+  assert datasource.connection.requests[0] <= now - 60 * 60 * 12
+
+
+def test_get_events_by_email_paged(datasource, now):
+  events = datasource.get_events_by_email('pfry@example.com', limit=1)
+  assert [event['timestamp'] for event in events] == [arrow.get(now - 60)]
+  before = stethoscope.utils.PageCursor(events[-1]['timestamp'], events[-1]['id'])
+  events = datasource.get_events_by_email('pfry@example.com', before=before)
+  assert [event['timestamp'] for event in events] == [arrow.get(now - 7200)]
+
+
+def test_get_events_by_email_paged_at_same_time(datasource, now):
+  datasource.connection.entries.insert(1, dict(auth_log_entry(now - 7200, 'pfry'), ip='192.0.2.2'))
+  events = datasource.get_events_by_email('pfry@example.com', limit=2)
+  assert [event['timestamp'] for event in events] == [arrow.get(now - 60), arrow.get(now - 7200)]
+  before = stethoscope.utils.PageCursor(events[-1]['timestamp'], events[-1]['id'])
+  events += datasource.get_events_by_email('pfry@example.com', before=before)
+  assert sorted(event['ip_address'] for event in events[1:]) == ['192.0.2.1', '192.0.2.2']
+
+
+def test_update_events_incremental(datasource, now):
+  datasource.update_events()
+  datasource.connection.entries.append(auth_log_entry(now, 'tleela'))
+  events = datasource.get_events_by_email('tleela@example.com')
+  assert len(events) == 2
+  # only entries after the latest one already stored were requested
+  assert datasource.connection.requests[-1] == now - 60 + 1
+  assert len(datasource.event_store) == 4
+
+
+class DeferredDuoDataSource(stethoscope.plugins.sources.duo.deferred.DeferredDuoDataSource):
+
+  def connect(self):
+    self.connections += 1
+    return self.admin
+
+
+class DeferredDuoTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.now = int(time.time())
+    self.datasource = DeferredDuoDataSource({
+      'DUO_INTEGRATION_KEY': '',
+      'DUO_SECRET_KEY': '',
+      'DUO_API_HOSTNAME': '',
+      'DUO_POLL_INTERVAL': 3600,
+    })
+    self.datasource.connections = 0
+    self.datasource.admin = FakeAdmin([
+      auth_log_entry(self.now - 7200, 'pfry'),
+      auth_log_entry(self.now - 60, 'tleela'),
+    ])
+    self.addCleanup(self.datasource.poller.stop)
+
+  @defer.inlineCallbacks
+  def test_lookups_wait_for_first_poll(self):
+    pfry, tleela = yield defer.gatherResults([
+      self.datasource.get_events_by_email('pfry@example.com'),
+      self.datasource.get_events_by_email('tleela@example.com'),
+    ])
+    self.assertEqual([event['username'] for event in pfry], ['pfry'])
+    self.assertEqual([event['username'] for event in tleela], ['tleela'])
+    self.assertEqual(len(self.datasource.admin.requests), 1)
+
+  @defer.inlineCallbacks
+  def test_lookups_read_only_event_store(self):
+    yield self.datasource.get_events_by_email('pfry@example.com')
+    self.datasource.admin.entries.append(auth_log_entry(self.now, 'pfry'))
+    events = yield self.datasource.get_events_by_email('pfry@example.com')
+    self.assertEqual(len(events), 1)
+    self.assertEqual(len(self.datasource.admin.requests), 1)
+
+    # the next poll picks up the new entry, using the same client
+    yield self.datasource.poller.poll()
+    events = yield self.datasource.get_events_by_email('pfry@example.com')
+    self.assertEqual(len(events), 2)
+    self.assertEqual(self.datasource.admin.requests[-1], self.now - 60 + 1)
+    self.assertEqual(self.datasource.connections, 1)
+
+  @defer.inlineCallbacks
+  def test_poll_failure(self):
+    entries = self.datasource.admin.entries
+    self.datasource.admin.entries = ValueError("unavailable")
+    # until a poll succeeds, lookups fail rather than finding no events
+    yield self.assertFailure(self.datasource.get_events_by_email('pfry@example.com'), ValueError)
+    yield self.assertFailure(self.datasource.get_events_by_email('pfry@example.com'), ValueError)
+    self.assertTrue(self.datasource.poller.running)
+    self.assertEqual(self.datasource.poller.stats(), {'polls': 0, 'failures': 1})
+
+    self.datasource.admin.entries = entries
+    yield self.datasource.poller.poll()
+    events = yield self.datasource.get_events_by_email('pfry@example.com')
+    self.assertEqual([event['username'] for event in events], ['pfry'])
+
+    # once a poll has succeeded, lookups are answered even while polls fail
+    self.datasource.admin.entries = ValueError("unavailable")
+    yield self.datasource.poller.poll()
+    events = yield self.datasource.get_events_by_email('pfry@example.com')
+    self.assertEqual(len(events), 1)
+    self.assertEqual(self.datasource.poller.stats(), {'polls': 1, 'failures': 2})
+
+
+def test_event_journal(tmpdir, now):
+  config = {
+    'DUO_INTEGRATION_KEY': '',
+    'DUO_SECRET_KEY': '',
+    'DUO_API_HOSTNAME': '',
+    'DUO_EVENT_JOURNAL': str(tmpdir.join('duo')),
+  }
+  datasource = DuoDataSource(config)
+  datasource.connection = FakeAdmin([
+    auth_log_entry(now - 7200, 'pfry'),
+    auth_log_entry(now - 60, 'tleela'),
+  ])
+  datasource.update_events()
+
+  # after a restart, the journal is replayed and only newer entries are requested
+  restarted = DuoDataSource(config)
+  restarted.connection = FakeAdmin(datasource.connection.entries)
+  events = restarted.get_events_by_email('pfry@example.com')
+  assert [event['timestamp'] for event in events] == [arrow.get(now - 7200)]
+  assert restarted.connection.requests == [now - 60 + 1]
@@ -0,0 +1,86 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import arrow
+import elasticsearch
+import elasticsearch_dsl.response
+import mock
+import pytest
+
+import stethoscope.plugins.mixins.es
+import stethoscope.plugins.sources.esnotifications
+import stethoscope.utils
+
+
+def make_plugin(**kwargs):
+  config = {
+    'ELASTICSEARCH_HOSTS': ['http://localhost:9200'],
+    'ELASTICSEARCH_INDEX': 'stethoscope_notifications',
+    'ELASTICSEARCH_DOCTYPE': 'default',
+  }
+  config.update(kwargs)
+  return stethoscope.plugins.sources.esnotifications.ElasticSearchNotifications(config)
+
+
+def test_create_search():
+  search = make_plugin().create_search('user@example.com').to_dict()
+  assert search == {
+    'query': {'match': {'email': 'user@example.com'}},
+    'sort': [{'event_timestamp': {'order': 'desc'}}],
+    'size': 10,
+  }
+
+
+def test_create_search_paged():
+  plugin = make_plugin(ELASTICSEARCH_SOURCE_FIELDS=['title', 'severity'],
+                       ELASTICSEARCH_TIEBREAKER_FIELD='notification_id')
+  before = stethoscope.utils.PageCursor(arrow.get('2017-01-01T00:00:00Z'), 'AVmLdfQN')
+  search = plugin.create_search('user@example.com', before=before, limit=50).to_dict()
+  assert search['size'] == 50
+  # notifications with the same timestamp are paged by their ids
+  assert search['search_after'] == [1483228800000, 'AVmLdfQN']
+  assert search['_source'] == {'includes': ['title', 'severity', 'event_timestamp']}
+
+
+def test_create_search_paged_without_tiebreaker():
+  before = stethoscope.utils.PageCursor(arrow.get('2017-01-01T00:00:00Z'), 'AVmLdfQN')
+  search = make_plugin().create_search('user@example.com', before=before).to_dict()
+  # `_id` is never sorted by, since that requires fielddata
+  assert search['sort'] == [{'event_timestamp': {'order': 'desc'}}]
+  assert search['search_after'] == [1483228800000]
+
+
+def test_create_search_tiebreaker():
+  plugin = make_plugin(ELASTICSEARCH_TIMESTAMP_FIELD='alert.created',
+                       ELASTICSEARCH_TIEBREAKER_FIELD='alert_id')
+  before = stethoscope.utils.PageCursor(arrow.get('2017-01-01T00:00:00Z'), None)
+  search = plugin.create_search('user@example.com', before=before).to_dict()
+  assert search['sort'] == [{'alert.created': {'order': 'desc'}}, {'alert_id': {'order': 'desc'}}]
+  # without an id, notifications at the cursor's timestamp are excluded
+  assert search['search_after'] == [1483228800000, '']
+
+
+def test_notifications_normalized():
+  plugin = make_plugin(ELASTICSEARCH_TIMESTAMP_FIELD='alert.created',
+                       ELASTICSEARCH_SOURCE_FIELDS=['title'])
+  response = elasticsearch_dsl.response.Response(plugin.create_search('user@example.com'), {
+    'hits': {'total': 1, 'hits': [
+      {'_id': 'a1', '_source': {'title': 'Alert', 'alert': {'created': '2017-01-01T00:00:00Z'}}},
+    ]},
+  })
+  with mock.patch('elasticsearch_dsl.Search.execute', return_value=response):
+    notifications = plugin._get_notifications_by_email('user@example.com')
+  assert notifications == [{'_id': 'a1', '_source': {
+    'title': 'Alert',
+    'alert': {'created': '2017-01-01T00:00:00Z'},
+    'event_timestamp': '2017-01-01T00:00:00Z',
+  }}]
+
+
+def test_query_failure():
+  plugin = make_plugin()
+  with mock.patch('elasticsearch_dsl.Search.execute',
+                  side_effect=elasticsearch.exceptions.ConnectionError('unavailable')):
+    with pytest.raises(stethoscope.plugins.mixins.es.ElasticSearchException):
+      plugin._get_notifications_by_email('user@example.com')
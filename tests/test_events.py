@@ -0,0 +1,104 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import stethoscope.plugins.events
+import stethoscope.utils
+
+
+def test_get_by_user():
+  store = stethoscope.plugins.events.EventStore()
+  for timestamp in range(10):
+    store.add('user{:d}'.format(timestamp % 3), timestamp, {'timestamp': timestamp})
+  assert [event['timestamp'] for event in store.get('user1')] == [1, 4, 7]
+  assert store.get('nobody') == []
+  assert store.latest == 9
+
+
+def test_retention():
+  now = [100]
+  store = stethoscope.plugins.events.EventStore(retention=50, clock=lambda: now[0])
+  store.add('pfry', 60, {'id': 1})
+  store.add('tleela', 70, {'id': 2})
+  store.add('pfry', 80, {'id': 3})
+  assert len(store.get('pfry')) == 2
+
+  now[0] = 125
+  assert store.get('pfry') == [{'id': 3}]
+  assert store.get('tleela') == []
+
+  stats = store.stats()
+  assert (stats['events'], stats['users'], stats['evicted_for_age']) == (1, 1, 2)
+  # the latest timestamp is kept for incremental updates
+  assert stats['latest'] == 80
+
+
+def test_max_events():
+  store = stethoscope.plugins.events.EventStore(max_events=3)
+  for timestamp in range(5):
+    store.add('pfry' if timestamp % 2 else 'tleela', timestamp, {'timestamp': timestamp})
+  assert len(store) == 3
+  assert [event['timestamp'] for event in store.get('tleela')] == [2, 4]
+  assert [event['timestamp'] for event in store.get('pfry')] == [3]
+  assert store.stats()['evicted_for_size'] == 2
+
+
+def test_late_events():
+  store = stethoscope.plugins.events.EventStore(max_events=3)
+  for timestamp in (5, 9, 7, 1, 8):
+    store.add('pfry', timestamp, {'timestamp': timestamp})
+  store.add('tleela', 6, {'timestamp': 6})
+  # events are kept in time order, and the oldest (rather than the first added) are evicted
+  assert [event['timestamp'] for event in store.get('pfry')] == [7, 8, 9]
+  recent = store.get_recent('pfry', before=stethoscope.utils.PageCursor(9, None))
+  assert [event['timestamp'] for event in recent] == [8, 7]
+  assert store.get('tleela') == []
+  assert store.stats()['oldest'] == 7
+
+
+def test_add_new():
+  store = stethoscope.plugins.events.EventStore(key=lambda event: event['id'])
+  assert store.add_new('pfry', 10.5, {'id': 1})
+  assert not store.add_new('pfry', 10.5, {'id': 1})
+  # events at the same time are told apart by their identity
+  assert store.add_new('pfry', 10.5, {'id': 2})
+  assert store.add_new('pfry', 11.0, {'id': 3})
+  assert not store.add_new('pfry', 10.5, {'id': 2})
+  assert store.add_new('tleela', 10.5, {'id': 1})
+  assert [event['id'] for event in store.get('pfry')] == [1, 2, 3]
+  assert store.latest_for('pfry') == 11.0
+  assert store.latest_for('nobody') is None
+
+
+def test_add_new_without_key():
+  store = stethoscope.plugins.events.EventStore()
+  assert store.add_new('pfry', 10.5, {'id': 1})
+  assert not store.add_new('pfry', 10.5, {'id': 2})
+  assert len(store) == 1
+
+
+def test_get_recent():
+  store = stethoscope.plugins.events.EventStore()
+  for timestamp in range(10):
+    store.add('user{:d}'.format(timestamp % 2), timestamp, {'timestamp': timestamp})
+  assert [event['timestamp'] for event in store.get_recent('user0')] == [8, 6, 4, 2, 0]
+  recent = store.get_recent('user0', before=stethoscope.utils.PageCursor(6, None), limit=2)
+  assert [event['timestamp'] for event in recent] == [4, 2]
+  assert store.get_recent('user1', before=stethoscope.utils.PageCursor(1, None)) == []
+
+
+def test_get_recent_at_same_time():
+  store = stethoscope.plugins.events.EventStore(key=stethoscope.plugins.events.get_event_id)
+  for timestamp, event_id in ((200, 'b'), (100, 'a'), (200, 'a'), (200, 'c')):
+    store.add('pfry', timestamp, {'timestamp': timestamp, 'id': event_id})
+
+  # paging one event at a time (from the last event of each page) visits every event once
+  pages = list()
+  before = None
+  while True:
+    page = store.get_recent('pfry', before=before, limit=1)
+    if len(page) == 0:
+      break
+    pages.append((page[0]['timestamp'], page[0]['id']))
+    before = stethoscope.utils.PageCursor(page[0]['timestamp'], page[0]['id'])
+  assert pages == [(200, 'c'), (200, 'b'), (200, 'a'), (100, 'a')]
@@ -4,6 +4,7 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 import json
 
+import arrow
 import klein
 import klein.test.test_resource
 import mock
@@ -20,6 +21,7 @@ import stethoscope.api.endpoints.notifications
 import stethoscope.api.endpoints.userinfo
 import stethoscope.api.endpoints.utils
 import stethoscope.auth
+import stethoscope.utils
 
 
 config = {
@@ -155,6 +157,49 @@ class RoutingTestCase(twisted.trial.unittest.TestCase):
 
     self.check_result(app, b'/notifications/merged/user@example.com', result_bar + result_foo)
 
+  def test_merged_notifications_paged(self):
+    app = klein.Klein()
+    auth = DummyAuthProvider()
+    requests = list()
+
+    def get_notifications_ext(records, name):
+      def get_notifications_by_email(email, before=None, limit=None):
+        requests.append((name, before, limit))
+        if before is not None:
+          before = before._replace(timestamp=before.timestamp.float_timestamp)
+        return twisted.internet.defer.succeed([
+          {'_id': _id, '_source': {'event_timestamp': timestamp}} for timestamp, _id in records
+          if before is None or before.precedes(timestamp, _id)
+        ][:limit])
+      ext = mock.MagicMock()
+      ext.name = name
+      ext.obj.get_notifications_by_email = get_notifications_by_email
+      return ext
+
+    mock_extension_manager = stevedore.ExtensionManager.make_test_instance([
+      get_notifications_ext([(5, 'f2'), (3, 'f1'), (1, 'f0')], 'foo'),
+      get_notifications_ext([(4, 'b2'), (3, 'b1'), (2, 'b0')], 'bar'),
+    ])
+
+    with mock.patch('stethoscope.plugins.utils.instantiate_plugins') as \
+        mock_instantiate_plugins:
+      mock_instantiate_plugins.return_value = mock_extension_manager
+      stethoscope.api.endpoints.notifications.register_notification_api_endpoints(app, config, auth)
+
+    self.check_result(app,
+        b'/notifications/merged/user@example.com?limit=3&before=2017-01-01T00:00:00Z',
+        [{'_id': _id, '_source': {'event_timestamp': timestamp}}
+         for timestamp, _id in ((5, 'f2'), (4, 'b2'), (3, 'f1'))])
+    self.assertEqual(sorted(request[2] for request in requests), [3, 3])
+    self.assertEqual(requests[0][1],
+                     stethoscope.utils.PageCursor(arrow.get('2017-01-01T00:00:00Z'), None))
+
+    # the next page starts with the notification with the same timestamp as the last one returned
+    self.check_result(app,
+        b'/notifications/merged/user@example.com?limit=2&before=1970-01-01T00:00:03Z&before_id=f1',
+        [{'_id': _id, '_source': {'event_timestamp': timestamp}}
+         for timestamp, _id in ((3, 'b1'), (2, 'b0'))])
+
   def test_register_account_api_endpoints(self):
     app = klein.Klein()
     auth = DummyAuthProvider()
@@ -217,6 +262,48 @@ class RoutingTestCase(twisted.trial.unittest.TestCase):
 
     self.check_result(app, b'/events/merged/user@example.com', result_bar + result_foo)
 
+  def test_merged_events_paged(self):
+    app = klein.Klein()
+    auth = DummyAuthProvider()
+    requests = list()
+
+    def get_events_ext(records, name):
+      def get_events_by_email(email, before=None, limit=None):
+        requests.append((name, before, limit))
+        if before is not None:
+          before = before._replace(timestamp=before.timestamp.float_timestamp)
+        events = [{'timestamp': timestamp, 'id': event_id, 'source': name}
+                  for timestamp, event_id in records
+                  if before is None or before.precedes(timestamp, event_id)]
+        return twisted.internet.defer.succeed(events[:limit])
+      ext = mock.MagicMock()
+      ext.name = name
+      ext.obj.get_events_by_email = get_events_by_email
+      return ext
+
+    mock_extension_manager = stevedore.ExtensionManager.make_test_instance([
+      get_events_ext([(9, 'a'), (5, 'b'), (5, 'a'), (1, 'a')], 'foo'),
+      get_events_ext([(8, 'a'), (7, 'a'), (6, 'a'), (5, 'c'), (2, 'a')], 'bar'),
+    ])
+    mock_hook_manager = stevedore.ExtensionManager.make_test_instance([])
+
+    with mock.patch('stethoscope.plugins.utils.instantiate_plugins') as \
+        mock_instantiate_plugins:
+      mock_instantiate_plugins.side_effect = [mock_extension_manager, mock_hook_manager]
+      stethoscope.api.endpoints.events.register_event_api_endpoints(app, config, auth)
+
+    self.check_result(app, b'/events/merged/user@example.com?limit=3&before=1970-01-01T00:00:09Z',
+        [{'timestamp': 8, 'id': 'a', 'source': 'bar'}, {'timestamp': 7, 'id': 'a', 'source': 'bar'},
+         {'timestamp': 6, 'id': 'a', 'source': 'bar'}])
+    self.assertEqual(sorted(request[2] for request in requests), [3, 3])
+
+    # a page may end between events with the same timestamp
+    self.check_result(app, b'/events/merged/user@example.com?limit=2&before=1970-01-01T00:00:05Z'
+        b'&before_id=c', [{'timestamp': 5, 'id': 'b', 'source': 'foo'},
+                          {'timestamp': 5, 'id': 'a', 'source': 'foo'}])
+    self.assertEqual(requests[-1][1],
+                     stethoscope.utils.PageCursor(arrow.get('1970-01-01T00:00:05Z'), 'c'))
+
   def test_register_device_api_endpoints(self):
     app = klein.Klein()
     auth = DummyAuthProvider()
@@ -7,12 +7,18 @@ import json
 import os
 import os.path
 import pprint
+import threading
 
 import arrow
 import logbook
+import mock
 import pytest
+import twisted.internet.defer
+import twisted.trial.unittest
 
+import stethoscope.plugins.sources.google.base
 import stethoscope.plugins.sources.google.deferred
+import stethoscope.utils
 
 
 logger = logbook.Logger(__name__)
@@ -230,3 +236,292 @@ def test_process_device_chromeos_model(raw_device, expected, mock_datasource):
     assert 'model' not in device
   else:
     assert device['model'] == expected
+
+
+@pytest.fixture(scope='function')
+def mock_credentials(mock_datasource):
+  credentials = mock.Mock(access_token=None, access_token_expired=False)
+  credentials.authorize.side_effect = lambda http: http
+  credentials.refresh.side_effect = lambda http: setattr(credentials, 'access_token', 'token')
+  mock_datasource._credentials = credentials
+  mock_datasource.build_service = mock.Mock(side_effect=lambda name, version, http: mock.Mock())
+  return credentials
+
+
+def test_service_cached_per_thread(mock_datasource, mock_credentials):
+  directory = mock_datasource.service('admin', 'directory_v1')
+  assert mock_datasource.service('admin', 'directory_v1') is directory
+  assert mock_datasource.service('admin', 'reports_v1') is not directory
+  assert mock_datasource.build_service.call_count == 2
+  assert mock_credentials.authorize.call_count == 1
+
+  services = list()
+  thread = threading.Thread(
+      target=lambda: services.append(mock_datasource.service('admin', 'directory_v1')))
+  thread.start()
+  thread.join()
+  assert services[0] is not directory
+  assert mock_datasource.build_service.call_args[1]['http'] is not mock_datasource.connection
+  assert mock_credentials.authorize.call_count == 2
+
+
+def test_token_refreshed_once(mock_datasource, mock_credentials):
+  threads = [threading.Thread(target=mock_datasource.service, args=('admin', 'directory_v1'))
+             for _ in range(8)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert mock_credentials.refresh.call_count == 1
+
+  mock_credentials.access_token_expired = True
+  mock_credentials.refresh.side_effect = \
+      lambda http: setattr(mock_credentials, 'access_token_expired', False)
+  mock_datasource.service('admin', 'directory_v1')
+  mock_datasource.service('admin', 'directory_v1')
+  assert mock_credentials.refresh.call_count == 2
+
+
+@pytest.fixture(scope='function')
+def mock_directory(mock_datasource):
+  directory = mock.Mock()
+  mock_datasource.service = mock.Mock(return_value=directory)
+  return directory
+
+
+def test_prefetch_all_devices(mock_datasource, mock_directory, raw_devices):
+  listings = {
+    'mobiledevices': [raw_devices['android']],
+    'chromeosdevices': [raw_devices['chromeos'], raw_devices['chromeos_pixelbook']],
+  }
+  with mock.patch('stethoscope.plugins.sources.google.utils.execute_batch',
+                  side_effect=lambda resource, request, key: listings[key]) as execute_batch:
+    mock_datasource.prefetch_all_devices()
+    assert execute_batch.call_count == 2
+
+    assert len(mock_datasource._get_mobile_devices_by_email('User@Example.com')) == 1
+    assert len(mock_datasource._get_chromeos_devices_by_email('user@exmaple.com')) == 1
+    assert mock_datasource._get_mobile_devices_by_email('nobody@example.com') == []
+    assert execute_batch.call_count == 2
+
+
+def test_prefetch_devices_by_emails(mock_datasource, mock_directory, raw_devices):
+  def execute_batched(service, requests, batch_size):
+    assert sorted(requests) == ['chromeosdevices-0', 'chromeosdevices-1', 'mobiledevices-0',
+                                'mobiledevices-1']
+    return {
+      'mobiledevices-0': ({'mobiledevices': [raw_devices['android']]}, None),
+      'chromeosdevices-0': ({}, None),
+      'mobiledevices-1': (None, Exception('rate limited')),
+      'chromeosdevices-1': ({}, None),
+    }
+
+  with mock.patch('stethoscope.plugins.sources.google.utils.execute_batched',
+                  side_effect=execute_batched), \
+      mock.patch('stethoscope.plugins.sources.google.utils.execute_batch',
+                 return_value=[]) as execute_batch:
+    mock_datasource.prefetch_devices_by_emails(['user@example.com', 'other@example.com'])
+    assert mock_datasource.device_index.emails == set(['user@example.com'])
+
+    assert len(mock_datasource._get_mobile_devices_by_email('user@example.com')) == 1
+    assert execute_batch.call_count == 0
+    # failed prefetch: falls back to an individual lookup
+    mock_datasource._get_mobile_devices_by_email('other@example.com')
+    assert execute_batch.call_count == 1
+
+
+def login_activity(time, email='user@example.com', unique=None):
+  return {
+    'id': {'time': time, 'uniqueQualifier': unique if unique is not None else time},
+    'actor': {'email': email},
+    'ipAddress': '192.0.2.1',
+    'events': [{
+      'name': 'login_success',
+      'parameters': [{'name': 'login_type', 'value': 'google_password'}],
+    }],
+  }
+
+
+def test_event_journal(tmpdir):
+  config = {
+    'GOOGLE_API_SECRETS': '',
+    'GOOGLE_API_USERNAME': '',
+    'GOOGLE_API_SCOPES': '',
+    'GOOGLE_EVENT_JOURNAL': str(tmpdir.join('google')),
+  }
+  now = arrow.utcnow()
+  activities = [
+    login_activity(now.shift(hours=-1).isoformat()),
+    login_activity(now.shift(days=-2).isoformat()),
+  ]
+
+  def get_events(datasource, activities):
+    reports = mock.Mock()
+    datasource.service = mock.Mock(return_value=reports)
+    with mock.patch('stethoscope.plugins.sources.google.utils.execute_pages',
+                    return_value=[activities]):
+      events = stethoscope.plugins.sources.google.base.GoogleDataSourceBase.get_events_by_email(
+          datasource, 'User@example.com')
+    return events, reports.activities().list.call_args[1]
+
+  datasource = stethoscope.plugins.sources.google.deferred.DeferredGoogleDataSource(config)
+  events, kwargs = get_events(datasource, activities)
+  assert [event['timestamp'] for event in events] == [arrow.get(activities[0]['id']['time']),
+                                                      arrow.get(activities[1]['id']['time'])]
+  assert arrow.get(kwargs['startTime']) < now.shift(days=-29)
+  assert '_raw' not in events[0]
+
+  # after a restart, events are replayed from the journal and only recent ones are requested
+  datasource = stethoscope.plugins.sources.google.deferred.DeferredGoogleDataSource(config)
+  activities.insert(0, login_activity(now.isoformat()))
+  events, kwargs = get_events(datasource, activities[:2])
+  assert len(events) == 3
+  assert arrow.get(kwargs['startTime']) == arrow.get(activities[1]['id']['time']).shift(
+      seconds=-stethoscope.plugins.sources.google.base.DEFAULT_EVENT_POLL_LAG)
+
+
+def test_event_journal_paged(tmpdir):
+  datasource = stethoscope.plugins.sources.google.deferred.DeferredGoogleDataSource({
+    'GOOGLE_API_SECRETS': '',
+    'GOOGLE_API_USERNAME': '',
+    'GOOGLE_API_SCOPES': '',
+    'GOOGLE_EVENT_JOURNAL': str(tmpdir.join('google')),
+  })
+  reports = mock.Mock()
+  datasource.service = mock.Mock(return_value=reports)
+  now = arrow.utcnow()
+  activities = [login_activity(now.shift(hours=-hours).isoformat()) for hours in range(4)]
+
+  def get_events(**kwargs):
+    events = stethoscope.plugins.sources.google.base.GoogleDataSourceBase.get_events_by_email(
+        datasource, 'user@example.com', **kwargs)
+    return [event['timestamp'] for event in events]
+
+  with mock.patch('stethoscope.plugins.sources.google.utils.execute_pages',
+                  return_value=[activities[:2], activities[2:]]) as execute_pages:
+    # a short first page does not limit which events are stored for later lookups
+    assert get_events(limit=1) == [now]
+    assert get_events() == [now.shift(hours=-hours) for hours in range(4)]
+    assert 'endTime' not in reports.activities().list.call_args[1]
+
+    # later pages are requested from the reports API, ending at the previous page
+    execute_pages.return_value = [activities[1:]]
+    before = stethoscope.utils.PageCursor(now.shift(hours=-1), None)
+    assert get_events(before=before, limit=2) == [now.shift(hours=-2), now.shift(hours=-3)]
+    kwargs = reports.activities().list.call_args[1]
+    assert arrow.get(kwargs['endTime']) == before.timestamp.shift(microseconds=+1000)
+    assert 'startTime' not in kwargs
+
+
+def make_prefetch_datasource():
+  datasource = stethoscope.plugins.sources.google.deferred.DeferredGoogleDataSource({
+    'GOOGLE_API_SECRETS': '',
+    'GOOGLE_API_USERNAME': '',
+    'GOOGLE_API_SCOPES': '',
+    'GOOGLE_EVENT_PREFETCH': True,
+  })
+  datasource.service = mock.Mock(return_value=mock.Mock())
+  return datasource
+
+
+@pytest.fixture(scope='function')
+def prefetch_datasource():
+  return make_prefetch_datasource()
+
+
+def test_update_events(prefetch_datasource):
+  now = arrow.utcnow()
+  activities = [
+    login_activity(now.shift(minutes=-5).isoformat(), email='Fry@example.com'),
+    login_activity(now.shift(hours=-2).isoformat(), email='leela@example.com'),
+    login_activity(now.shift(days=-1).isoformat(), email='fry@example.com'),
+  ]
+  list_activities = prefetch_datasource.service().activities().list
+  with mock.patch('stethoscope.plugins.sources.google.utils.execute_pages',
+                  return_value=[activities[:2], activities[2:]]) as execute_pages:
+    prefetch_datasource.update_events()
+    assert list_activities.call_args[1]['userKey'] == 'all'
+    backfill_start = arrow.get(list_activities.call_args[1]['startTime'])
+    assert backfill_start < now.shift(days=-29)
+
+    events = prefetch_datasource._get_stored_events('fry@example.com', 500)
+    assert [event['timestamp'] for event in events] == [arrow.get(activities[0]['id']['time']),
+                                                        arrow.get(activities[2]['id']['time'])]
+    assert len(prefetch_datasource._get_stored_events('leela@example.com', 500)) == 1
+
+    # subsequent updates retrieve only events since shortly before the latest stored (for any
+    # user), including those made available late
+    late = login_activity(now.shift(minutes=-10).isoformat(), email='fry@example.com')
+    execute_pages.return_value = [activities[:1] + [late]]
+    prefetch_datasource.update_events()
+    assert arrow.get(list_activities.call_args[1]['startTime']) == \
+        arrow.get(activities[0]['id']['time']).shift(minutes=-60)
+    events = prefetch_datasource._get_stored_events('fry@example.com', 500)
+    assert [event['timestamp'] for event in events] == [arrow.get(activities[0]['id']['time']),
+                                                        arrow.get(late['id']['time']),
+                                                        arrow.get(activities[2]['id']['time'])]
+
+
+def test_store_events_at_same_time(prefetch_datasource):
+  now = arrow.utcnow().isoformat()
+  activities = [login_activity(now, unique='2'), login_activity(now, unique='1')]
+  assert prefetch_datasource._store_events(activities) == 2
+  assert prefetch_datasource._store_events(activities) == 0
+  events = prefetch_datasource._get_stored_events('user@example.com', 500)
+  assert [event['id'] for event in events] == ['2', '1']
+
+
+class DeferredGoogleEventPrefetchTestCase(twisted.trial.unittest.TestCase):
+
+  def setUp(self):
+    self.datasource = make_prefetch_datasource()
+    self.addCleanup(self.datasource.poller.stop)
+    self.activities = [login_activity(arrow.utcnow().isoformat(), email='fry@example.com')]
+    patcher = mock.patch('stethoscope.plugins.sources.google.utils.execute_pages',
+                         side_effect=lambda *args, **kwargs: [self.activities])
+    self.execute_pages = patcher.start()
+    self.addCleanup(patcher.stop)
+
+  @twisted.internet.defer.inlineCallbacks
+  def test_lookups_read_event_store(self):
+    events = yield twisted.internet.defer.gatherResults([
+      self.datasource.get_events_by_email('fry@example.com'),
+      self.datasource.get_events_by_email('leela@example.com'),
+    ])
+    self.assertEqual([len(user_events) for user_events in events], [1, 0])
+    events = yield self.datasource.get_events_by_email('Fry@example.com')
+    self.assertEqual(len(events), 1)
+    self.assertEqual(self.execute_pages.call_count, 1)
+
+
+def test_get_events_by_email_before(mock_datasource, mock_directory):
+  now = arrow.utcnow()
+  activities = [login_activity(now.isoformat()), login_activity(now.shift(hours=-1).isoformat())]
+  with mock.patch('stethoscope.plugins.sources.google.utils.execute_pages',
+                  return_value=[activities]):
+    events = stethoscope.plugins.sources.google.base.GoogleDataSourceBase.get_events_by_email(
+        mock_datasource, 'user@example.com', before=stethoscope.utils.PageCursor(now, None),
+        limit=10)
+  assert [event['timestamp'] for event in events] == [now.shift(hours=-1)]
+  kwargs = mock_directory.activities().list.call_args[1]
+  assert (arrow.get(kwargs['endTime']), kwargs['maxResults']) == (now.shift(microseconds=+1000), 10)
+
+
+def test_get_events_by_email_paged_at_same_time(mock_datasource, mock_directory):
+  now = arrow.utcnow()
+  activities = [
+    login_activity(now.isoformat(), unique='1'),
+    login_activity(now.isoformat(), unique='2'),
+    login_activity(now.shift(hours=-1).isoformat()),
+  ]
+  pages = list()
+  before = None
+  with mock.patch('stethoscope.plugins.sources.google.utils.execute_pages',
+                  return_value=[activities[:2], activities[2:]]):
+    for _ in range(4):
+      events = stethoscope.plugins.sources.google.base.GoogleDataSourceBase.get_events_by_email(
+          mock_datasource, 'user@example.com', before=before, limit=1)
+      pages.append([event['id'] for event in events])
+      if len(events) > 0:
+        before = stethoscope.utils.PageCursor(events[-1]['timestamp'], events[-1]['id'])
+  assert pages == [['2'], ['1'], [activities[2]['id']['uniqueQualifier']], []]
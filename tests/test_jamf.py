@@ -124,3 +124,39 @@ def test_process_basic_information_lgmd_pfry(device):
   assert set(device['identifiers']['mac_addresses']) == set(mac_addresses)
 
   assert device['source'] == 'jamf'
+
+
+def test_computer_path():
+  datasource = stethoscope.plugins.sources.jamf.deferred.DeferredJAMFDataSource({
+    'JAMF_API_USERNAME': '',
+    'JAMF_API_PASSWORD': '',
+    'JAMF_API_HOSTADDR': '',
+    'JAMF_PRACTICES': ['encryption', 'firewall'],
+    'JAMF_SOFTWARE': False,
+  })
+  assert datasource._computer_path('/computers/id/3001') == \
+      '/computers/id/3001/subset/General&Hardware&Location&ExtensionAttributes'
+
+  datasource.config['JAMF_SUBSET'] = False
+  assert datasource._computer_path('/computers/id/3001') == '/computers/id/3001'
+
+
+@pytest.mark.parametrize('filename', ["lgml-pfry", "lgmd-pfry"])
+def test_process_device_subset(filename):
+  datasource = stethoscope.plugins.sources.jamf.deferred.DeferredJAMFDataSource({
+    'JAMF_API_USERNAME': '',
+    'JAMF_API_PASSWORD': '',
+    'JAMF_API_HOSTADDR': '',
+    'JAMF_PRACTICES': ['encryption', 'firewall'],
+    'JAMF_SOFTWARE': False,
+  })
+  with open("tests/fixtures/jamf/{:s}.json".format(filename)) as fo:
+    raw = json.load(fo)
+  # only the sections requested in the subset are returned
+  raw['computer'] = dict((key, value) for key, value in six.iteritems(raw['computer'])
+                         if key in ('general', 'hardware', 'location', 'extension_attributes'))
+
+  device = datasource._process_device(raw)
+  assert set(device['practices']) == {'encryption', 'firewall'}
+  assert 'software' not in device
+  assert device['identifiers']['serial'] == raw['computer']['general']['serial_number']
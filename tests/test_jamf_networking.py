@@ -2,24 +2,42 @@
 
 from __future__ import absolute_import, print_function, unicode_literals
 
+import json
+import os
+import shutil
+import tempfile
+
 import mock
 import treq
-from twisted.internet.defer import succeed
+from twisted.internet import task
+from twisted.internet.defer import Deferred, succeed
 from twisted.trial import unittest
 
 import stethoscope.api.exceptions
 import stethoscope.api.utils
+import stethoscope.plugins.concurrency
+import stethoscope.plugins.metrics
 import stethoscope.plugins.sources.jamf.deferred
 
 
-class DeferredJAMFTestCase(unittest.TestCase):
+def deliver(body, collector, chunk_size=512):
+  """Pass `body` to `collector` in chunks, as `treq.collect` does as a response arrives."""
+  for start in range(0, len(body), chunk_size):
+    collector(body[start:start + chunk_size])
+
+
+class MockTreqMixin(object):
+
+  config = {}
 
   def setUp(self):
-    self.datasource = stethoscope.plugins.sources.jamf.deferred.DeferredJAMFDataSource({
+    config = {
       'JAMF_API_USERNAME': '',
       'JAMF_API_PASSWORD': '',
       'JAMF_API_HOSTADDR': '',
-    })
+    }
+    config.update(self.config)
+    self.datasource = stethoscope.plugins.sources.jamf.deferred.DeferredJAMFDataSource(config)
 
     self.treq = mock.patch('stethoscope.plugins.sources.jamf.deferred.treq', wraps=treq).start()
     self.addCleanup(mock.patch.stopall)
@@ -29,11 +47,15 @@ class DeferredJAMFTestCase(unittest.TestCase):
     response.code = code
 
     if body is not None:
-      self.treq.content.return_value = succeed(body)
+      self.treq.content.side_effect = lambda _: succeed(body)
+      self.treq.collect.side_effect = lambda _, collector: succeed(deliver(body, collector))
 
-    self.treq.get.return_value = succeed(response)
+    self.treq.get.side_effect = lambda *_args, **_kwargs: succeed(response)
     return response
 
+
+class DeferredJAMFTestCase(MockTreqMixin, unittest.TestCase):
+
   def test_userinfo_notfound(self):
     self.set_response(code=404)
     deferred = self.datasource.get_userinfo_by_email('user@example.com')
@@ -63,3 +85,176 @@ class DeferredJAMFTestCase(unittest.TestCase):
     self.set_response(code=500)
     deferred = self.datasource.get_devices_by_email('user@example.com')
     return self.failUnlessFailure(deferred, stethoscope.api.exceptions.InvalidResponseException)
+
+  def test_device_subset(self):
+    with open("tests/fixtures/jamf/lgml-pfry.json", 'rb') as fo:
+      body = fo.read()
+    self.set_response(body=body)
+    deferred = self.datasource._get_device_by_id(3002)
+
+    def check(device):
+      url = self.treq.get.call_args[0][0]
+      self.assertEqual(url, '/computers/id/3002/subset/'
+                       'General&Hardware&Location&ExtensionAttributes&Software')
+      self.assertEqual(device['serial'], self.datasource._process_device(
+          stethoscope.plugins.metrics.ResponseMetrics().decode_json(body))['serial'])
+
+      stats = self.datasource.response_metrics.stats()['device']
+      self.assertEqual(stats['responses'], 1)
+      self.assertEqual(stats['bytes'], len(body))
+
+    deferred.addCallback(check)
+    return deferred
+
+  def test_device_streaming(self):
+    with open("tests/fixtures/jamf/lgml-pfry.json", 'rb') as fo:
+      body = fo.read()
+    self.set_response(body=body)
+    deferred = self.datasource._get_device_by_id(4551)
+
+    def check(device):
+      # only the parts of the record which are used were decoded, but the result is the same
+      self.assertEqual(device, self.datasource._process_device(json.loads(body.decode('utf-8'))))
+
+    deferred.addCallback(check)
+    return deferred
+
+  def test_limit_covers_body(self):
+    with open("tests/fixtures/jamf/lgml-pfry.json", 'rb') as fo:
+      body = fo.read()
+    self.set_response(body=body)
+    received = Deferred()
+    self.treq.collect.side_effect = lambda _, collector: received.addCallback(
+      lambda _: deliver(body, collector))
+    self.datasource.limiter = stethoscope.plugins.concurrency.AdaptiveLimiter(1,
+        clock=task.Clock())
+
+    deferred = self.datasource._get_device_by_id(4551)
+    # the response has arrived, but its body hasn't, so the request still holds its slot
+    self.assertEqual(self.datasource.limiter.active, 1)
+    received.callback(None)
+    self.assertEqual(self.datasource.limiter.active, 0)
+    self.assertEqual(self.successResultOf(deferred),
+                     self.datasource._process_device(json.loads(body.decode('utf-8'))))
+
+  def test_prefetch_devices(self):
+    self.datasource.config['JAMF_ADVANCED_SEARCH_ID'] = 7
+    self.set_response(body=json.dumps({'advanced_computer_search': {'id': 7, 'computers': [
+      {'id': 3001, 'Email_Address': 'fry@example.com', 'Username': 'pfry',
+       'Serial_Number': 'C02', 'MAC_Address': '00:DE:CA:FB:AD:00'},
+      {'id': 3002, 'Email_Address': 'fry@example.com', 'Username': 'pfry'},
+      {'id': 3003, 'Email_Address': 'leela@example.com', 'Username': 'tleela'},
+    ]}}).encode('utf-8'))
+    deferred = self.datasource.prefetch_devices(['fry@example.com'] * 500)
+
+    def check(_):
+      self.assertEqual(self.treq.get.call_args[0][0], '/advancedcomputersearches/id/7')
+      index = self.datasource.computer_index
+      self.assertEqual(len(index), 3)
+
+      self.datasource._get_devices_by_id = mock.Mock(return_value=succeed([]))
+      self.datasource.get_devices_by_email('Fry@example.com')
+      self.datasource._get_devices_by_id.assert_called_with([3001, 3002])
+      self.datasource.get_devices_by_serial('C02')
+      self.datasource._get_devices_by_id.assert_called_with([3001])
+      # only the search itself was requested
+      self.assertEqual(self.treq.get.call_count, 1)
+
+      # users missing from the search are resolved individually
+      self.datasource.get_userinfo_by_email = mock.Mock(return_value=succeed(
+        {'user': {'links': {'computers': [{'id': 3004}]}}}))
+      self.datasource.get_devices_by_email('bender@example.com')
+      self.datasource.get_userinfo_by_email.assert_called_with('bender@example.com')
+      self.datasource._get_devices_by_id.assert_called_with([3004])
+
+    deferred.addCallback(check)
+    return deferred
+
+  def test_prefetch_devices_below_threshold(self):
+    self.datasource.config['JAMF_ADVANCED_SEARCH_ID'] = 7
+    deferred = self.datasource.prefetch_devices(['fry@example.com'])
+    deferred.addCallback(self.assertIsNone)
+    deferred.addCallback(lambda _: self.assertFalse(self.treq.get.called))
+    return deferred
+
+
+class DeferredJAMFDeviceStoreTestCase(MockTreqMixin, unittest.TestCase):
+
+  def setUp(self):
+    directory = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, directory)
+    self.config = {'JAMF_DEVICE_STORE': os.path.join(directory, 'devices.jsonl')}
+    super(DeferredJAMFDeviceStoreTestCase, self).setUp()
+    with open("tests/fixtures/jamf/lgml-pfry.json", 'rb') as fo:
+      self.body = fo.read()
+    self.report_date = json.loads(self.body.decode('utf-8'))['computer']['general'][
+        'report_date_utc']
+
+  def test_device_reused_if_unchanged(self):
+    self.set_response(body=self.body)
+    deferred = self.datasource._get_device_by_id(4551)
+
+    def check_unchanged(device):
+      self.assertEqual(self.treq.get.call_count, 1)
+      self.datasource.report_dates[4551] = self.report_date
+      _deferred = self.datasource._get_device_by_id(4551)
+      _deferred.addCallback(self.assertEqual, device)
+      _deferred.addCallback(lambda _: self.assertEqual(self.treq.get.call_count, 1))
+      return _deferred
+    deferred.addCallback(check_unchanged)
+
+    def check_changed(_):
+      self.datasource.report_dates[4551] = '2016-03-01T09:00:00.000-0800'
+      _deferred = self.datasource._get_device_by_id(4551)
+      _deferred.addCallback(lambda _: self.assertEqual(self.treq.get.call_count, 2))
+      return _deferred
+    deferred.addCallback(check_changed)
+
+    def check_stats(_):
+      stats = self.datasource.device_store.stats()
+      self.assertEqual((stats['hits'], stats['misses'], stats['stale']), (1, 1, 1))
+    deferred.addCallback(check_stats)
+    return deferred
+
+  def test_report_date_checked_without_prefetch(self):
+    self.set_response(body=self.body)
+    deferred = self.datasource._get_device_by_id(4551)
+
+    def check(device):
+      _deferred = self.datasource._get_device_by_id(4551)
+      _deferred.addCallback(self.assertEqual, device)
+      # only the General subset was requested the second time
+      _deferred.addCallback(lambda _: self.assertEqual(self.treq.get.call_args[0][0],
+                                                       '/computers/id/4551/subset/General'))
+      return _deferred
+    deferred.addCallback(check)
+    return deferred
+
+  def test_prefetch_report_dates(self):
+    self.datasource.device_store.put(4551, self.report_date, {'serial': 'C02'})
+    self.datasource.device_store.put(3001, self.report_date, {'serial': 'C03'})
+    self.set_response(body=json.dumps({'computers': [
+      {'id': 4551, 'report_date_utc': self.report_date},
+    ]}).encode('utf-8'))
+    deferred = self.datasource.prefetch_devices(None)
+
+    def check(_):
+      self.assertEqual(self.treq.get.call_args[0][0], '/computers/subset/basic')
+      self.assertEqual(self.datasource.report_dates, {4551: self.report_date})
+      # computers no longer in JAMF are dropped from the store
+      self.assertIn(4551, self.datasource.device_store)
+      self.assertNotIn(3001, self.datasource.device_store)
+    deferred.addCallback(check)
+    return deferred
+
+  def test_saved_across_instances(self):
+    self.set_response(body=self.body)
+    deferred = self.datasource._get_device_by_id(4551)
+
+    def check(device):
+      self.datasource.save_state()
+      datasource = stethoscope.plugins.sources.jamf.deferred.DeferredJAMFDataSource(
+          self.datasource.config)
+      self.assertEqual(datasource.device_store.get(4551, self.report_date), device)
+    deferred.addCallback(check)
+    return deferred
@@ -0,0 +1,85 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import io
+import os
+
+import arrow
+import pytest
+
+import stethoscope.plugins.events
+import stethoscope.plugins.journal
+
+
+@pytest.fixture
+def journal(tmpdir):
+  return stethoscope.plugins.journal.EventJournal(str(tmpdir.join('journal')),
+      segment_seconds=100)
+
+
+def replayed(journal, **kwargs):
+  records = list()
+  journal.replay(lambda user, timestamp, event: records.append((user, timestamp, event)), **kwargs)
+  return records
+
+
+def test_segments(journal):
+  for timestamp in (10, 150, 160, 320):
+    journal.append('pfry', timestamp, {'timestamp': arrow.get(timestamp), '_raw': {}})
+  journal.flush()
+  assert journal.segments() == [0, 100, 300]
+
+  records = replayed(journal)
+  assert [timestamp for _, timestamp, _ in records] == [10, 150, 160, 320]
+  assert records[0][2] == {'timestamp': arrow.get(10)}
+
+  assert [timestamp for _, timestamp, _ in replayed(journal, since=155)] == [160, 320]
+
+
+def test_compact(journal):
+  for timestamp in (10, 150, 320):
+    journal.append('pfry', timestamp, {})
+  journal.compact(cutoff=250)
+  assert journal.segments() == [300]
+  # the current segment may be deleted, too
+  journal.compact(cutoff=500)
+  assert journal.segments() == []
+  journal.append('pfry', 520, {})
+  assert journal.segments() == [500]
+  assert journal.stats()['compacted'] == 3
+
+
+def test_truncated_line(journal):
+  journal.append('pfry', 10, {'id': 1})
+  journal.close()
+  with io.open(os.path.join(journal.path, '0.jsonl'), 'a', encoding='utf-8') as fo:
+    fo.write('{"user": "tleela", "timest')
+  assert [event for _, _, event in replayed(journal)] == [{'id': 1}]
+
+
+def test_event_store_rebuilt(journal):
+  now = [1000]
+
+  def create_store():
+    return stethoscope.plugins.events.EventStore(retention=500, clock=lambda: now[0],
+        journal=journal, key=lambda event: event['id'])
+
+  store = create_store()
+  store.add('pfry', 400, {'id': 1})
+  store.add('tleela', 700, {'id': 2})
+  store.add('pfry', 900, {'id': 3})
+  store.flush()
+
+  now[0] = 1100
+  store = create_store()
+  assert [event['id'] for event in store.get('pfry')] == [3]
+  assert store.latest == 900
+  # replayed events are recognized when retrieved again
+  assert not store.add_new('pfry', 900, {'id': 3})
+  assert store.add_new('pfry', 900, {'id': 4})
+
+  # evicting for age deletes segments
+  now[0] = 1350
+  assert store.get('tleela') == []
+  assert journal.segments() == [900]
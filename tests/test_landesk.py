@@ -3,6 +3,7 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
 import datetime
+import re
 
 import arrow
 import pytest
@@ -145,6 +146,208 @@ def test_process_device(raw_dict, mock_datasource):
   check_processed_device(mock_datasource._process_device(raw_dict))
 
 
+def test_process_device_vulnerability_practices(raw_dict, mock_datasource):
+  practices = mock_datasource._process_device(raw_dict)['practices']
+  assert practices['screenlock'] == {
+    'value': False,
+    'details': "  • The screen saver is not enabled for user: zoidberg.",
+    'last_updated': arrow.get(raw_dict['sw_last_scan_date'], 'US/Pacific'),
+  }
+  assert practices['autoupdate']['value'] is True
+  assert 'details' not in practices['autoupdate']
+  assert practices['uptodate']['value'] is False
+  assert practices['uptodate']['details'] == ("Missing Updates:\n"
+      "    Java SE Runtime Environment 8 Update 92 (JRE 8u92)\n")
+
+
+def test_process_device_configured_vulnerability_rules(raw_dict):
+  datasource = stethoscope.plugins.sources.landesk.base.LandeskSQLDataSourceBase({
+    'LANDESK_SQL_USERNAME': '',
+    'LANDESK_SQL_PASSWORD': '',
+    'LANDESK_SQL_HOSTNAME': '',
+    'LANDESK_SQL_HOSTPORT': 12345,
+    'LANDESK_SQL_DATABASE': '',
+    'LANDESK_VULN_RULES': {
+      'uptodate': None,
+      'java': {'vul_ids': ['JAVAv8u92'], 'details': 'titles'},
+    },
+  })
+  practices = datasource._process_device(raw_dict)['practices']
+  assert 'uptodate' not in practices
+  assert practices['java']['value'] is False
+  assert practices['screenlock']['value'] is False
+
+
+class RecordedConnection(object):
+  """Stand-in for an `_mssql` connection which answers queries from recorded rows.
+
+  `tables` maps table names to rows; queries are answered with the rows of the table named in their
+  ``FROM`` clause, restricted to the computer IDs passed as parameters (if any).
+  """
+
+  def __init__(self, tables, queries=None):
+    self.tables = tables
+    self.queries = queries if queries is not None else list()
+    self._rows = iter([])
+
+  def execute_query(self, query, params=None):
+    self.queries.append((query, params))
+    match = re.search(r'SELECT (?:DISTINCT )?(.*?)\s+FROM (\w+)', query, re.DOTALL)
+    columns, table = match.group(1).split(', '), match.group(2)
+    rows = self.tables[table]
+    if params is not None and table != 'Computer':
+      ids = params if isinstance(params, tuple) else (params,)
+      rows = [row for row in rows if row['Computer_Idn'] in ids]
+    if table != 'Computer' and columns != ['*']:
+      # (projected) columns missing from the recorded rows are NULL
+      rows = [dict((column, row.get(column)) for column in columns) for row in rows]
+    self._rows = iter([dict(row) for row in rows])
+
+  def __iter__(self):
+    return self._rows
+
+  def close(self):
+    pass
+
+
+@pytest.fixture
+def recorded_tables(raw_row, adapters, vulns):
+  row = dict(raw_row, email='zoidberg@example.com')
+  other_row = dict(row, Computer_Idn=67890, serial='0xF005BA11', name='LGWL-BENDER',
+                   email='Bender@example.com')
+  return {
+    'Computer': [row, other_row],
+    'CVDetectedV': [dict(vuln, Computer_Idn=12345) for vuln in vulns],
+    'BoundAdapter': [dict(adapter, Computer_Idn=12345) for adapter in adapters] + [
+      {'Computer_Idn': 67890, 'FirewallEnabled': 'Yes', 'PhysAddress': '00000BADF00D'},
+    ],
+    'AppSoftwareSuites': [
+      {'Computer_Idn': 12345, 'InstallDate': '20161004', 'Publisher': 'SentinelOne',
+       'SuiteName': 'Sentinel Agent', 'Version': '1.6.2.5020'},
+      {'Computer_Idn': 67890, 'InstallDate': None, 'Publisher': 'Carbon Black, Inc.',
+       'SuiteName': 'Carbon Black Sensor', 'Version': '6.0.061114'},
+    ],
+  }
+
+
+def get_recorded_devices(tables, **config):
+  config.update({
+    'LANDESK_SQL_USERNAME': '',
+    'LANDESK_SQL_PASSWORD': '',
+    'LANDESK_SQL_HOSTNAME': '',
+    'LANDESK_SQL_HOSTPORT': 12345,
+    'LANDESK_SQL_DATABASE': '',
+  })
+  datasource = stethoscope.plugins.sources.landesk.base.LandeskSQLDataSourceBase(config)
+  conn = RecordedConnection(tables)
+  conn.execute_query("SELECT * FROM Computer")
+  return datasource._get_devices_by_email(conn), conn.queries[1:]
+
+
+def test_get_devices_by_email_set_queries(recorded_tables):
+  devices, queries = get_recorded_devices(recorded_tables)
+  assert len(queries) == 3
+  assert all(params[:2] == (12345, 67890) for _, params in queries)
+  # only vulnerabilities matched by a rule are requested
+  assert 'ST000202' in queries[0][1]
+  assert 'Critical' in queries[0][1]
+
+  assert [device['serial'] for device in devices] == ['0xDECAFBAD', '0xF005BA11']
+  assert devices[0]['practices']['screenlock']['value'] is False
+  assert devices[0]['practices']['firewall']['value'] is False
+  assert devices[1]['practices']['screenlock']['value'] is True
+  assert devices[1]['practices']['firewall']['value'] is True
+  assert devices[1]['identifiers']['mac_addresses'] == ['00:00:0B:AD:F0:0D']
+  assert devices[1]['software']['installed'] == [{'install_date': None,
+    'name': 'Carbon Black Sensor', 'publisher': 'Carbon Black, Inc.', 'version': '6.0.061114'}]
+
+
+def test_get_devices_by_email_set_queries_match_per_device_queries(recorded_tables):
+  devices, queries = get_recorded_devices(recorded_tables, LANDESK_SET_QUERIES=False)
+  assert len(queries) == 6
+  assert get_recorded_devices(recorded_tables)[0] == devices
+
+
+def test_get_devices_by_email_set_queries_chunked(recorded_tables):
+  devices, queries = get_recorded_devices(recorded_tables, LANDESK_IN_CHUNK_SIZE=1)
+  assert [params[:1] for _, params in queries] == [(12345,), (67890,)] * 3
+  assert get_recorded_devices(recorded_tables)[0] == devices
+
+
+def test_get_devices_by_email_without_vulnerability_rules(recorded_tables):
+  devices, queries = get_recorded_devices(recorded_tables, LANDESK_VULN_RULES={
+    'screenlock': None, 'autoupdate': None, 'uptodate': None})
+  assert len(queries) == 2
+  assert 'CVDetectedV' not in ''.join(query for query, _ in queries)
+  assert all(set(device['practices']) == {'encryption', 'firewall'} for device in devices)
+
+
+def test_get_devices_by_email_set_queries_no_devices(recorded_tables):
+  recorded_tables['Computer'] = []
+  assert get_recorded_devices(recorded_tables) == ([], [])
+
+
+def get_recorded_datasource(tables, queries=None, **config):
+  config.update({
+    'LANDESK_SQL_USERNAME': '',
+    'LANDESK_SQL_PASSWORD': '',
+    'LANDESK_SQL_HOSTNAME': '',
+    'LANDESK_SQL_HOSTPORT': 12345,
+    'LANDESK_SQL_DATABASE': '',
+  })
+  datasource = stethoscope.plugins.sources.landesk.base.LandeskSQLDataSourceBase(config)
+  datasource.connection_pool.connect = lambda: RecordedConnection(tables, queries)
+  return datasource
+
+
+def test_get_devices_by_email_reuses_pooled_connection(recorded_tables):
+  datasource = get_recorded_datasource(recorded_tables)
+
+  for _ in range(2):
+    assert len(datasource.get_devices_by_email('zoidberg@example.com')) == 2
+  stats = datasource.connection_pool.stats()
+  assert stats['opened'] == 1
+  assert stats['reused'] == 1
+
+
+@pytest.mark.parametrize('pool_size', [1, 4])
+def test_prefetch_all_devices(recorded_tables, pool_size):
+  queries = list()
+  datasource = get_recorded_datasource(recorded_tables, queries, LANDESK_POOL_SIZE=pool_size,
+                                       LANDESK_IN_CHUNK_SIZE=1)
+  index = datasource.prefetch_devices()
+  assert len(index) == 2
+  # one scan of the fleet, then one query per table per chunk
+  assert len(queries) == 1 + 3 * 2
+
+  del queries[:]
+  devices = datasource.get_devices_by_email('bender@example.com')
+  assert [device['serial'] for device in devices] == ['0xF005BA11']
+  assert datasource.get_devices_by_email('nobody@example.com') == []
+  assert len(queries) == 0
+
+
+def test_prefetch_devices_for_emails(recorded_tables):
+  queries = list()
+  datasource = get_recorded_datasource(recorded_tables, queries, LANDESK_BULK_THRESHOLD=1)
+  index = datasource.prefetch_devices(['Zoidberg@example.com'])
+  assert list(index.devices) == ['zoidberg@example.com']
+  assert [params[0] for _, params in queries[1:]] == [12345] * 3
+
+  del queries[:]
+  assert len(datasource.get_devices_by_email('zoidberg@example.com')) == 1
+  assert len(queries) == 0
+  # users not prefetched are looked up individually
+  datasource.get_devices_by_email('bender@example.com')
+  assert len(queries) == 4
+
+
+def test_prefetch_devices_below_threshold(recorded_tables):
+  datasource = get_recorded_datasource(recorded_tables)
+  assert datasource.prefetch_devices(['zoidberg@example.com']) is None
+  assert datasource.device_index is None
+
+
 # def test_get_devices_by_email(raw_row, mock_datasource):
 #   conn = mock.Mock(side_effect=[raw_row, None, adapters, None, vulns])
 #   returned = mock_datasource.get_devices_by_email(conn)
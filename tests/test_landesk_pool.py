@@ -0,0 +1,209 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import threading
+import time
+
+import pytest
+
+import stethoscope.plugins.sources.landesk.pool
+
+
+class FakeConnection(object):
+  """Stand-in for an `_mssql` connection."""
+
+  def __init__(self, healthy=True):
+    self.connected = True
+    self.healthy = healthy
+    self.pings = 0
+
+  def execute_scalar(self, query):
+    self.pings += 1
+    if not self.healthy:
+      raise Exception("connection reset")
+    return 1
+
+  def close(self):
+    self.connected = False
+
+
+class Clock(object):
+
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+
+@pytest.fixture
+def clock():
+  return Clock()
+
+
+@pytest.fixture
+def pool(clock):
+  return stethoscope.plugins.sources.landesk.pool.ConnectionPool(FakeConnection, max_size=2,
+      max_lifetime=600, max_idle=60, ping_after=10, timeout=0.1, discard_on=(IOError,),
+      clock=clock)
+
+
+def test_connections_are_reused(pool):
+  with pool.connection() as first:
+    pass
+  with pool.connection() as second:
+    pass
+  assert first is second
+
+  stats = pool.stats()
+  assert stats['checkouts'] == 2
+  assert stats['opened'] == 1
+  assert stats['reused'] == 1
+  assert stats['size'] == 1
+  assert stats['idle'] == 1
+
+
+def test_pool_is_bounded(pool):
+  first = pool.checkout()
+  second = pool.checkout()
+  assert pool.stats()['in_use'] == 2
+
+  with pytest.raises(stethoscope.plugins.sources.landesk.pool.PoolTimeoutError):
+    pool.checkout()
+  assert pool.stats()['waits'] == 1
+
+  pool.checkin(first)
+  assert pool.checkout() is first
+  pool.checkin(second)
+
+
+def test_waiting_thread_gets_returned_connection():
+  pool = stethoscope.plugins.sources.landesk.pool.ConnectionPool(FakeConnection, max_size=1,
+      timeout=5)
+  conn = pool.checkout()
+  result = dict()
+
+  def wait():
+    result['conn'] = pool.checkout()
+
+  thread = threading.Thread(target=wait)
+  thread.start()
+  time.sleep(0.05)
+  pool.checkin(conn)
+  thread.join(5)
+
+  assert result['conn'] is conn
+  stats = pool.stats()
+  assert stats['waits'] == 1
+  assert stats['max_wait_time'] > 0
+  assert stats['opened'] == 1
+
+
+def test_connection_is_discarded_after_exception(pool):
+  with pytest.raises(IOError):
+    with pool.connection() as conn:
+      raise IOError()
+  assert not conn.connected
+
+  stats = pool.stats()
+  assert stats['discarded'] == 1
+  assert stats['size'] == 0
+
+
+def test_connection_is_kept_after_other_exceptions(pool):
+  for _ in range(3):
+    with pytest.raises(KeyError):
+      with pool.connection() as conn:
+        raise KeyError()
+    assert conn.connected
+
+  stats = pool.stats()
+  assert stats['opened'] == 1
+  assert stats['reused'] == 2
+  assert stats['discarded'] == 0
+  assert stats['idle'] == 1
+
+
+def test_connections_expire_after_max_lifetime(pool, clock):
+  with pool.connection() as first:
+    pass
+  clock.now += 601
+  with pool.connection() as second:
+    pass
+  assert first is not second
+  assert not first.connected
+  assert pool.stats()['reaped'] == 1
+
+  # connections older than their lifetime are also closed when they are returned
+  conn = pool.checkout()
+  clock.now += 601
+  pool.checkin(conn)
+  stats = pool.stats()
+  assert stats['expired'] == 1
+  assert stats['size'] == 0
+
+
+def test_idle_connections_are_reaped(pool, clock):
+  with pool.connection() as conn:
+    pass
+  pool.reap()
+  assert pool.stats()['idle'] == 1
+
+  clock.now += 61
+  pool.reap()
+  assert not conn.connected
+  stats = pool.stats()
+  assert stats['reaped'] == 1
+  assert stats['size'] == 0
+
+
+def test_idle_connections_are_health_checked(pool, clock):
+  with pool.connection() as conn:
+    pass
+  with pool.connection():
+    pass
+  assert conn.pings == 0
+
+  clock.now += 11
+  with pool.connection():
+    pass
+  assert conn.pings == 1
+
+  conn.healthy = False
+  clock.now += 11
+  with pool.connection() as replacement:
+    pass
+  assert replacement is not conn
+  stats = pool.stats()
+  assert stats['unhealthy'] == 1
+  assert stats['size'] == 1
+
+
+def test_failed_connect_releases_slot(clock):
+  attempts = list()
+
+  def connect():
+    attempts.append(None)
+    if len(attempts) == 1:
+      raise Exception("login failed")
+    return FakeConnection()
+
+  pool = stethoscope.plugins.sources.landesk.pool.ConnectionPool(connect, max_size=1, timeout=0.1,
+      clock=clock)
+  with pytest.raises(Exception):
+    pool.checkout()
+  with pool.connection() as conn:
+    assert conn.connected
+  assert pool.stats()['opened'] == 1
+
+
+def test_close(pool):
+  with pool.connection() as idle:
+    busy = pool.checkout()
+  pool.close()
+  assert not idle.connected
+
+  pool.checkin(busy)
+  assert not busy.conn.connected
+  assert pool.stats()['size'] == 0
@@ -0,0 +1,100 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import pytest
+
+import stethoscope.plugins.sources.landesk.rules
+
+
+VULNS = [
+  {'Vul_ID': 'JAVAv8u92', 'VulType': 'Vulnerability', 'VulSeverity': 'Critical'},
+  {'Vul_ID': 'ST000202', 'VulType': 'Security Threat', 'VulSeverity': 'High'},
+  {'Vul_ID': 'FLASH23', 'VulType': 'Vulnerability', 'VulSeverity': 'Low'},
+  {'Vul_ID': 'MS16-001', 'VulType': 'Vulnerability', 'VulSeverity': 'High'},
+  {'Vul_ID': 'ST000003v2', 'VulType': 'Security Threat', 'VulSeverity': 'Medium'},
+]
+
+
+def ids(vulns):
+  return [vuln['Vul_ID'] for vuln in vulns]
+
+
+@pytest.mark.parametrize('single_pass', [False, True])
+def test_default_rules(single_pass):
+  rules = stethoscope.plugins.sources.landesk.rules.RuleSet(
+    stethoscope.plugins.sources.landesk.rules.DEFAULT_RULES, single_pass=single_pass)
+  matches = rules.evaluate(VULNS)
+  assert ids(matches['screenlock']) == ['ST000202']
+  assert ids(matches['autoupdate']) == ['ST000003v2']
+  # matches keep the order in which the vulnerabilities were given
+  assert ids(matches['uptodate']) == ['JAVAv8u92', 'MS16-001']
+
+
+@pytest.mark.parametrize('single_pass', [False, True])
+def test_no_vulnerabilities(single_pass):
+  rules = stethoscope.plugins.sources.landesk.rules.RuleSet(
+    stethoscope.plugins.sources.landesk.rules.DEFAULT_RULES, single_pass=single_pass)
+  assert rules.evaluate([]) == {'screenlock': [], 'autoupdate': [], 'uptodate': []}
+
+
+@pytest.mark.parametrize('single_pass', [False, True])
+def test_wildcard_rules(single_pass):
+  rules = stethoscope.plugins.sources.landesk.rules.RuleSet({
+    'threats': {'types': ['Security Threat']},
+    'high': {'severities': ['High']},
+    'java': {'vul_ids': ['JAVAv8u92', 'JAVAv8u101']},
+  }, single_pass=single_pass)
+  matches = rules.evaluate(VULNS)
+  assert ids(matches['threats']) == ['ST000202', 'ST000003v2']
+  assert ids(matches['high']) == ['ST000202', 'MS16-001']
+  assert ids(matches['java']) == ['JAVAv8u92']
+
+
+@pytest.mark.parametrize('single_pass', [False, True])
+def test_rules_sharing_a_vulnerability(single_pass):
+  rules = stethoscope.plugins.sources.landesk.rules.RuleSet({
+    'first': {'vul_ids': ['FLASH23']},
+    'second': {'vul_ids': ['FLASH23']},
+    'low': {'types': ['Vulnerability'], 'severities': ['Low']},
+  }, single_pass=single_pass)
+  matches = rules.evaluate(VULNS)
+  assert ids(matches['first']) == ids(matches['second']) == ids(matches['low']) == ['FLASH23']
+
+
+def test_single_pass_for_many_rules():
+  rules = stethoscope.plugins.sources.landesk.rules.DEFAULT_RULES
+  assert not stethoscope.plugins.sources.landesk.rules.RuleSet(rules).single_pass
+
+  rules = dict(rules)
+  rules.update(('av-{:d}'.format(idx), {'vul_ids': ['AV-{:d}'.format(idx)]}) for idx in range(10))
+  assert stethoscope.plugins.sources.landesk.rules.RuleSet(rules).single_pass
+
+
+def test_sql_filter():
+  condition, params = stethoscope.plugins.sources.landesk.rules.RuleSet({
+    'threats': {'types': ['Security Threat']},
+    'high': {'severities': ['High', 'Critical']},
+    'java': {'vul_ids': ['JAVAv8u92']},
+  }).sql_filter()
+  assert condition == "Vul_ID IN (%s) OR (VulSeverity IN (%s, %s)) OR (VulType IN (%s))"
+  assert params == ('JAVAv8u92', 'High', 'Critical', 'Security Threat')
+
+  assert stethoscope.plugins.sources.landesk.rules.RuleSet({}).sql_filter() == ('', ())
+
+
+def test_invalid_rule():
+  with pytest.raises(ValueError):
+    stethoscope.plugins.sources.landesk.rules.RuleSet({'everything': {'details': 'titles'}})
+
+
+def test_get_rules_does_not_modify_defaults():
+  rules = stethoscope.plugins.sources.landesk.rules.get_rules({
+    'LANDESK_SCREENLOCK_VULN_ID': 'ST000999',
+    'LANDESK_VULN_RULES': {'autoupdate': {'vul_ids': ['ST000004']}},
+  })
+  assert rules['screenlock']['vul_ids'] == ['ST000999']
+  assert rules['autoupdate'] == {'vul_ids': ['ST000004']}
+  defaults = stethoscope.plugins.sources.landesk.rules.DEFAULT_RULES
+  assert defaults['screenlock']['vul_ids'] == ['ST000202']
+  assert defaults['autoupdate']['vul_ids'] == ['ST000003v2']
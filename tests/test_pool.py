@@ -0,0 +1,62 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import treq
+from twisted.internet import defer
+from twisted.trial import unittest
+from twisted.web import resource, server
+
+import stethoscope.plugins.pool
+
+
+class HelloResource(resource.Resource):
+
+  isLeaf = True
+
+  def render_GET(self, request):
+    return b'hello'
+
+
+class MeteredConnectionPoolTestCase(unittest.TestCase):
+
+  def setUp(self):
+    from twisted.internet import reactor
+    self.port = reactor.listenTCP(0, server.Site(HelloResource()), interface='127.0.0.1')
+    self.url = 'http://127.0.0.1:{:d}/'.format(self.port.getHost().port)
+    self.pool = stethoscope.plugins.pool.MeteredConnectionPool(reactor, name='test')
+
+  @defer.inlineCallbacks
+  def tearDown(self):
+    yield self.pool.closeCachedConnections()
+    yield self.port.stopListening()
+
+  @defer.inlineCallbacks
+  def test_reuses_connections(self):
+    for _ in range(3):
+      response = yield treq.get(self.url, pool=self.pool)
+      content = yield treq.content(response)
+      self.assertEqual(content, b'hello')
+
+    stats = self.pool.stats()
+    self.assertEqual(stats['requests'], 3)
+    self.assertEqual(stats['connections'], 1)
+    self.assertEqual(stats['reused'], 2)
+    self.assertEqual(stats['idle'], 1)
+    self.assertEqual(stats['hosts'], {'http://127.0.0.1': {'requests': 3, 'connections': 1,
+      'reused': 2}})
+
+
+class GetPoolTestCase(unittest.TestCase):
+
+  def tearDown(self):
+    pool = stethoscope.plugins.pool._pools.pop('test', None)
+    if pool is not None:
+      return pool.closeCachedConnections()
+
+  def test_configured_and_shared(self):
+    pool = stethoscope.plugins.pool.get_pool('test', {'HTTP_MAX_PERSISTENT_PER_HOST': 4,
+      'HTTP_IDLE_TIMEOUT': 30})
+    self.assertEqual(pool.maxPersistentPerHost, 4)
+    self.assertEqual(pool.cachedConnectionTimeout, 30)
+    self.assertIs(stethoscope.plugins.pool.get_pool('test', {}), pool)
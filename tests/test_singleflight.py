@@ -0,0 +1,48 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import mock
+from twisted.internet import defer
+from twisted.trial import unittest
+
+import stethoscope.plugins.singleflight
+
+
+class SingleFlightTestCase(unittest.TestCase):
+
+  def setUp(self):
+    self.single_flight = stethoscope.plugins.singleflight.SingleFlight()
+    self.pending = defer.Deferred()
+    self.func = mock.Mock(return_value=self.pending)
+
+  def test_coalesces(self):
+    first = self.single_flight.call('foo', self.func, 'foo')
+    second = self.single_flight.call('foo', self.func, 'foo')
+    self.assertIn('foo', self.single_flight)
+    self.assertEqual(self.func.call_count, 1)
+    self.func.return_value = defer.succeed([{'serial': 'bar'}])
+    self.assertEqual(self.successResultOf(self.single_flight.call('bar', self.func, 'bar')),
+                     [{'serial': 'bar'}])
+
+    self.pending.callback([{'serial': 'foo'}])
+    first, second = self.successResultOf(first), self.successResultOf(second)
+    self.assertEqual(first, [{'serial': 'foo'}])
+    self.assertEqual(second, [{'serial': 'foo'}])
+    self.assertIsNot(first[0], second[0])
+    self.assertEqual(self.single_flight.stats(), {'calls': 2, 'coalesced': 1, 'in_flight': 0})
+
+  def test_not_cached(self):
+    self.func.return_value = defer.succeed([])
+    self.successResultOf(self.single_flight.call('foo', self.func, 'foo'))
+    self.successResultOf(self.single_flight.call('foo', self.func, 'foo'))
+    self.assertEqual(self.func.call_count, 2)
+    self.assertNotIn('foo', self.single_flight)
+
+  def test_failure(self):
+    first = self.single_flight.call('foo', self.func, 'foo')
+    second = self.single_flight.call('foo', self.func, 'foo')
+    self.pending.errback(RuntimeError())
+    self.failureResultOf(first, RuntimeError)
+    self.failureResultOf(second, RuntimeError)
+    self.assertNotIn('foo', self.single_flight)
@@ -0,0 +1,68 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import arrow
+
+import stethoscope.plugins.store
+
+
+def test_round_trip(tmpdir):
+  path = str(tmpdir.join('devices.jsonl'))
+  device = {'serial': 'C02', 'last_sync': arrow.get('2016-06-03T14:35:13+00:00')}
+
+  store = stethoscope.plugins.store.DeviceStore(path, fingerprint='v1')
+  store.put(3001, '2016-06-03 14:35:13', device)
+  store.save()
+
+  store = stethoscope.plugins.store.DeviceStore(path, fingerprint='v1')
+  assert '3001' in store
+  assert store.get('3001', '2016-06-03 14:35:13') == device
+  assert store.get(3001, '2016-06-03 14:35:13')['last_sync'] == device['last_sync']
+
+
+def test_copies(tmpdir):
+  store = stethoscope.plugins.store.DeviceStore(str(tmpdir.join('devices.jsonl')))
+  device = {'practices': {}}
+  store.put(1, 'a', device)
+  device['practices']['encryption'] = {'status': 'ok'}
+  store.get(1, 'a')['practices']['firewall'] = {'status': 'warn'}
+  assert store.get(1, 'a') == {'practices': {}}
+
+
+def test_stats(tmpdir):
+  store = stethoscope.plugins.store.DeviceStore(str(tmpdir.join('devices.jsonl')))
+  assert store.stats()['hit_rate'] is None
+
+  store.put(1, 'a', {})
+  store.get(1, 'a')
+  store.get(1, 'b')
+  store.get(2, 'a')
+  stats = store.stats()
+  assert (stats['hits'], stats['stale'], stats['misses']) == (1, 1, 1)
+  assert stats['entries'] == 1
+  assert stats['hit_rate'] == 1.0 / 3
+
+
+def test_unchanged_store_not_written(tmpdir):
+  path = tmpdir.join('devices.jsonl')
+  stethoscope.plugins.store.DeviceStore(str(path)).save()
+  assert not path.exists()
+
+
+def test_retain(tmpdir):
+  path = str(tmpdir.join('devices.jsonl'))
+  store = stethoscope.plugins.store.DeviceStore(path)
+  for key in (3001, 3002, 3003):
+    store.put(key, 'a', {'id': key})
+  store.save()
+
+  assert store.retain([3001, '3003']) == 1
+  assert store.retain([3001, 3003]) == 0
+  assert store.stats()['pruned'] == 1
+  store.save()
+
+  store = stethoscope.plugins.store.DeviceStore(path)
+  assert len(store) == 2
+  assert 3002 not in store
+  assert store.get(3003, 'a') == {'id': 3003}
@@ -0,0 +1,78 @@
+# vim: set fileencoding=utf-8 :
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+import json
+
+import pytest
+
+import stethoscope.plugins.streaming
+
+
+DOCUMENT = {
+  'computer': {
+    'general': {'id': 4551, 'name': 'lgml-pfry', 'report_date_utc': '2016-02-26T10:58:57.853-0800'},
+    'hardware': {'model': 'MacBook Pro', 'storage': [{'drive_capacity_mb': 500277}]},
+    'fonts': [{'name': 'Helvetica', 'version': '1.0'}] * 100,
+    'software': {
+      'applications': [{'name': 'Café.app', 'version': 1.5, 'bundle_size': 12345678}] * 20,
+      'available_software_updates': [],
+    },
+    'flags': [True, False, None, -0.5e-3],
+  },
+}
+
+SPEC = {'computer': {
+  'general': ('id', 'report_date_utc'),
+  'hardware': True,
+  'software': {'applications': [('name', 'version')]},
+  'flags': True,
+}}
+
+EXPECTED = {'computer': {
+  'general': {'id': 4551, 'report_date_utc': '2016-02-26T10:58:57.853-0800'},
+  'hardware': DOCUMENT['computer']['hardware'],
+  'software': {'applications': [{'name': 'Café.app', 'version': 1.5}] * 20},
+  'flags': [True, False, None, -0.5e-3],
+}}
+
+
+def decode(body, spec, chunk_size):
+  decoder = stethoscope.plugins.streaming.StreamingJSONDecoder(spec)
+  for start in range(0, len(body), chunk_size):
+    decoder.feed(body[start:start + chunk_size])
+  return decoder.close()
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 64, 1 << 20])
+def test_chunk_boundaries(chunk_size):
+  body = json.dumps(DOCUMENT, indent=2, ensure_ascii=False).encode('utf-8')
+  assert decode(body, SPEC, chunk_size) == EXPECTED
+  assert decode(body, True, chunk_size) == DOCUMENT
+
+
+def test_numbers_split_across_chunks():
+  decoded = decode(b'{"a": 12345, "b": [6.25]}', {'a': True, 'b': [True]}, 2)
+  assert decoded == {'a': 12345, 'b': [6.25]}
+  assert decode(b'12345', True, 2) == 12345
+  assert decode(b"[-0.0005, 1e-3]", True, 1) == [-0.0005, 1e-3]
+
+
+def test_unexpected_types_kept():
+  assert decode(b'{"a": null, "b": "c"}', {'a': {'x': True}, 'b': [True]}, 4) == {'a': None,
+                                                                                  'b': 'c'}
+
+
+def test_size():
+  decoder = stethoscope.plugins.streaming.StreamingJSONDecoder()
+  decoder.feed(b'{"a": ')
+  decoder.feed(b'1}')
+  assert decoder.close() == {'a': 1}
+  assert decoder.size == 8
+
+
+@pytest.mark.parametrize('body', [b'', b'{"a": 1', b'{"a": 1}}', b'{"a" 1}', b'{"a": [1 2]}',
+                                  b'{"a": tru}', b'[1, ]'])
+def test_invalid(body):
+  with pytest.raises(ValueError):
+    decode(body, {'a': [True]}, 2)